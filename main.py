@@ -1,4 +1,5 @@
 from modules.FlaskAppHandler import FlaskAppHandler
+from modules.WSGIServer import WSGIServer
 from modules.Config import Config
 import time
 import os
@@ -15,9 +16,12 @@ if __name__ == '__main__':
     root_directory = os.path.abspath("./songs/")
     #root_directory = os.path.abspath("./songs/ignore/")
 
-    flask_app = FlaskAppHandler(config=config,
-                                host="0.0.0.0",
-                                port=5731,
-                                root_directory=root_directory
-                                )
-    flask_app.run()
\ No newline at end of file
+    def create_app_handler(start_background_services: bool) -> FlaskAppHandler:
+        return FlaskAppHandler(config=config,
+                               host="0.0.0.0",
+                               port=5731,
+                               root_directory=root_directory,
+                               start_background_services=start_background_services
+                               )
+
+    WSGIServer(config=config, create_app_handler=create_app_handler, host="0.0.0.0", port=5731).run()
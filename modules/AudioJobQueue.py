@@ -0,0 +1,223 @@
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from modules.Music.Song import Song
+from modules.SQLiteConnector import SQLiteConnector
+from modules.utils.AudioUtils import SAMPLE_FILE_NAME, convert_audio_to_ogg, export_sample_ogg
+
+logger = logging.getLogger(__name__)
+
+JOB_KIND_TRANSCODE = "transcode"
+JOB_KIND_SAMPLE = "sample"
+
+
+class AudioJobQueue:
+    def __init__(self,
+                 sqlite_db_connector: SQLiteConnector,
+                 max_workers: int = 2,
+                 max_attempts: int = 3,
+                 retry_delay_seconds: float = 30.0,
+                 start: bool = True):
+        """
+        Runs ogg conversions and sample creation in the background, so the song scan does not wait for audio decoding.
+
+        Job state is persisted in the audio_jobs table. A job that keeps failing is given up on after max_attempts,
+        and is not retried on later scans unless its source audio file changes.
+
+        :param sqlite_db_connector: The connector used to persist job state.
+        :param max_workers: The number of jobs that run at the same time.
+        :param max_attempts: The number of attempts made before a job is marked as failed.
+        :param retry_delay_seconds: The delay before the first retry. Later retries wait proportionally longer.
+        :param start: Whether to run jobs as soon as they are submitted. If False, they wait until start is called,
+                      e.g. so a process that forks after the scan does not start job threads before forking.
+        """
+        self.sqlite_db_connector = sqlite_db_connector
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="AudioJob")
+        # Serializes job state changes, which are written from the worker threads
+        self._lock = threading.Lock()
+        self._queued_target_paths = set()
+        # Target path -> the songs waiting for its job. A rescan creates new Song objects for a job already queued.
+        self._songs_by_target_path: Dict[str, List[Song]] = {}
+        # Every target path a job was queued for, so changes to those files are known to be the queue's own
+        self._target_paths = set()
+        self._retry_timers: Dict[str, threading.Timer] = {}
+        self._started = start
+        self._jobs_waiting_for_start: List[tuple] = []
+
+    def start(self):
+        """
+        Runs the jobs submitted before the queue was started, and every job submitted from now on.
+        """
+        with self._lock:
+            self._started = True
+            jobs, self._jobs_waiting_for_start = self._jobs_waiting_for_start, []
+        for job_args in jobs:
+            self.executor.submit(self._run, *job_args)
+
+    def submit_song_jobs(self, song: Song):
+        """
+        Queues the jobs a song still needs: converting its audio to ogg and creating its sample.
+        The song is updated in place once a job completes, or once it fails for good.
+        """
+        if song.pending_ogg_audio_file_path:
+            if not self.submit(kind=JOB_KIND_TRANSCODE,
+                               song=song,
+                               source_path=song.audio_file_path,
+                               target_path=song.pending_ogg_audio_file_path):
+                # The original audio keeps being served
+                song.pending_ogg_audio_file_path = None
+
+        if not song.directory_index.exists(SAMPLE_FILE_NAME):
+            song.sample_pending = self.submit(kind=JOB_KIND_SAMPLE,
+                                              song=song,
+                                              source_path=song.audio_file_path,
+                                              target_path=os.path.join(song.directory, SAMPLE_FILE_NAME))
+
+    def submit(self, kind: str, song: Song, source_path: str, target_path: str) -> bool:
+        """
+        :return: Whether a job for the target path is queued, either by this call or by an earlier one.
+                 The song is updated when that job completes or fails for good.
+        """
+        with self._lock:
+            if target_path in self._queued_target_paths:
+                self._songs_by_target_path.setdefault(target_path, []).append(song)
+                return True
+            try:
+                source_last_modified = os.path.getmtime(source_path)
+            except OSError as e:
+                logger.error(f"Not queueing {kind} job for {target_path}: {e}")
+                return False
+
+            attempts = 0
+            job = self.sqlite_db_connector.get_audio_job(target_path)
+            if job and job['source_last_modified'] == source_last_modified:
+                if job['status'] == "failed" and job['attempts'] >= self.max_attempts:
+                    logger.warning(f"Not retrying {kind} job for {target_path}, which failed {job['attempts']} times: "
+                                   f"{job['last_error']}")
+                    return False
+                attempts = job['attempts']
+
+            self.sqlite_db_connector.upsert_audio_job(target_path=target_path,
+                                                      kind=kind,
+                                                      source_path=source_path,
+                                                      source_last_modified=source_last_modified,
+                                                      status="pending",
+                                                      attempts=attempts)
+            self._queued_target_paths.add(target_path)
+            self._target_paths.add(os.path.abspath(target_path))
+            self._songs_by_target_path[target_path] = [song]
+            job_args = (kind, song, source_path, target_path, source_last_modified, attempts)
+            if not self._started:
+                self._jobs_waiting_for_start.append(job_args)
+                return True
+        self.executor.submit(self._run, *job_args)
+        return True
+
+    def is_job_output(self, path: str) -> bool:
+        """
+        :return: Whether the file is written by a job of this queue, or is the partial file of one.
+        """
+        path = os.path.abspath(path)
+        if path.endswith(".part"):
+            path = path[:-len(".part")]
+        with self._lock:
+            return path in self._target_paths
+
+    def _run(self, kind: str, song: Song, source_path: str, target_path: str, source_last_modified: float, attempts: int):
+        self._update_job(kind, source_path, target_path, source_last_modified, "running", attempts)
+        # Write to a temporary file first, so a partially written file is never served
+        partial_target_path = f"{target_path}.part"
+        try:
+            if kind == JOB_KIND_TRANSCODE:
+                convert_audio_to_ogg(source_path, partial_target_path)
+            else:
+                export_sample_ogg(audio_file_path=source_path,
+                                  sample_path=partial_target_path,
+                                  sample_start=song.sample_start,
+                                  sample_length=song.sample_length)
+            os.replace(partial_target_path, target_path)
+        except Exception as e:
+            if os.path.exists(partial_target_path):
+                os.remove(partial_target_path)
+            attempts += 1
+            # Unsupported formats will not succeed on a retry
+            if isinstance(e, ValueError) or attempts >= self.max_attempts:
+                logger.error(f"{kind} job for {target_path} failed after {attempts} attempts: {e}")
+                self._update_job(kind, source_path, target_path, source_last_modified, "failed", attempts, str(e))
+                # The songs fall back to the original audio, or to no sample
+                for waiting_song in self._finish(target_path):
+                    if kind == JOB_KIND_TRANSCODE:
+                        waiting_song.pending_ogg_audio_file_path = None
+                    else:
+                        waiting_song.sample_pending = False
+            else:
+                delay = self.retry_delay_seconds * attempts
+                logger.warning(f"{kind} job for {target_path} failed, retrying in {delay:.0f}s: {e}")
+                self._update_job(kind, source_path, target_path, source_last_modified, "pending", attempts, str(e))
+                self._schedule_retry(delay, kind, song, source_path, target_path, source_last_modified, attempts)
+            return
+
+        self._update_job(kind, source_path, target_path, source_last_modified, "done", attempts)
+
+        target_file_name = os.path.basename(target_path)
+        for waiting_song in self._finish(target_path):
+            waiting_song.directory_index.add(target_file_name)
+            if kind == JOB_KIND_TRANSCODE:
+                waiting_song.audio_file_path = target_path
+                waiting_song.audio_file_name = target_file_name
+                waiting_song.pending_ogg_audio_file_path = None
+            else:
+                waiting_song.sample_pending = False
+        if kind == JOB_KIND_TRANSCODE:
+            logger.info(f"Converted {source_path} to {target_path}")
+        else:
+            logger.info(f"Created a sample file for the song {song.name} in {song.directory}")
+
+    def _finish(self, target_path: str) -> List[Song]:
+        """
+        Marks the job for the target path as no longer queued.
+
+        :return: The songs that were waiting for it.
+        """
+        with self._lock:
+            self._queued_target_paths.discard(target_path)
+            return self._songs_by_target_path.pop(target_path, [])
+
+    def _schedule_retry(self, delay: float, *job_args):
+        target_path = job_args[3]
+        timer = threading.Timer(delay, self._retry, args=job_args)
+        timer.daemon = True
+        with self._lock:
+            self._retry_timers[target_path] = timer
+        timer.start()
+
+    def _retry(self, *job_args):
+        with self._lock:
+            self._retry_timers.pop(job_args[3], None)
+        self.executor.submit(self._run, *job_args)
+
+    def _update_job(self, kind: str, source_path: str, target_path: str, source_last_modified: float,
+                    status: str, attempts: int, last_error: Optional[str] = None):
+        with self._lock:
+            self.sqlite_db_connector.upsert_audio_job(target_path=target_path,
+                                                      kind=kind,
+                                                      source_path=source_path,
+                                                      source_last_modified=source_last_modified,
+                                                      status=status,
+                                                      attempts=attempts,
+                                                      last_error=last_error)
+
+    def shutdown(self):
+        """
+        Stops the queue. Unfinished jobs stay pending in the database and are queued again by the next scan.
+        """
+        with self._lock:
+            for timer in self._retry_timers.values():
+                timer.cancel()
+            self._retry_timers.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,127 @@
+import json
+import logging
+from typing import List
+
+from modules.Music.Group import Group
+from modules.Music.Song import Song
+from modules.Music.Chart import Chart
+
+logger = logging.getLogger(__name__)
+
+# Field widths of the resonite format, in characters
+VERSION_WIDTH = 8
+GROUP_COUNT_WIDTH = 4
+GROUP_NAME_WIDTH = 64
+SONG_COUNT_WIDTH = 4
+TITLE_WIDTH = 64
+ARTIST_WIDTH = 64
+BPM_WIDTH = 24
+DURATION_WIDTH = 8
+CHART_COUNT_WIDTH = 2
+CHART_MODE_WIDTH = 1
+DIFFICULTY_NAME_WIDTH = 10
+DIFFICULTY_LEVEL_WIDTH = 2
+NOTE_COUNT_WIDTH = 5
+
+
+def format_text_field(value, width: int) -> str:
+    """
+    Pads or truncates a value to exactly width characters.
+    Newlines are replaced with spaces, and characters outside the Basic Multilingual Plane with "?",
+    since Resonite counts them as two characters when taking substrings.
+    """
+    text = "" if value is None else str(value)
+    text = text.replace("\r", " ").replace("\n", " ")
+    text = "".join(c if ord(c) <= 0xFFFF else "?" for c in text)
+    return f"{text:<{width}}"[:width]
+
+
+def format_number_field(value: int, width: int) -> str:
+    """
+    Zero-pads a number to exactly width digits, clamping it to the largest number that fits.
+    """
+    return str(max(0, min(int(value or 0), 10 ** width - 1))).zfill(width)
+
+
+class Catalog:
+    def __init__(self, groups: List[Group], version: int):
+        """
+        The metadata of all groups, songs and charts, so the song wheel can be built from a single request
+        instead of one request per group name, song title, artist, details and chart levels.
+
+        Built once per scan, in both formats, and replaced (with a new version) when the songs are rescanned.
+
+        The resonite format is a concatenation of fixed-width fields, read in this order:
+        - Header: version (8 digits), group count (4 digits)
+        - Per group: display name (64), song count (4 digits)
+        - Per song: title (64), artist (64), BPM display (24), duration (8), chart count (2 digits)
+        - Per chart: mode (1, "S" or "D"), difficulty name (10), level (2 digits), note count (5 digits)
+        Text fields are padded with spaces. Indices are positional, as in the other routes.
+        A single group is served as the version (8 digits) followed by the group's fields.
+
+        :param groups: The groups, in the order the routes index them.
+        :param version: The version of the catalog, incremented on every rescan.
+        """
+        self.version = version
+        self.group_count = len(groups)
+
+        version_field = format_number_field(version, VERSION_WIDTH)
+        group_dicts = [self.get_group_dict(group) for group in groups]
+        group_resonite_strings = [self.get_group_resonite_string(group) for group in groups]
+
+        self.json = json.dumps({"version": version, "groups": group_dicts}, ensure_ascii=False)
+        self.resonite_string = version_field + format_number_field(len(groups), GROUP_COUNT_WIDTH) + "".join(group_resonite_strings)
+        # The responses of the single group route
+        self.group_json = [json.dumps({"version": version, "group": group_dict}, ensure_ascii=False)
+                           for group_dict in group_dicts]
+        self.group_resonite_strings = [version_field + group_resonite_string
+                                       for group_resonite_string in group_resonite_strings]
+        logger.info(f"Built catalog version {version} with {len(groups)} groups.")
+
+    @staticmethod
+    def get_group_dict(group: Group) -> dict:
+        return {
+            "name": group.name,
+            "display_name": group.display_name,
+            "songs": [Catalog.get_song_dict(song) for song in group.songs],
+        }
+
+    @staticmethod
+    def get_song_dict(song: Song) -> dict:
+        return {
+            "guid": song.song_id,
+            "title": song.title,
+            "artist": song.artist,
+            "details": song.details,
+            "bpm_display": song.bpm_display,
+            "duration": song.duration_str,
+            "chart_levels": song.chart_levels,
+            "charts": [Catalog.get_chart_dict(chart) for chart in song.charts],
+        }
+
+    @staticmethod
+    def get_chart_dict(chart: Chart) -> dict:
+        return {
+            "guid": chart.chart_id,
+            "mode": chart.mode,
+            "difficulty": chart.difficulty_name,
+            "level": chart.difficulty_level,
+            "note_count": chart.note_count,
+        }
+
+    @staticmethod
+    def get_group_resonite_string(group: Group) -> str:
+        parts = [format_text_field(group.display_name, GROUP_NAME_WIDTH),
+                 format_number_field(len(group.songs), SONG_COUNT_WIDTH)]
+        for song in group.songs:
+            parts.append(format_text_field(song.title, TITLE_WIDTH))
+            parts.append(format_text_field(song.artist, ARTIST_WIDTH))
+            parts.append(format_text_field(song.bpm_display, BPM_WIDTH))
+            parts.append(format_text_field(song.duration_str, DURATION_WIDTH))
+            parts.append(format_number_field(len(song.charts), CHART_COUNT_WIDTH))
+            for chart in song.charts:
+                parts.append(format_text_field("D" if chart.is_double_chart else "S", CHART_MODE_WIDTH))
+                parts.append(format_text_field(chart.difficulty_name, DIFFICULTY_NAME_WIDTH))
+                parts.append(format_number_field(chart.difficulty_level, DIFFICULTY_LEVEL_WIDTH))
+                parts.append(format_number_field(chart.note_count, NOTE_COUNT_WIDTH))
+        return "".join(parts)
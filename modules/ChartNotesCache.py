@@ -0,0 +1,92 @@
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from modules.SQLiteConnector import SQLiteConnector
+
+logger = logging.getLogger(__name__)
+
+# The compressed resonite string, its compression format, and the string compressed with brotli (or None)
+ChartNotes = Tuple[bytes, int, Optional[bytes]]
+
+
+class ChartNotesNotFoundError(Exception):
+    """
+    Raised by a chart whose notes are no longer in the database, e.g. after a rescan replaced the chart.
+    """
+
+
+class ChartNotesCache:
+    def __init__(self, sqlite_db_connector: SQLiteConnector, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Reads the notes of charts (their compressed resonite strings) from the database when they are requested,
+        and keeps the most recently used ones, up to max_bytes in total.
+        Charts only keep their metadata in memory, so memory use follows the charts being played, not the library.
+
+        Chart GUIDs change whenever a chart's SM file does, so cached notes never go stale.
+
+        :param sqlite_db_connector: The connector the notes are read with.
+        :param max_bytes: The maximum total size of the cached notes. 0 disables the cache.
+        """
+        self.sqlite_db_connector = sqlite_db_connector
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, ChartNotes]" = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _get_size(notes: ChartNotes) -> int:
+        compressed_string, _, brotli_string = notes
+        return len(compressed_string) + (len(brotli_string) if brotli_string is not None else 0)
+
+    def get(self, chart_guid: str) -> Optional[ChartNotes]:
+        """
+        :return: The chart's notes, or None if the chart is not in the database.
+        """
+        with self._lock:
+            notes = self._entries.get(chart_guid)
+            if notes is not None:
+                self._entries.move_to_end(chart_guid)
+                self.hits += 1
+                return notes
+            self.misses += 1
+
+        # Read outside of the lock, so a slow read does not hold up hits. Concurrent misses may both read the notes.
+        notes = self.sqlite_db_connector.get_chart_notes(chart_guid)
+        if notes is None:
+            logger.warning(f"The notes of chart {chart_guid} are not in the database.")
+            return None
+        size = self._get_size(notes)
+        if size > self.max_bytes:
+            return notes
+
+        with self._lock:
+            if chart_guid not in self._entries:
+                self._entries[chart_guid] = notes
+                self._size_bytes += size
+                while self._size_bytes > self.max_bytes:
+                    _, evicted_notes = self._entries.popitem(last=False)
+                    self._size_bytes -= self._get_size(evicted_notes)
+                    self.evictions += 1
+        return notes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries),
+                    "size_bytes": self._size_bytes,
+                    "max_bytes": self.max_bytes,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
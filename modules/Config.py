@@ -9,5 +9,82 @@ class Config:
         self.config = configparser.ConfigParser()
         self.config.read(self.config_file_path)
 
-        self.mongodb_uri = self.config.get('database', 'uri')
-        self.sample_audio_filename = self.config.get('io', 'sample_audio_filename')
\ No newline at end of file
+        # Where scores and settings are kept: "mongodb" (the cluster at the database uri), or "sqlite"
+        # (a local database, for a single server). python -m modules.ScoreStoreMigration copies them between the two.
+        self.score_store_backend = self.config.get('scores', 'backend', fallback='mongodb')
+        # The database file of the sqlite backend. Defaults to reso-dmx-scores.sqlite3 next to reso-dmx.sqlite3.
+        self.score_store_sqlite_path = self.config.get('scores', 'sqlite_path', fallback=None)
+        # Only needed by the mongodb backend
+        self.mongodb_uri = self.config.get('database', 'uri', fallback=None)
+        # MongoDB connection pool of each process. Each server thread holds at most one connection at a time.
+        self.mongodb_max_pool_size = self.config.getint('database', 'max_pool_size', fallback=20)
+        self.mongodb_min_pool_size = self.config.getint('database', 'min_pool_size', fallback=0)
+        # How long an operation waits for a reachable server, for a connection to open, and for a reply
+        self.mongodb_server_selection_timeout_ms = self.config.getint('database', 'server_selection_timeout_ms',
+                                                                      fallback=2000)
+        self.mongodb_connect_timeout_ms = self.config.getint('database', 'connect_timeout_ms', fallback=2000)
+        self.mongodb_socket_timeout_ms = self.config.getint('database', 'socket_timeout_ms', fallback=5000)
+        # After this many consecutive failed operations, MongoDB is considered unreachable: operations fail right away,
+        # scores are spooled and reads are served from the caches, until a trial operation succeeds.
+        self.mongodb_circuit_failure_threshold = self.config.getint('database', 'circuit_failure_threshold', fallback=3)
+        # How long to wait after MongoDB became unreachable before a trial operation
+        self.mongodb_circuit_reset_seconds = self.config.getfloat('database', 'circuit_reset_seconds', fallback=30.0)
+        self.sample_audio_filename = self.config.get('io', 'sample_audio_filename')
+        # Number of worker processes used to ingest new or changed songs. 1 ingests serially.
+        self.ingest_workers = self.config.getint('io', 'ingest_workers', fallback=1)
+        # Engine used to precalculate chart beats: "python", "numpy", or "auto" to use numpy if it is installed.
+        self.timing_engine = self.config.get('io', 'timing_engine', fallback='auto')
+        # Whether to convert audio to ogg and create samples in the background instead of during the scan.
+        self.background_audio_jobs = self.config.getboolean('io', 'background_audio_jobs', fallback=True)
+        self.audio_job_workers = self.config.getint('io', 'audio_job_workers', fallback=2)
+        # Whether to watch the songs directory and rescan changed groups while the server is running.
+        self.watch_songs_directory = self.config.getboolean('io', 'watch_songs_directory', fallback=False)
+        # Poll the songs directory instead of using inotify, e.g. for network mounts that do not report changes.
+        self.watch_use_polling = self.config.getboolean('io', 'watch_use_polling', fallback=False)
+        self.watch_poll_interval_seconds = self.config.getfloat('io', 'watch_poll_interval_seconds', fallback=10.0)
+        # The songs database file. Defaults to reso-dmx.sqlite3 in the project directory.
+        self.sqlite_path = self.config.get('sqlite', 'path', fallback=None)
+        # SQLite connection tuning. Each thread gets its own connection to the database, which is in WAL mode.
+        self.sqlite_busy_timeout_seconds = self.config.getfloat('sqlite', 'busy_timeout_seconds', fallback=30.0)
+        self.sqlite_cache_size_kib = self.config.getint('sqlite', 'cache_size_kib', fallback=65536)
+        self.sqlite_mmap_size_bytes = self.config.getint('sqlite', 'mmap_size_bytes', fallback=268435456)
+        self.sqlite_synchronous = self.config.get('sqlite', 'synchronous', fallback='NORMAL')
+        # How long clients and proxies may reuse song and chart responses before revalidating them with their ETag
+        self.http_cache_max_age_seconds = self.config.getint('http', 'cache_max_age_seconds', fallback=0)
+        # How long clients and proxies may reuse an asset (audio, sample, jacket, background) fetched by a versioned URL.
+        # The URL changes when the file does, so these responses are marked immutable.
+        self.http_asset_max_age_seconds = self.config.getint('http', 'asset_max_age_seconds', fallback=31536000)
+        # Let a front-end server (e.g. Apache mod_xsendfile, or nginx with X-Accel-Redirect mapping) send asset files
+        # instead of the app. Without it, full asset responses use the WSGI server's sendfile support if it has any.
+        self.http_use_x_sendfile = self.config.getboolean('http', 'use_x_sendfile', fallback=False)
+        # The WSGI server main.py runs the app with: "gunicorn", "waitress", "flask" (the development server),
+        # or "auto" to use the first of gunicorn and waitress that is installed.
+        self.server = self.config.get('server', 'server', fallback='auto')
+        # gunicorn worker processes. With more than one, the songs are scanned once before forking and shared by the workers.
+        self.server_workers = self.config.getint('server', 'workers', fallback=1)
+        # Threads handling requests in each worker process
+        self.server_threads = self.config.getint('server', 'threads', fallback=8)
+        self.server_timeout_seconds = self.config.getint('server', 'timeout_seconds', fallback=120)
+        # Whether to acknowledge score submissions once they are spooled to SQLite, and write them to MongoDB in batches.
+        # Otherwise, scores are only spooled while MongoDB is unreachable. Not used by the sqlite backend.
+        self.scores_write_behind = self.config.getboolean('scores', 'write_behind', fallback=True)
+        self.scores_flush_interval_seconds = self.config.getfloat('scores', 'flush_interval_seconds', fallback=5.0)
+        # The number of pending scores that triggers a flush before the interval is over
+        self.scores_flush_threshold = self.config.getint('scores', 'flush_threshold', fallback=100)
+        # How long user settings and scores read from MongoDB are cached. 0 disables a cache.
+        # A change made by another server worker to the scores or settings of a user drops them on the next read.
+        self.settings_cache_ttl_seconds = self.config.getfloat('cache', 'settings_ttl_seconds', fallback=300.0)
+        self.scores_cache_ttl_seconds = self.config.getfloat('cache', 'scores_ttl_seconds', fallback=60.0)
+        self.cache_max_entries = self.config.getint('cache', 'max_entries', fallback=10000)
+        # How long a user's personal bests on a group's charts are cached. A score submitted by the user drops them
+        # right away, in other server workers on the next read of the user's personal bests. They are not cached
+        # while the score store is unavailable.
+        self.personal_bests_cache_ttl_seconds = self.config.getfloat('cache', 'personal_bests_ttl_seconds', fallback=60.0)
+        # The maximum total size of the compressed chart notes kept in memory. Charts only keep their metadata,
+        # and the notes of the charts being played are read from the song database and kept up to this size.
+        self.chart_notes_cache_max_bytes = self.config.getint('cache', 'chart_notes_max_bytes', fallback=64 * 1024 * 1024)
+        # How long a chart's leaderboard is kept in memory before it is loaded again from the scores.
+        # Scores submitted to this process update it right away, scores submitted to other workers once it is reloaded.
+        self.leaderboards_max_age_seconds = self.config.getfloat('leaderboards', 'max_age_seconds', fallback=60.0)
+        # The maximum number of chart leaderboards kept in memory
+        self.leaderboards_max_charts = self.config.getint('leaderboards', 'max_charts', fallback=2000)
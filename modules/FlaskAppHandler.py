@@ -1,19 +1,33 @@
 from flask import Flask, jsonify, abort, make_response, url_for, send_from_directory, request
 from modules.Music.Group import Group
-from modules.Music.Song import Song
-from modules.Music.Group import find_songs
-from modules.utils.FileUtils import read_file_with_encodings
+from modules.Music.Song import Song, format_personal_best, PERSONAL_BEST_WIDTH
+from modules.Music.Group import find_songs, rescan_groups
+from modules.LibraryWatcher import LibraryWatcher
+from modules.Catalog import Catalog
+from modules.AudioJobQueue import AudioJobQueue
+from modules.ScoreBuffer import ScoreBuffer
+from modules.Leaderboards import Leaderboards
+from modules.ChartNotesCache import ChartNotesCache, ChartNotesNotFoundError
+from modules.utils.FileUtils import read_file_with_encodings, get_file_version
+from modules.utils.TTLCache import TTLCache
 from modules.Music.Beat import precalculate_beats, get_beats_as_resonite_string
+from modules.Music.ChartEncoding import encode_compact
 from modules.Config import Config
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Set, Dict, Callable, Union
+from natsort import natsorted
 import logging
 import os
 import time
+import threading
 from modules.utils.Loggers import configure_console_logger
 
 logger = logging.getLogger(__name__)
-from modules.MongoDBClient import MongoDBClient
+from modules.ScoreStore import create_score_store, ScoreStoreUnavailableError
 from modules.SQLiteConnector import SQLiteConnector
+from modules.SQLiteConnectionManager import SQLiteConnectionManager
+
+# The song files served by /assets/<guid>/<file_type>
+FILE_TYPES = ("jacket", "background", "sample", "audio")
 
 
 def validate_params(params):
@@ -28,22 +42,93 @@ def validate_params(params):
 
 
 class FlaskAppHandler:
-    def __init__(self, config: Config, host='0.0.0.0', base_url="http://servers.ikubaysan.com", port=5731, root_directory='./songs'):
+    def __init__(self, config: Config, host='0.0.0.0', base_url="http://servers.ikubaysan.com", port=5731, root_directory='./songs',
+                 start_background_services: bool = True):
+        """
+        Scans the songs and sets up the routes.
+
+        :param start_background_services: Whether to start the audio job queue and the library watcher now.
+                                          If False, start_background_services must be called, e.g. in the worker
+                                          process when the app is built before forking.
+        """
         self.app = Flask(__name__)
         self.host = host
         self.base_url = base_url
         self.config = config
-        self.mongodb_client = MongoDBClient(self.config)
-        self.sqlite_db_connector = SQLiteConnector(db_path=os.path.join(os.path.dirname(__file__), "../reso-dmx.sqlite3"),
-                                                   mongodb_client=self.mongodb_client)
+        self.app.config["USE_X_SENDFILE"] = self.config.http_use_x_sendfile
+        self.score_store = create_score_store(self.config)
+        sqlite_db_path = self.config.sqlite_path or os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                                                 "../reso-dmx.sqlite3"))
+        sqlite_connection_manager = SQLiteConnectionManager(db_path=sqlite_db_path,
+                                                            busy_timeout_seconds=self.config.sqlite_busy_timeout_seconds,
+                                                            cache_size_kib=self.config.sqlite_cache_size_kib,
+                                                            mmap_size_bytes=self.config.sqlite_mmap_size_bytes,
+                                                            synchronous=self.config.sqlite_synchronous)
+        self.sqlite_db_connector = SQLiteConnector(db_path=sqlite_db_path,
+                                                   score_store=self.score_store,
+                                                   connection_manager=sqlite_connection_manager)
         self.port = port
         self.root_directory = root_directory
 
+        self.score_buffer = None
+        # Without write-behind, the buffer still spools the scores submitted while the remote store is unreachable
+        if self.score_store.is_remote:
+            self.score_buffer = ScoreBuffer(sqlite_db_connector=self.sqlite_db_connector,
+                                            score_store=self.score_store,
+                                            flush_interval_seconds=self.config.scores_flush_interval_seconds,
+                                            flush_threshold=self.config.scores_flush_threshold,
+                                            write_behind=self.config.scores_write_behind,
+                                            start=start_background_services)
+        # Scores are added and read through the buffer if there is one, so pending scores are read back
+        self.scores = self.score_buffer or self.score_store
+        # User ID -> the user's score revision (see SQLiteConnector.record_score_changes) when this process last
+        # checked it, to drop the scores of the user it cached once another server worker changed them
+        self.score_revisions = TTLCache(max_entries=self.config.cache_max_entries,
+                                        ttl_seconds=max(self.config.scores_cache_ttl_seconds,
+                                                        self.config.personal_bests_cache_ttl_seconds))
+        # User ID -> the user's settings revision when this process last checked it, like score_revisions
+        self.settings_revisions = TTLCache(max_entries=self.config.cache_max_entries,
+                                           ttl_seconds=self.config.settings_cache_ttl_seconds)
+        # User ID -> {Group: the user's personal bests on the group's charts}, dropped when the user submits a score
+        # to this process, or when drop_stale_cached_scores finds one submitted to another
+        self.personal_bests_cache = TTLCache(max_entries=self.config.cache_max_entries,
+                                             ttl_seconds=self.config.personal_bests_cache_ttl_seconds)
+        self.leaderboards = Leaderboards(load_chart_scores=self.scores.get_chart_scores,
+                                         max_age_seconds=self.config.leaderboards_max_age_seconds,
+                                         max_charts=self.config.leaderboards_max_charts)
+        self.chart_notes_cache = ChartNotesCache(sqlite_db_connector=self.sqlite_db_connector,
+                                                 max_bytes=self.config.chart_notes_cache_max_bytes)
+
+        self.audio_job_queue = None
+        if self.config.background_audio_jobs:
+            self.audio_job_queue = AudioJobQueue(sqlite_db_connector=self.sqlite_db_connector,
+                                                 max_workers=self.config.audio_job_workers,
+                                                 start=start_background_services)
+
         self.all_groups, self.single_groups, self.double_groups = find_songs(
                                                                 root_directory=self.root_directory,
-                                                                sqlite_db_connector=self.sqlite_db_connector)
+                                                                sqlite_db_connector=self.sqlite_db_connector,
+                                                                ingest_workers=self.config.ingest_workers,
+                                                                timing_engine=self.config.timing_engine,
+                                                                audio_job_queue=self.audio_job_queue,
+                                                                chart_notes_cache=self.chart_notes_cache)
+        # Rebuilt, with the next version, whenever the groups are rescanned
+        self.catalog = Catalog(groups=self.all_groups, version=1)
+        # Built before the server forks its workers, so every worker can serve the asset URLs of every song
+        self.songs_by_id = self.index_songs(self.all_groups)
+        # Held while the catalog is patched after a rescan
+        self.catalog_lock = threading.Lock()
+        self.library_watcher = None
+        if self.config.watch_songs_directory:
+            self.library_watcher = LibraryWatcher(root_directory=self.root_directory,
+                                                  on_groups_changed=self.rescan_changed_groups,
+                                                  poll_interval_seconds=self.config.watch_poll_interval_seconds,
+                                                  use_polling=self.config.watch_use_polling,
+                                                  ignore_path=self.audio_job_queue.is_job_output
+                                                  if self.audio_job_queue else None)
+        if start_background_services:
+            self.start_background_services()
 
-        self.file_guid_map = {}  # Dictionary to store GUID to file path mapping
         self.setup_routes()
         self.setup_logging()
         self.force_always_precalculate_beats = False
@@ -54,6 +139,17 @@ class FlaskAppHandler:
         else:
             self.logger.info(f"No base URL provided. Using IP address and port.")
 
+    def start_background_services(self):
+        """
+        Starts running audio jobs, flushing buffered scores and watching the songs directory, in the calling process.
+        """
+        if self.score_buffer:
+            self.score_buffer.start()
+        if self.audio_job_queue:
+            self.audio_job_queue.start()
+        if self.library_watcher:
+            self.library_watcher.start()
+
     def setup_logging(self):
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -62,10 +158,103 @@ class FlaskAppHandler:
         self.logger.info(f"Found {sum(len(group.songs) for group in self.all_groups)} total songs in {len(self.all_groups)} groups.")
         pass
 
+    def rescan_changed_groups(self, group_directory_paths: Set[str]):
+        """
+        Rescans the given group directories and patches the catalog in place,
+        without touching the groups that did not change.
+
+        :param group_directory_paths: The paths of the group directories that changed.
+        """
+        with self.catalog_lock:
+            start_time = time.time()
+            rescanned_groups = rescan_groups(root_directory=self.root_directory,
+                                             group_directory_paths=group_directory_paths,
+                                             sqlite_db_connector=self.sqlite_db_connector,
+                                             ingest_workers=self.config.ingest_workers,
+                                             timing_engine=self.config.timing_engine,
+                                             audio_job_queue=self.audio_job_queue,
+                                             chart_notes_cache=self.chart_notes_cache,
+                                             on_rescanned=self.swap_in_rescanned_groups)
+            self.logger.info(f"Rescanned {len(rescanned_groups)} changed groups in {time.time() - start_time:.2f}s. "
+                             f"Found {sum(len(group.songs) for group in self.all_groups)} total songs "
+                             f"in {len(self.all_groups)} groups.")
+
+    def swap_in_rescanned_groups(self, rescanned_groups: Dict[str, Optional[Group]]):
+        """
+        Serves the rescanned groups instead of the previous ones. Called before the records of the previous groups'
+        songs and charts are deleted, so their charts can read their notes until they are no longer served.
+        """
+        # Swap in new lists rather than mutating the current ones, so requests being served keep a consistent view
+        self.all_groups = natsorted(self.patch_group_list(self.all_groups, rescanned_groups, lambda group: True),
+                                    key=lambda x: x.name)
+        self.single_groups = self.patch_group_list(self.single_groups, rescanned_groups,
+                                                   lambda group: group.is_single_group)
+        self.double_groups = self.patch_group_list(self.double_groups, rescanned_groups,
+                                                   lambda group: group.is_double_group)
+        self.catalog = Catalog(groups=self.all_groups, version=self.catalog.version + 1)
+        self.songs_by_id = self.index_songs(self.all_groups)
+
+    @staticmethod
+    def index_songs(groups: List[Group]) -> Dict[str, Tuple[Group, Song]]:
+        """
+        :return: Song GUID -> the group and the song, for every song in the groups.
+        """
+        return {song.song_id: (group, song) for group in groups for song in group.songs}
+
+    @staticmethod
+    def patch_group_list(groups: List[Group], rescanned_groups: Dict[str, Optional[Group]], include) -> List[Group]:
+        """
+        Returns a copy of the group list with rescanned groups replaced, removed or appended.
+
+        :param groups: The current group list.
+        :param rescanned_groups: The rescanned groups by directory path, None for groups that were removed.
+        :param include: Predicate deciding whether a group belongs in this list.
+        """
+        patched_groups = []
+        for group in groups:
+            if group.directory_path not in rescanned_groups:
+                patched_groups.append(group)
+                continue
+            rescanned_group = rescanned_groups[group.directory_path]
+            if rescanned_group is not None and include(rescanned_group):
+                patched_groups.append(rescanned_group)
+
+        existing_directory_paths = {group.directory_path for group in groups}
+        for directory_path, rescanned_group in rescanned_groups.items():
+            if directory_path not in existing_directory_paths and rescanned_group is not None and include(rescanned_group):
+                patched_groups.append(rescanned_group)
+        return patched_groups
+
+    def conditional_response(self, etag: str, make_body: Callable[[], Union[str, bytes]], mimetype: Optional[str] = None,
+                             headers: Optional[Dict[str, str]] = None):
+        """
+        Builds a response with a strong ETag, or a 304 Not Modified without building the body
+        if the client's If-None-Match already has the ETag.
+
+        :param etag: Identifies the body. It must change whenever the body would.
+        :param make_body: Returns the body. Only called if the body is sent.
+        :param mimetype: The mimetype of the body. Defaults to Flask's default.
+        :param headers: Extra headers, set on both the full and the 304 response.
+        """
+        if request.if_none_match.contains(etag):
+            response = self.app.response_class(status=304)
+        else:
+            response = self.app.response_class(make_body(), mimetype=mimetype)
+        if headers:
+            response.headers.update(headers)
+        response.set_etag(etag)
+        # Caches may reuse the response for max-age seconds, and revalidate it with the ETag after that
+        response.cache_control.public = True
+        response.cache_control.max_age = self.config.http_cache_max_age_seconds
+        response.cache_control.must_revalidate = True
+        return response
+
     def validate_indices(self, group_idx, song_idx=None) -> Tuple[Group, Optional[Song]]:
-        if group_idx >= len(self.all_groups) or group_idx < 0:
+        # The group list can be swapped by a rescan, so work on a single reference
+        all_groups = self.all_groups
+        if group_idx >= len(all_groups) or group_idx < 0:
             abort(404)
-        group = self.all_groups[group_idx]
+        group = all_groups[group_idx]
         if song_idx is not None:
             if song_idx >= len(group.songs) or song_idx < 0:
                 abort(404)
@@ -87,6 +276,47 @@ class FlaskAppHandler:
             abort(404, description="Invalid chart index.")
         return song.charts[chart_idx].chart_id
 
+    def drop_stale_cached_scores(self, user_id: str):
+        """
+        Drops the scores of the user cached by this process if they changed since it last checked,
+        e.g. when the user submitted a score to another server worker.
+        """
+        revision = self.sqlite_db_connector.get_score_revision(user_id)
+        if self.score_revisions.get(user_id) != revision:
+            self.score_store.invalidate_cached_user_scores(user_id)
+            self.personal_bests_cache.invalidate(user_id)
+            self.score_revisions.set(user_id, revision)
+
+    def drop_stale_cached_settings(self, user_id: str):
+        """
+        Drops the settings of the user cached by this process if they changed since it last checked,
+        e.g. when the user saved their settings through another server worker.
+        """
+        revision = self.sqlite_db_connector.get_settings_revision(user_id)
+        if self.settings_revisions.get(user_id) != revision:
+            self.score_store.invalidate_cached_user_settings(user_id)
+            self.settings_revisions.set(user_id, revision)
+
+    def get_group_personal_bests(self, user_id: str, group: Group) -> List[List[Optional[float]]]:
+        """
+        Fetches the user's personal bests on all charts of the group in one query, and caches them until the user
+        submits a score to any server worker, so scrolling through the group's songs does not query the scores again.
+
+        :return: For each song of the group, the user's personal best percentage on each of its charts, or None.
+        """
+        self.drop_stale_cached_scores(user_id)
+        groups_personal_bests = self.personal_bests_cache.get_or_load(user_id, dict)
+        # Keyed by the group itself, since a rescan replaces it
+        personal_bests = groups_personal_bests.get(group)
+        if personal_bests is None:
+            fallback_read_count = self.score_store.fallback_read_count
+            scores = self.scores.get_user_scores_bulk(user_id, group.chart_ids)
+            personal_bests = [[scores.get(chart.chart_id) for chart in song.charts] for song in group.songs]
+            # Scores read while the score store is unavailable may be stale or missing, so they are read again next time
+            if self.score_store.fallback_read_count == fallback_read_count:
+                groups_personal_bests[group] = personal_bests
+        return personal_bests
+
     def setup_db_routes(self):
         """
         Set up API routes for interacting with the database.
@@ -159,7 +389,10 @@ class FlaskAppHandler:
                 if missing_post:
                     return make_response(f"Missing parameters: {', '.join(missing_post)}", 400)
 
-                self.mongodb_client.add_score(user_id, chart_guid, percentage_score, timestamp)
+                self.scores.add_score(user_id, chart_guid, percentage_score, timestamp)
+                self.sqlite_db_connector.record_score_changes([user_id])
+                self.leaderboards.record_score(chart_guid, user_id, percentage_score, timestamp)
+                self.personal_bests_cache.invalidate(user_id)
                 logger.info(
                     f"User '{user_id}' posted score {percentage_score} on song '{song.title}' "
                     f"chart {chart_idx}, from group '{group.name}'."
@@ -170,7 +403,8 @@ class FlaskAppHandler:
                 response_type = request.args.get('response_type',
                                                  default="json").lower()  # Default to "json" and normalize to lowercase
 
-                score = self.mongodb_client.get_user_score(user_id, chart_guid)
+                self.drop_stale_cached_scores(user_id)
+                score = self.scores.get_user_score(user_id, chart_guid)
                 if score:
                     if response_type == "resonite":
                         # Return the score as a formatted percentage string
@@ -185,6 +419,15 @@ class FlaskAppHandler:
                 else:
                     return make_response("Score not found", 404)
 
+        @self.app.route('/db/cache_stats', methods=['GET'])
+        def cache_stats():
+            """
+            Returns the hit and miss counters of this process's caches of score store reads and chart notes.
+            """
+            return jsonify({**self.score_store.cache_stats,
+                            "personal_bests": self.personal_bests_cache.stats,
+                            "chart_notes": self.chart_notes_cache.stats})
+
         @self.app.route('/db/top_scores', methods=['GET'])
         def top_scores():
             """
@@ -210,9 +453,58 @@ class FlaskAppHandler:
             except Exception as e:
                 return make_response(str(e), 404)
 
-            top_scores = self.mongodb_client.get_top_scores(chart_guid=chart_guid, limit=limit)
+            top_scores = self.leaderboards.get_top_scores(chart_guid=chart_guid, limit=limit)
             return jsonify(top_scores)
 
+        @self.app.route('/db/rank', methods=['GET'])
+        def rank():
+            """
+            Retrieves a user's rank on a chart, and the scores ranked around theirs.
+            Example URL: /db/rank?user_id=player1&group_idx=0&song_idx=1&chart_idx=2&neighbours=2
+            If no matching score, returns 404.
+
+            :query user_id: (str) The ID of the user.
+            :query group_idx: (int) The index of the group.
+            :query song_idx: (int) The index of the song in the group.
+            :query chart_idx: (int) The index of the chart in the song.
+            :query neighbours: (int, optional) The number of scores to include above and below the user's. Default 0.
+            :query response_type: (str, optional) 'json' (default) for the rank, total and scores,
+                                  or 'resonite' for the rank as "rank/total".
+            """
+            user_id = request.args.get('user_id')
+            group_idx = request.args.get('group_idx', type=int)
+            song_idx = request.args.get('song_idx', type=int)
+            chart_idx = request.args.get('chart_idx', type=int)
+            neighbour_count = request.args.get('neighbours', default=0, type=int)
+            response_type = request.args.get('response_type', default="json").lower()
+
+            required_params = {
+                "user_id": user_id,
+                "group_idx": group_idx,
+                "song_idx": song_idx,
+                "chart_idx": chart_idx,
+            }
+            missing = validate_params(required_params)
+            if missing:
+                return make_response(f"Missing parameters: {', '.join(missing)}", 400)
+            if neighbour_count < 0:
+                return make_response("neighbours must not be negative", 400)
+
+            try:
+                chart_guid = self.resolve_chart_guid(group_idx, song_idx, chart_idx)
+            except Exception as e:
+                return make_response(str(e), 404)
+
+            user_rank = self.leaderboards.get_rank(chart_guid, user_id, neighbour_count=neighbour_count)
+            if user_rank is None:
+                return make_response("Score not found", 404)
+            if response_type == "resonite":
+                return make_response(f"{user_rank['rank']}/{user_rank['total']}", 200)
+            elif response_type == "json":
+                return jsonify(user_rank)
+            else:
+                return make_response(f"Invalid response_type: {response_type}. Use 'json' or 'resonite'.", 400)
+
 
         @self.app.route('/db/settings', methods=['GET', 'POST'])
         def settings():
@@ -253,12 +545,13 @@ class FlaskAppHandler:
                 if missing:
                     return make_response(f"Missing parameters: {', '.join(missing)}", 400)
 
-                self.mongodb_client.set_user_settings(
+                self.score_store.set_user_settings(
                     user_id, scroll_speed, noteskin, controller_type, controller_buttons,
                     visual_timing_offset, judgement_timing_offset,
                     height_of_notes_area, arrow_x_axis_spacing, note_scroll_direction,
                     combo_text_position, judgement_text_position, background_filter
                 )
+                self.sqlite_db_connector.record_settings_change(user_id)
                 logger.info(f"User settings updated for {user_id}")
                 return jsonify({"message": "User settings updated successfully"})
 
@@ -270,7 +563,8 @@ class FlaskAppHandler:
                 if not user_id:
                     return make_response("Missing user_id parameter", 400)
 
-                settings = self.mongodb_client.get_user_settings(user_id)
+                self.drop_stale_cached_settings(user_id)
+                settings = self.score_store.get_user_settings(user_id)
                 if not settings:
                     return make_response("Settings not found", 404)
 
@@ -311,66 +605,93 @@ class FlaskAppHandler:
         def not_found(error):
             return make_response("Error: Not Found", 404)
 
+        @self.app.errorhandler(ScoreStoreUnavailableError)
+        def score_store_unavailable(error):
+            # e.g. settings writes and leaderboards while MongoDB is unreachable. Scores are spooled instead.
+            return make_response(f"Error: {error}", 503,
+                                 {"Retry-After": str(int(self.config.mongodb_circuit_reset_seconds))})
+
+        @self.app.errorhandler(ChartNotesNotFoundError)
+        def chart_notes_not_found(error):
+            # The chart was replaced by a rescan; the client has to load the song list again
+            return make_response("Error: Not Found", 404)
+
     def setup_api_routes(self):
+        # ETags: responses about a single song or chart are identified by its GUID, which changes whenever its
+        # SM file does. Responses about groups or the group list are identified by the catalog version.
+
         @self.app.route('/groups/count', methods=['GET'])
         def get_group_count():
-            return str(len(self.groups))
+            catalog_version = self.catalog.version
+            return self.conditional_response(f"catalog-{catalog_version}", lambda: str(len(self.all_groups)))
+
+        @self.app.route('/catalog', methods=['GET'])
+        def get_catalog():
+            """
+            Returns the metadata of every group, song and chart in one response.
+            - Example URL: /catalog?response_type=resonite
+            See Catalog for the resonite format.
+            """
+            catalog = self.catalog
+            if request.args.get('response_type', 'json') == 'resonite':
+                return self.conditional_response(f"catalog-{catalog.version}-resonite", lambda: catalog.resonite_string)
+            return self.conditional_response(f"catalog-{catalog.version}-json", lambda: catalog.json,
+                                             mimetype='application/json')
+
+        @self.app.route('/groups/<int:group_idx>/catalog', methods=['GET'])
+        def get_group_catalog(group_idx):
+            catalog = self.catalog
+            if group_idx >= catalog.group_count or group_idx < 0:
+                abort(404)
+            if request.args.get('response_type', 'json') == 'resonite':
+                return self.conditional_response(f"catalog-{catalog.version}-resonite",
+                                                 lambda: catalog.group_resonite_strings[group_idx])
+            return self.conditional_response(f"catalog-{catalog.version}-json", lambda: catalog.group_json[group_idx],
+                                             mimetype='application/json')
 
         @self.app.route('/groups/<int:group_idx>/name', methods=['GET'])
         def get_group_name(group_idx):
+            catalog_version = self.catalog.version
             group, _ = self.validate_indices(group_idx)
-            return f"{group.name} ({len(group.songs)} ♫)"
+            return self.conditional_response(f"catalog-{catalog_version}", lambda: group.display_name)
 
         @self.app.route('/groups/<int:group_idx>/songs/count', methods=['GET'])
         def get_song_count(group_idx):
+            catalog_version = self.catalog.version
             group, _ = self.validate_indices(group_idx)
-            return str(len(group.songs))
+            return self.conditional_response(f"catalog-{catalog_version}", lambda: str(len(group.songs)))
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/title', methods=['GET'])
         def get_song_title(group_idx, song_idx):
             _, song = self.validate_indices(group_idx, song_idx)
-            return song.title
+            return self.conditional_response(song.song_id, lambda: song.title)
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/artist', methods=['GET'])
         def get_song_artist(group_idx, song_idx):
             _, song = self.validate_indices(group_idx, song_idx)
-            return song.artist
+            return self.conditional_response(song.song_id, lambda: song.artist)
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/details', methods=['GET'])
         def get_song_details(group_idx, song_idx):
             _, song = self.validate_indices(group_idx, song_idx)
-
-            # Check if the whole number part of the BPMs is within 1
-            min_bpm_int = int(song.min_bpm)
-            max_bpm_int = int(song.max_bpm)
-
-            if abs(min_bpm_int - max_bpm_int) <= 1:
-                bpm_display = f"BPM: {max_bpm_int}"  # Display the max BPM as the single BPM
-            else:
-                bpm_display = f"BPM Range: {min_bpm_int} - {max_bpm_int}"
-
-            details = [
-                song.title,
-                song.artist,
-                bpm_display,
-                f"Duration: {song.duration_str}"
-            ]
-            return '\n'.join(details)
+            return self.conditional_response(song.song_id, lambda: song.details)
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/charts/count', methods=['GET'])
         def get_chart_count(group_idx, song_idx):
             _, song = self.validate_indices(group_idx, song_idx)
-            return str(len(song.charts))
+            return self.conditional_response(song.song_id, lambda: str(len(song.charts)))
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/charts/<int:chart_idx>/difficulty', methods=['GET'])
         def get_chart_difficulty(group_idx, song_idx, chart_idx):
             _, song = self.validate_indices(group_idx, song_idx)
-            return song.charts[chart_idx].difficulty_name
+            chart = song.charts[chart_idx]
+            return self.conditional_response(chart.chart_id, lambda: chart.difficulty_name)
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/charts/<int:chart_idx>/level', methods=['GET'])
         def get_chart_level(group_idx, song_idx, chart_idx):
             _, song = self.validate_indices(group_idx, song_idx)
-            return str(song.charts[chart_idx].difficulty_level)
+            chart = song.charts[chart_idx]
+            return self.conditional_response(chart.chart_id, lambda: str(chart.difficulty_level))
 
 
         # route to get a list of difficulty levels for a song
@@ -380,7 +701,7 @@ class FlaskAppHandler:
             # A single string where each difficulty is padded with 0 to be 2 digits
             #return "".join([str(chart.difficulty_level).zfill(2) for chart in song.charts])
 
-            return "/".join(str(chart.difficulty_level) for chart in song.charts)
+            return self.conditional_response(song.song_id, lambda: song.chart_levels)
 
         # route to get a list of difficulty levels with their note counts for a song
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/charts/chart_levels_and_note_counts',
@@ -408,49 +729,112 @@ class FlaskAppHandler:
               - Personal Best: "PB: <formatted PB %>"
             - Spaces are appended to the end of each block to make it 35 characters.
             """
-            _, song = self.validate_indices(group_idx, song_idx)
+            group, song = self.validate_indices(group_idx, song_idx)
 
-            # Fixed width for each chart block
-            block_width = 45
             user_id = request.args.get('user_id')
+            if not user_id:
+                return song.chart_blocks_without_personal_bests
 
-            # Get chart IDs and fetch scores in bulk if user_id is provided
-            chart_ids = [chart.chart_id for chart in song.charts]
-            user_scores = (
-                self.mongodb_client.get_user_scores_bulk(user_id, chart_ids) if user_id else {}
-            )
-
-            def format_score(score):
-                """Formats the score as a string with 2 digits before and after the decimal point."""
-                if score is not None:
-                    if score == 100 or score == 100.00:
-                        return "100%"
-                    return f"{score:.2f}%"
-                return "00.00%"
-
-            chart_blocks = []
-            for chart in song.charts:
-                # Create the substring for the current chart
-                block = (
-                    f"<b>Lv. {str(chart.difficulty_level).rjust(2)}</b>\n"
-                    f"{str(chart.note_count)} Notes\n"
-                    f"PB: {format_score(user_scores.get(chart.chart_id))}"
-                )
-                # Append spaces to make the block exactly 35 characters
-                chart_blocks.append(block.ljust(block_width))
+            # The blocks are rendered up to the personal bests, which are fetched for the whole group and spliced in
+            personal_bests = self.get_group_personal_bests(user_id, group)[song_idx]
+            return song.get_chart_blocks({chart.chart_id: personal_best
+                                          for chart, personal_best in zip(song.charts, personal_bests)})
+
+        @self.app.route('/groups/<int:group_idx>/personal_bests', methods=['GET'])
+        def get_personal_bests(group_idx):
+            """
+            Returns a user's personal bests on every chart of the group, fetched with one query.
+            Example URL: /groups/0/personal_bests?user_id=player1&response_type=resonite
 
-            return "".join(chart_blocks)
+            :query user_id: (str) The ID of the user.
+            :query response_type: (str, optional) 'json' (default) or 'resonite'.
+            :return: With 'json', a list with a list per song (by song index) of the personal best percentage
+                     on each chart (by chart index), or null.
+                     With 'resonite', a line per song, with a PERSONAL_BEST_WIDTH character field per chart,
+                     e.g. "95.50%00.00%100%  ".
+            """
+            group, _ = self.validate_indices(group_idx)
+            user_id = request.args.get('user_id')
+            response_type = request.args.get('response_type', default="json").lower()
+            if not user_id:
+                return make_response("Missing parameters: user_id", 400)
+
+            personal_bests = self.get_group_personal_bests(user_id, group)
+            if response_type == "resonite":
+                return "\n".join("".join(format_personal_best(personal_best).ljust(PERSONAL_BEST_WIDTH)
+                                          for personal_best in song_personal_bests)
+                                  for song_personal_bests in personal_bests)
+            elif response_type == "json":
+                return jsonify(personal_bests)
+            else:
+                return make_response(f"Invalid response_type: {response_type}. Use 'json' or 'resonite'.", 400)
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/charts/<int:chart_idx>/notes', methods=['GET'])
         def get_chart_measures(group_idx, song_idx, chart_idx):
+            """
+            Returns the chart's resonite string.
+
+            :query encoding: (str, optional) "compact" for the binary encoding of ChartEncoding.encode_compact.
+            """
             _, song = self.validate_indices(group_idx, song_idx)
             if chart_idx >= len(song.charts) or chart_idx < 0:
                 abort(404)
 
             chart = song.charts[chart_idx]
-            resonite_string = chart.beats_as_resonite_string
+            chart_encoding = request.args.get('encoding')
+            if chart_encoding == "compact":
+                return self.conditional_response(
+                    f"{chart.chart_id}-compact",
+                    lambda: encode_compact(chart.beats_as_resonite_string, chart.arrow_count),
+                    mimetype="application/octet-stream")
+            if chart_encoding is not None:
+                return make_response(f"Unknown encoding: {chart_encoding}", 400)
+
+            # The stored gzip or brotli bytes are sent as is to clients that accept them,
+            # and the string is only decompressed for clients that accept neither
+            encoding = request.accept_encodings.best_match(chart.content_encodings + ["identity"], default="identity")
+            headers = {"Vary": "Accept-Encoding"}
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            return self.conditional_response(f"{chart.chart_id}-{encoding}",
+                                             lambda: chart.get_encoded_beats_as_resonite_string(encoding),
+                                             headers=headers)
+
+        @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/charts/<int:chart_idx>/notes/window',
+                        methods=['GET'])
+        def get_chart_measures_window(group_idx, song_idx, chart_idx):
+            """
+            Returns a window of the records of a chart's notes, so playback can start before the whole chart is loaded.
+            Example URLs: .../notes/window?offset=0&limit=64, .../notes/window?start_time=0&end_time=10
+
+            :query offset: (int, optional) The index of the first record. Defaults to 0.
+            :query limit: (int, optional) The maximum number of records. Defaults to all records after the offset.
+            :query start_time: (float, optional) The time in seconds of the first record, instead of offset.
+            :query end_time: (float, optional) The time in seconds the window ends at (exclusive).
+            :return: The records, in the format of the notes route. The X-Record-Offset, X-Record-Count and
+                     X-Total-Record-Count headers tell the client where the next window starts.
+            """
+            _, song = self.validate_indices(group_idx, song_idx)
+            if chart_idx >= len(song.charts) or chart_idx < 0:
+                abort(404)
+            chart = song.charts[chart_idx]
 
-            return resonite_string
+            offset = request.args.get('offset', default=0, type=int)
+            limit = request.args.get('limit', type=int)
+            start_time = request.args.get('start_time', type=float)
+            end_time = request.args.get('end_time', type=float)
+            if offset < 0 or (limit is not None and limit < 0):
+                return make_response("offset and limit must not be negative.", 400)
+
+            window, first_record_index, total_record_count = chart.get_resonite_string_window(
+                offset=offset, limit=limit, start_time=start_time, end_time=end_time)
+            record_count = len(window) // chart.resonite_record_width
+            return self.conditional_response(
+                f"{chart.chart_id}-{first_record_index}-{record_count}",
+                lambda: window,
+                headers={"X-Record-Offset": str(first_record_index),
+                         "X-Record-Count": str(record_count),
+                         "X-Total-Record-Count": str(total_record_count)})
 
         # Route to get a chart's note count
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/charts/<int:chart_idx>/note_count', methods=['GET'])
@@ -458,7 +842,8 @@ class FlaskAppHandler:
             _, song = self.validate_indices(group_idx, song_idx)
             if chart_idx >= len(song.charts) or chart_idx < 0:
                 abort(404)
-            return str(song.charts[chart_idx].note_count)
+            chart = song.charts[chart_idx]
+            return self.conditional_response(chart.chart_id, lambda: str(chart.note_count))
 
 
     def setup_file_routes(self):
@@ -472,6 +857,10 @@ class FlaskAppHandler:
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/sample', methods=['GET'])
         def get_song_sample(group_idx, song_idx):
+            _, song = self.validate_indices(group_idx, song_idx)
+            if song.sample_pending:
+                # The sample is still being created by the audio job queue
+                return make_response("Sample pending", 202)
             return self.generate_file_url(group_idx, song_idx, "sample")
 
         @self.app.route('/groups/<int:group_idx>/songs/<int:song_idx>/audio', methods=['GET'])
@@ -480,13 +869,32 @@ class FlaskAppHandler:
 
         @self.app.route('/assets/<guid>/<file_type>', methods=['GET'])
         def serve_file(guid, file_type):
-            if guid not in self.file_guid_map:
+            """
+            Serves a file of a song. Range requests are answered with 206 Partial Content, so audio can be
+            streamed and seeked, and conditional requests with 304 Not Modified.
+            """
+            group_and_song = self.songs_by_id.get(guid)
+            if group_and_song is None or file_type not in FILE_TYPES:
                 abort(404)
-            file_path = self.file_guid_map[guid][file_type]
-            return send_from_directory(directory=self.root_directory, path=file_path)
-
-    def generate_file_url(self, group_idx, song_idx, file_type):
-        group, song = self.validate_indices(group_idx, song_idx)
+            file_path = self.get_file_path(*group_and_song, file_type)
+            if file_path is None:
+                abort(404)
+            response = send_from_directory(directory=self.root_directory, path=file_path)
+            # A URL with the file's current version always refers to the same bytes
+            version = request.args.get("v")
+            if version and version == get_file_version(os.path.join(self.root_directory, file_path)):
+                response.cache_control.public = True
+                response.cache_control.max_age = self.config.http_asset_max_age_seconds
+                response.cache_control.immutable = True
+                response.cache_control.no_cache = None
+            return response
+
+    @staticmethod
+    def get_file_path(group: Group, song: Song, file_type: str) -> Optional[str]:
+        """
+        :param file_type: One of FILE_TYPES.
+        :return: The path of the song's file, relative to the root directory, or None if the song does not have one.
+        """
         file_map = {
             "jacket": song.jacket,
             "background": song.background,
@@ -494,17 +902,23 @@ class FlaskAppHandler:
             "audio": song.audio_file_name
         }
         file_name = file_map[file_type]
-        file_path = f"{group.name}/{song.folder_name}/{file_name}"
+        if not file_name:
+            return None
+        return f"{group.name}/{song.folder_name}/{file_name}"
+
+    def generate_file_url(self, group_idx, song_idx, file_type):
+        group, song = self.validate_indices(group_idx, song_idx)
+        file_path = self.get_file_path(group, song, file_type)
         file_guid = song.song_id
-        if file_guid not in self.file_guid_map:
-            self.file_guid_map[file_guid] = {}
-        self.file_guid_map[file_guid][file_type] = file_path
 
+        # The version changes whenever the file does, so the asset can be cached until then
+        version = get_file_version(os.path.join(self.root_directory, file_path)) if file_path else None
+        query = f"?v={version}" if version else ""
 
         if self.base_url:
-            return f"{self.base_url}:{self.port}/assets/{file_guid}/{file_type}"
+            return f"{self.base_url}:{self.port}/assets/{file_guid}/{file_type}{query}"
         else:
-            return f"http://{self.host}:{self.port}/assets/{file_guid}/{file_type}"
+            return f"http://{self.host}:{self.port}/assets/{file_guid}/{file_type}{query}"
 
     def run(self):
         self.app.run(host=self.host, port=self.port)
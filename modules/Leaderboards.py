@@ -0,0 +1,122 @@
+import threading
+import logging
+from bisect import bisect_left, insort
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from modules.utils.TTLCache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+
+class ChartLeaderboard:
+    def __init__(self, chart_guid: str, scores: List[Dict[str, Any]]):
+        """
+        The scores of a chart, kept sorted by percentage score (highest first), then timestamp (earliest first).
+
+        :param chart_guid: The GUID of the chart.
+        :param scores: Dicts with the user_id, percentage_score and timestamp of each user's score on the chart.
+        """
+        self.chart_guid = chart_guid
+        self._lock = threading.Lock()
+        # (-percentage_score, timestamp, user_id), so ascending order is leaderboard order
+        self._entries: List[Tuple[float, int, str]] = []
+        self._entries_by_user_id: Dict[str, Tuple[float, int, str]] = {}
+        for score in scores:
+            entry = (-score["percentage_score"], score.get("timestamp") or 0, score["user_id"])
+            self._entries_by_user_id[score["user_id"]] = entry
+        self._entries = sorted(self._entries_by_user_id.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def record_score(self, user_id: str, percentage_score: float, timestamp: int):
+        """
+        Replaces the user's score on the chart, as ScoreStore.add_score does.
+        """
+        entry = (-percentage_score, timestamp, user_id)
+        with self._lock:
+            previous_entry = self._entries_by_user_id.get(user_id)
+            if previous_entry is not None:
+                del self._entries[bisect_left(self._entries, previous_entry)]
+            insort(self._entries, entry)
+            self._entries_by_user_id[user_id] = entry
+
+    def get_rank(self, user_id: str) -> Optional[int]:
+        """
+        :return: The user's 1-based rank on the chart, or None if they have no score on it.
+        """
+        with self._lock:
+            entry = self._entries_by_user_id.get(user_id)
+            if entry is None:
+                return None
+            return bisect_left(self._entries, entry) + 1
+
+    def get_scores(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        """
+        :return: The scores from 0-based position start to stop (exclusive), with their 1-based rank.
+        """
+        with self._lock:
+            start = max(start, 0)
+            return [self._to_dict(rank, entry)
+                    for rank, entry in enumerate(self._entries[start:stop], start=start + 1)]
+
+    def _to_dict(self, rank: int, entry: Tuple[float, int, str]) -> Dict[str, Any]:
+        negated_percentage_score, timestamp, user_id = entry
+        return {"rank": rank,
+                "user_id": user_id,
+                "chart_guid": self.chart_guid,
+                "percentage_score": -negated_percentage_score,
+                "timestamp": timestamp}
+
+
+class Leaderboards:
+    def __init__(self,
+                 load_chart_scores: Callable[[str], List[Dict[str, Any]]],
+                 max_age_seconds: float = 60.0,
+                 max_charts: int = 2000):
+        """
+        In-memory leaderboards of the charts that are being looked at, so top scores and ranks are read
+        without querying the scores collection.
+
+        A chart's leaderboard is loaded with load_chart_scores the first time it is needed, and updated in place
+        by record_score as scores are submitted. It is loaded again once it is max_age_seconds old, which bounds
+        how long it can miss scores submitted to other processes (e.g. other server workers).
+
+        :param load_chart_scores: Returns the score of each user on a chart.
+        :param max_age_seconds: How long a leaderboard is used before it is loaded again.
+        :param max_charts: The maximum number of leaderboards kept. The least recently used is dropped first.
+        """
+        self.load_chart_scores = load_chart_scores
+        self.cache = TTLCache(max_entries=max_charts, ttl_seconds=max_age_seconds)
+
+    def get_leaderboard(self, chart_guid: str) -> ChartLeaderboard:
+        return self.cache.get_or_load(chart_guid,
+                                      lambda: ChartLeaderboard(chart_guid, self.load_chart_scores(chart_guid)))
+
+    def record_score(self, chart_guid: str, user_id: str, percentage_score: float, timestamp: int):
+        """
+        Updates the chart's leaderboard, if it is loaded, with a submitted score.
+        """
+        leaderboard = self.cache.get(chart_guid)
+        if leaderboard is MISSING:
+            # A leaderboard being loaded right now may have been read without the score, so it is not kept
+            self.cache.invalidate(chart_guid)
+            return
+        leaderboard.record_score(user_id, percentage_score, timestamp)
+
+    def get_top_scores(self, chart_guid: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return self.get_leaderboard(chart_guid).get_scores(0, limit)
+
+    def get_rank(self, chart_guid: str, user_id: str, neighbour_count: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        :param neighbour_count: The number of scores to include above and below the user's.
+        :return: The user's rank, the number of ranked users, and the scores around the user's (including it),
+                 or None if the user has no score on the chart.
+        """
+        leaderboard = self.get_leaderboard(chart_guid)
+        rank = leaderboard.get_rank(user_id)
+        if rank is None:
+            return None
+        return {"rank": rank,
+                "total": len(leaderboard),
+                "scores": leaderboard.get_scores(rank - 1 - neighbour_count, rank + neighbour_count)}
@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+import logging
+from typing import Callable, Dict, Optional, Set
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # Fall back to polling if watchdog is not installed
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+
+class _SongsDirectoryEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher: "LibraryWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        # A directory is modified whenever an entry in it changes, which is reported by an event of its own
+        if event.is_directory and event.event_type == "modified":
+            return
+        self.watcher.mark_path_changed(event.src_path)
+        dest_path = getattr(event, "dest_path", None)
+        if dest_path:
+            self.watcher.mark_path_changed(dest_path)
+
+
+class LibraryWatcher:
+    def __init__(self,
+                 root_directory: str,
+                 on_groups_changed: Callable[[Set[str]], None],
+                 debounce_seconds: float = 2.0,
+                 poll_interval_seconds: float = 10.0,
+                 use_polling: bool = False,
+                 ignore_path: Optional[Callable[[str], bool]] = None):
+        """
+        Watches the songs directory and reports which group directories changed.
+
+        Uses inotify (through watchdog) when available, and otherwise polls the songs directory.
+        Changes are debounced, so copying a whole pack results in a single callback once the copy settles.
+
+        :param root_directory: The directory containing the group directories.
+        :param on_groups_changed: Called from the watcher thread with the paths of the changed group directories.
+        :param debounce_seconds: How long the songs directory has to be quiet before the callback is made.
+        :param poll_interval_seconds: How often the songs directory is polled when inotify is not used.
+        :param use_polling: Whether to poll even if watchdog is installed.
+        :param ignore_path: Decides whether a changed file is ignored, e.g. because the server wrote it.
+                            Samples and partially written (.part) files are always ignored.
+        """
+        self.root_directory = os.path.abspath(root_directory)
+        self.on_groups_changed = on_groups_changed
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.use_polling = use_polling or Observer is None
+        self.ignore_path = ignore_path
+
+        self._changed_group_directory_paths: Set[str] = set()
+        self._last_change_time = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop_event.clear()
+        if self.use_polling:
+            target = self._poll_loop
+            logger.info(f"Watching {self.root_directory} for changes by polling every {self.poll_interval_seconds}s.")
+        else:
+            self._observer = Observer()
+            self._observer.schedule(_SongsDirectoryEventHandler(self), self.root_directory, recursive=True)
+            self._observer.start()
+            target = self._debounce_loop
+            logger.info(f"Watching {self.root_directory} for changes.")
+        self._thread = threading.Thread(target=target, name="LibraryWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def get_group_directory_path(self, path: str) -> Optional[str]:
+        """
+        Maps a path inside the songs directory to the group directory it belongs to.
+
+        :return: The group directory path, or None if the path does not belong to a group.
+        """
+        relative_path = os.path.relpath(os.path.abspath(path), self.root_directory)
+        group_dir = relative_path.split(os.sep)[0]
+        if group_dir in (os.curdir, os.pardir, "ignore"):
+            return None
+        if self.is_ignored_path(path):
+            return None
+        return os.path.join(self.root_directory, group_dir)
+
+    def is_ignored_path(self, path: str) -> bool:
+        """
+        Files written by the server itself, such as samples, converted audio and their partially written files,
+        should not trigger a rescan.
+        """
+        file_name = os.path.basename(path)
+        if file_name.startswith("reso-dmx-sample") or file_name.endswith(".part"):
+            return True
+        return self.ignore_path is not None and self.ignore_path(path)
+
+    def mark_path_changed(self, path: str):
+        group_directory_path = self.get_group_directory_path(path)
+        if group_directory_path is None:
+            return
+        with self._lock:
+            self._changed_group_directory_paths.add(group_directory_path)
+            self._last_change_time = time.monotonic()
+
+    def _debounce_loop(self):
+        while not self._stop_event.wait(min(self.debounce_seconds, 1.0)):
+            with self._lock:
+                if not self._changed_group_directory_paths:
+                    continue
+                if time.monotonic() - self._last_change_time < self.debounce_seconds:
+                    continue
+                changed_group_directory_paths = self._changed_group_directory_paths
+                self._changed_group_directory_paths = set()
+            self._notify(changed_group_directory_paths)
+
+    def _poll_loop(self):
+        snapshot = self._take_snapshot()
+        while not self._stop_event.wait(self.poll_interval_seconds):
+            new_snapshot = self._take_snapshot()
+            changed_group_directory_paths = {path for path in snapshot.keys() | new_snapshot.keys()
+                                             if snapshot.get(path) != new_snapshot.get(path)}
+            snapshot = new_snapshot
+            if changed_group_directory_paths:
+                self._notify(changed_group_directory_paths)
+
+    def _take_snapshot(self) -> Dict[str, tuple]:
+        """
+        Builds a signature per group directory from the names, sizes and modification times
+        of the song directories and the files in them.
+        """
+        snapshot = {}
+        try:
+            group_entries = list(os.scandir(self.root_directory))
+        except OSError as e:
+            logger.error(f"Failed to list {self.root_directory}: {e}")
+            return snapshot
+
+        for group_entry in group_entries:
+            if group_entry.name == "ignore" or not group_entry.is_dir():
+                continue
+            signature = []
+            try:
+                for song_entry in os.scandir(group_entry.path):
+                    if not song_entry.is_dir():
+                        continue
+                    for file_entry in os.scandir(song_entry.path):
+                        if self.is_ignored_path(file_entry.path):
+                            continue
+                        stat = file_entry.stat()
+                        signature.append((song_entry.name, file_entry.name, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                # The group is changing under us; the next poll will pick it up
+                signature.append(None)
+            snapshot[group_entry.path] = tuple(sorted(signature, key=str))
+        return snapshot
+
+    def _notify(self, changed_group_directory_paths: Set[str]):
+        try:
+            self.on_groups_changed(changed_group_directory_paths)
+        except Exception as e:
+            logger.exception(f"Failed to rescan {len(changed_group_directory_paths)} changed groups: {e}")
@@ -1,13 +1,18 @@
 # MongoDBClient.py
 
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import ConnectionFailure
 from pymongo.server_api import ServerApi
 from modules.Config import Config
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Callable, Iterator, Optional
 import logging
 import datetime
+import threading
 from bson import ObjectId
 from modules.utils.Loggers import configure_console_logger
+from modules.utils.TTLCache import TTLCache, MISSING
+from modules.ScoreStore import ScoreStore, ScoreStoreUnavailableError
+from modules.utils.CircuitBreaker import CircuitBreaker
 
 
 logger = logging.getLogger(__name__)
@@ -27,25 +32,105 @@ def serialize_mongo_document(doc):
         return doc
 
 
-class MongoDBClient:
+class MongoDBClient(ScoreStore):
+    is_remote = True
+
     def __init__(self, config: Config):
         """
         Initialize the DatabaseClient with a MongoDB connection.
 
+        The client connects in the background, so the server starts without waiting for the cluster.
+        Calls fail within the configured timeouts while the cluster is unreachable, and once enough of them have,
+        a circuit breaker makes the following calls fail right away with ScoreStoreUnavailableError until a trial
+        call succeeds. Meanwhile, score and settings reads are served from the caches, expired entries included,
+        and those not cached read as not found.
+
         :param config: Config object containing the database URI and settings.
         """
-        uri = config.mongodb_uri
-        # Connect to the MongoDB deployment with API version 1
-        self.client = MongoClient(uri, server_api=ServerApi('1'))
-        try:
-            self.client.admin.command('ping')
-            logger.info("Pinged your deployment. You successfully connected to MongoDB!")
-        except Exception as e:
-            logger.error(e)
+        self.uri = config.mongodb_uri
+        self.config = config
+        # Read-through caches of user settings and scores. Writes made through this client update or invalidate them.
+        # Writes made by other processes (e.g. other server workers) are seen once the cached entry expires,
+        # or once invalidate_cached_user_scores or invalidate_cached_user_settings is called for the user.
+        # Cached values are shared between callers and must not be modified.
+        self.settings_cache = TTLCache(max_entries=config.cache_max_entries, ttl_seconds=config.settings_cache_ttl_seconds)
+        self.scores_cache = TTLCache(max_entries=config.cache_max_entries, ttl_seconds=config.scores_cache_ttl_seconds)
+        self._indexes_created = False
+        self._fallback_read_count = 0
+        self._connect()
+
+    def _connect(self) -> None:
+        # Connect to the MongoDB deployment with API version 1.
+        # With connect=False, the connection pool is opened by the first operation instead of right away.
+        self.client = MongoClient(self.uri,
+                                  server_api=ServerApi('1'),
+                                  connect=False,
+                                  maxPoolSize=self.config.mongodb_max_pool_size,
+                                  minPoolSize=self.config.mongodb_min_pool_size,
+                                  serverSelectionTimeoutMS=self.config.mongodb_server_selection_timeout_ms,
+                                  connectTimeoutMS=self.config.mongodb_connect_timeout_ms,
+                                  socketTimeoutMS=self.config.mongodb_socket_timeout_ms)
         self.db = self.client['stepmania_game']
         self.scores_collection = self.db['scores']
         self.settings_collection = self.db['settings']
-        self._create_indexes()
+        self.circuit_breaker = CircuitBreaker("MongoDB",
+                                              failure_threshold=self.config.mongodb_circuit_failure_threshold,
+                                              reset_timeout_seconds=self.config.mongodb_circuit_reset_seconds)
+        self._stop_event = threading.Event()
+        self._initialize_thread = threading.Thread(target=self._initialize_in_background, name="MongoDBInitialize",
+                                                   daemon=True)
+        self._initialize_thread.start()
+
+    def _initialize_in_background(self) -> None:
+        """
+        Pings the cluster and creates the indexes, retrying until the cluster is reachable.
+        """
+        while not self._stop_event.is_set():
+            try:
+                self.client.admin.command('ping')
+                logger.info("Pinged your deployment. You successfully connected to MongoDB!")
+                if not self._indexes_created:
+                    self._create_indexes()
+                    self._indexes_created = True
+                self.circuit_breaker.record_success()
+                return
+            except Exception as e:
+                logger.error(f"Could not connect to MongoDB, retrying in {self.circuit_breaker.reset_timeout_seconds}s: {e}")
+                # Requests fail fast instead of each waiting for the server selection timeout
+                self.circuit_breaker.trip()
+            self._stop_event.wait(self.circuit_breaker.reset_timeout_seconds)
+
+    def reconnect_after_fork(self) -> None:
+        """
+        Replaces the client inherited from the parent process with a new one.
+        A MongoClient is not fork-safe: its connection pool and monitor threads belong to the process that created it.
+        """
+        self._connect()
+        logger.info("Opened a new MongoDB client in the forked worker process.")
+
+    def close(self) -> None:
+        self._stop_event.set()
+        self.client.close()
+
+    def _call(self, operation: Callable[[], Any]) -> Any:
+        """
+        Runs an operation on the cluster through the circuit breaker.
+
+        :raises ScoreStoreUnavailableError: If the circuit is open, or the cluster could not be reached.
+        """
+        if not self.circuit_breaker.allow_request():
+            raise ScoreStoreUnavailableError("MongoDB is unreachable")
+        try:
+            result = operation()
+        except ConnectionFailure as e:
+            self.circuit_breaker.record_failure()
+            raise ScoreStoreUnavailableError(f"MongoDB is unreachable: {e}") from e
+        except Exception:
+            # The cluster was reached, the operation itself failed
+            self.circuit_breaker.record_success()
+            raise
+        self.circuit_breaker.record_success()
+        return result
 
     def _create_indexes(self) -> None:
         """
@@ -54,6 +139,10 @@ class MongoDBClient:
         self.scores_collection.create_index(
             [("user_id", ASCENDING), ("chart_guid", ASCENDING)], unique=True
         )
+        # Leaderboards read all of a chart's scores, best first
+        self.scores_collection.create_index(
+            [("chart_guid", ASCENDING), ("percentage_score", DESCENDING)]
+        )
         self.settings_collection.create_index("user_id", unique=True)
 
     def add_score(self, user_id: str, chart_guid: str, percentage_score: float, timestamp: int) -> None:
@@ -71,13 +160,39 @@ class MongoDBClient:
             "percentage_score": percentage_score,
             "timestamp": timestamp
         }
-        self.scores_collection.update_one(
+        self._call(lambda: self.scores_collection.update_one(
             {"user_id": user_id, "chart_guid": chart_guid},  # Match criteria
             {"$set": score_entry},  # Update or set the score entry
             upsert=True  # Create a new entry if none exists
-        )
+        ))
+        self.scores_cache.invalidate((user_id, chart_guid))
         logger.info(f"Score for user '{user_id}' on chart '{chart_guid}' updated or added.")
 
+    def add_scores_bulk(self, scores: List[Dict[str, Any]]) -> None:
+        """
+        Adds or updates many scores in a single round trip. Like add_score, an existing score is overwritten.
+
+        :param scores: Dicts with the user_id, chart_guid, percentage_score and timestamp of each score.
+                       There must be at most one per user and chart, since unordered writes can be applied in any order.
+        """
+        if not scores:
+            return
+        operations = [
+            UpdateOne(
+                {"user_id": score["user_id"], "chart_guid": score["chart_guid"]},
+                {"$set": {"user_id": score["user_id"],
+                          "chart_guid": score["chart_guid"],
+                          "percentage_score": score["percentage_score"],
+                          "timestamp": score["timestamp"]}},
+                upsert=True
+            )
+            for score in scores
+        ]
+        result = self._call(lambda: self.scores_collection.bulk_write(operations, ordered=False))
+        for score in scores:
+            self.scores_cache.invalidate((score["user_id"], score["chart_guid"]))
+        logger.info(f"Wrote {len(scores)} scores: {result.upserted_count} added, {result.modified_count} updated.")
+
     def _limit_scores(self, user_id: str, chart_guid: str) -> None:
         """
         Limits the number of stored scores for a user and chart to the latest 10 entries.
@@ -98,6 +213,8 @@ class MongoDBClient:
 
         This method optimizes performance by querying the database only once to retrieve
         scores for multiple charts instead of making separate queries for each chart.
+        Scores in the scores cache are not queried at all.
+        While the cluster is unreachable, the scores that are not cached are read from expired entries, or as None.
 
         :param user_id: The ID of the user.
         :param chart_ids: A list of chart GUIDs for which to fetch scores.
@@ -111,10 +228,7 @@ class MongoDBClient:
         MongoDB Query:
             Finds all documents in the `scores_collection` where:
             - "user_id" matches the given `user_id`.
-            - "chart_guid" is in the list of provided `chart_ids`.
-
-            Projection:
-            - Only retrieves the "chart_guid" and "percentage_score" fields to optimize the query.
+            - "chart_guid" is in the list of provided `chart_ids` that are not cached.
 
         Output:
             {
@@ -123,21 +237,43 @@ class MongoDBClient:
                 "chart3": 87.50   # Found score
             }
         """
-        # Perform a query to find scores for the given user and chart IDs
-        results = self.scores_collection.find(
-            {"user_id": user_id, "chart_guid": {"$in": chart_ids}},  # Match criteria
-            {"chart_guid": 1, "percentage_score": 1}  # Projection to include only required fields
-        )
-
-        # Initialize a dictionary with all chart IDs set to None (default for missing scores)
-        scores = {chart_id: None for chart_id in chart_ids}
-
-        # Iterate through query results and map chart IDs to their respective scores
+        # Only the charts whose score is not cached are queried
+        scores = {}
+        uncached_chart_ids = []
+        for chart_id in chart_ids:
+            cached_score = self.scores_cache.get((user_id, chart_id))
+            if cached_score is MISSING:
+                uncached_chart_ids.append(chart_id)
+            else:
+                scores[chart_id] = cached_score["percentage_score"] if cached_score else None
+        if not uncached_chart_ids:
+            return scores
+
+        cache_version = self.scores_cache.version
+        # Perform a query to find scores for the given user and chart IDs.
+        # Whole documents are fetched (they are small), so they can be cached for get_user_score too.
+        try:
+            results = self._call(lambda: list(self.scores_collection.find(
+                {"user_id": user_id, "chart_guid": {"$in": uncached_chart_ids}}  # Match criteria
+            )))
+        except ScoreStoreUnavailableError:
+            self._fallback_read_count += 1
+            for chart_id in uncached_chart_ids:
+                stale_score = self.scores_cache.get((user_id, chart_id), include_expired=True)
+                scores[chart_id] = stale_score["percentage_score"] if stale_score not in (MISSING, None) else None
+            return {chart_id: scores[chart_id] for chart_id in chart_ids}
+
+        # Initialize the uncached chart IDs to None (default for missing scores)
+        found_scores = {chart_id: None for chart_id in uncached_chart_ids}
+
+        # Iterate through query results and map chart IDs to their respective score documents
         for result in results:
-            # For each result, update the score for the corresponding chart ID
-            scores[result["chart_guid"]] = result.get("percentage_score", None)
+            found_scores[result["chart_guid"]] = serialize_mongo_document(result)
 
-        return scores
+        for chart_id, score in found_scores.items():
+            self.scores_cache.set((user_id, chart_id), score, version=cache_version)
+            scores[chart_id] = score.get("percentage_score", None) if score else None
+        return {chart_id: scores[chart_id] for chart_id in chart_ids}
 
     def get_user_score(self, user_id: str, chart_guid: str) -> Optional[Dict[str, Any]]:
         """
@@ -147,8 +283,21 @@ class MongoDBClient:
         :param chart_guid: The GUID of the chart.
         :return: A dictionary containing the score information, or None if not found.
         """
-        result = self.scores_collection.find_one({"user_id": user_id, "chart_guid": chart_guid})
-        return serialize_mongo_document(result)
+        return self._get_cached_or_load(
+            self.scores_cache, (user_id, chart_guid),
+            lambda: serialize_mongo_document(self.scores_collection.find_one({"user_id": user_id, "chart_guid": chart_guid})))
+
+    def _get_cached_or_load(self, cache: TTLCache, key: Any, load: Callable[[], Any]) -> Any:
+        """
+        Like cache.get_or_load, except that while the cluster is unreachable, an expired entry is returned instead,
+        or None if there is none.
+        """
+        try:
+            return cache.get_or_load(key, lambda: self._call(load))
+        except ScoreStoreUnavailableError:
+            self._fallback_read_count += 1
+            stale_value = cache.get(key, include_expired=True)
+            return None if stale_value is MISSING else stale_value
 
     def delete_scores_for_user(self, user_id: str) -> None:
         """
@@ -156,7 +305,8 @@ class MongoDBClient:
 
         :param user_id: The ID of the user whose scores should be deleted.
         """
-        result = self.scores_collection.delete_many({"user_id": user_id})
+        result = self._call(lambda: self.scores_collection.delete_many({"user_id": user_id}))
+        self.scores_cache.clear()
         logger.info(f"Deleted {result.deleted_count} scores for user '{user_id}'.")
 
     def delete_scores_for_chart(self, chart_guid: str) -> None:
@@ -165,7 +315,8 @@ class MongoDBClient:
 
         :param chart_guid: The GUID of the chart whose scores should be deleted.
         """
-        result = self.scores_collection.delete_many({"chart_guid": chart_guid})
+        result = self._call(lambda: self.scores_collection.delete_many({"chart_guid": chart_guid}))
+        self.scores_cache.clear()
         logger.info(f"Deleted {result.deleted_count} scores for chart '{chart_guid}'.")
 
 
@@ -175,10 +326,27 @@ class MongoDBClient:
 
         :param chart_guids: A list of chart GUIDs whose scores should be deleted.
         """
-        result = self.scores_collection.delete_many({"chart_guid": {"$in": chart_guids}})
+        result = self._call(lambda: self.scores_collection.delete_many({"chart_guid": {"$in": chart_guids}}))
+        self.scores_cache.clear()
         logger.info(f"Deleted {result.deleted_count} scores for {len(chart_guids)} charts.")
 
 
+    def get_chart_scores(self, chart_guid: str) -> List[Dict[str, Any]]:
+        """
+        Retrieves the score of every user on a chart, to build the chart's leaderboard.
+
+        :param chart_guid: The GUID of the chart.
+        :return: Dicts with the user_id, chart_guid, percentage_score and timestamp of each score, best first.
+        """
+        return self._call(lambda: list(self.scores_collection.find(
+            {"chart_guid": chart_guid},
+            {"_id": 0, "user_id": 1, "chart_guid": 1, "percentage_score": 1, "timestamp": 1}
+        ).sort("percentage_score", DESCENDING)))
+
+    def iter_scores(self) -> Iterator[Dict[str, Any]]:
+        return self.scores_collection.find(
+            {}, {"_id": 0, "user_id": 1, "chart_guid": 1, "percentage_score": 1, "timestamp": 1})
+
     def get_top_scores(self, chart_guid: str, limit: int = 10) -> List[Dict[str, Any]]:
         """
         Retrieve the top scores for a specific chart by percentage score, ensuring each entry is the best score for a unique user.
@@ -199,47 +367,17 @@ class MongoDBClient:
             {"$limit": limit}
         ]
 
-        return list(self.scores_collection.aggregate(pipeline))
+        return self._call(lambda: list(self.scores_collection.aggregate(pipeline)))
 
-    def set_user_settings(self, user_id: str, scroll_speed: float, noteskin: str,
-                          controller_type: str, controller_buttons: Dict[str, str],
-                          visual_timing_offset: float, judgement_timing_offset: float,
-                          height_of_notes_area: float, arrow_x_axis_spacing: float,
-                          note_scroll_direction: str,
-                          combo_text_position: int,
-                          judgement_text_position: int,
-                          background_filter: int,
-                          ) -> None:
+    def save_user_settings(self, settings: Dict[str, Any]) -> None:
         """
         Set or update a user's settings.
 
-        :param user_id: The user_id of the player.
-        :param scroll_speed: The scroll speed setting.
-        :param noteskin: The noteskin setting.
-        :param controller: The controller type.
-        :param controller_buttons: Mapping of controller buttons (e.g., button_0, button_1).
-        :param visual_timing_offset: Visual timing offset for display.
-        :param judgement_timing_offset: Timing offset for judgement.
-        :param height_of_notes_area: Height of the notes area.
-        :param arrow_x_axis_spacing: Spacing of arrows on the x-axis.
-        :param note_scroll_direction: Scroll direction for notes.
-        """
-        settings = {
-            "user_id": user_id,
-            "scroll_speed": scroll_speed,
-            "noteskin": noteskin,
-            "controller_type": controller_type,
-            "controller_buttons": controller_buttons,
-            "visual_timing_offset": visual_timing_offset,
-            "judgement_timing_offset": judgement_timing_offset,
-            "height_of_notes_area": height_of_notes_area,
-            "arrow_x_axis_spacing": arrow_x_axis_spacing,
-            "note_scroll_direction": note_scroll_direction,
-            "background_filter": background_filter,
-            "combo_text_position": combo_text_position,
-            "judgement_text_position": judgement_text_position,
-        }
-        self.settings_collection.update_one({"user_id": user_id}, {"$set": settings}, upsert=True)
+        :param settings: A settings dict. Settings it does not have are left as they are.
+        """
+        self._call(lambda: self.settings_collection.update_one({"user_id": settings["user_id"]}, {"$set": settings},
+                                                                upsert=True))
+        self.settings_cache.invalidate(settings["user_id"])
 
     def get_user_settings(self, user_id: str) -> Optional[Dict[str, Any]]:
         """
@@ -248,8 +386,25 @@ class MongoDBClient:
         :param user_id: The user_id of the player.
         :return: A dictionary containing the user's settings or None if not found.
         """
-        result = self.settings_collection.find_one({"user_id": user_id})
-        return serialize_mongo_document(result)
+        return self._get_cached_or_load(
+            self.settings_cache, user_id, lambda: serialize_mongo_document(self.settings_collection.find_one({"user_id": user_id})))
+
+    def iter_settings(self) -> Iterator[Dict[str, Any]]:
+        return self.settings_collection.find({}, {"_id": 0})
+
+    def invalidate_cached_user_scores(self, user_id: str) -> None:
+        self.scores_cache.invalidate_where(lambda key: key[0] == user_id)
+
+    def invalidate_cached_user_settings(self, user_id: str) -> None:
+        self.settings_cache.invalidate(user_id)
+
+    @property
+    def fallback_read_count(self) -> int:
+        return self._fallback_read_count
+
+    @property
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {"settings": self.settings_cache.stats, "scores": self.scores_cache.stats}
 
 if __name__ == "__main__":
     configure_console_logger()
@@ -1,6 +1,24 @@
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import os
 
+try:
+    import numpy as np
+except ImportError:  # The numpy timing engine is optional
+    np = None
+
+# Each record of a resonite string is the time (TIME_FIELD_WIDTH characters), one character per arrow,
+# and the number of beats in the measure (MEASURE_SIZE_FIELD_WIDTH digits)
+TIME_FIELD_WIDTH = 12
+MEASURE_SIZE_FIELD_WIDTH = 3
+
+def format_beat_time(time: float) -> str:
+    """
+    Formats a time in seconds the way it appears in the resonite string.
+    """
+    # # pad 4 digits for the whole number part, 7 digits for the decimal part
+    whole_part, decimal_part = f"{time:.7f}".split('.')
+    return f"{int(whole_part):04d}.{decimal_part:0<7}"
+
 
 class Beat:
     def __init__(self, time: float, normalized_time: float, n_beats_in_measure: int, arrows_binary_string: str, arrows: List[int] = None):
@@ -9,9 +27,7 @@ class Beat:
         # 7 decimal places with padding if necessary
         self.normalized_time_string_formatted = f"{normalized_time:.7f}"
 
-        # # pad 4 digits for the whole number part, 7 digits for the decimal part
-        whole_part, decimal_part = f"{time:.7f}".split('.')
-        self.time_string_formatted = f"{int(whole_part):04d}.{decimal_part:0<7}"
+        self.time_string_formatted = format_beat_time(time)
 
         self.arrows = arrows if arrows else []
         self.arrows_binary_string = arrows_binary_string
@@ -97,11 +113,113 @@ def precalculate_beats(song, chart, exclude_inactive_beats: bool) -> (List[Beat]
     return beats, note_count
 
 
+def use_numpy_timing_engine(timing_engine: str) -> bool:
+    """
+    :param timing_engine: "python", "numpy", or "auto" to use numpy if it is installed.
+    """
+    if timing_engine == "auto":
+        return np is not None
+    return timing_engine == "numpy"
+
+
+def precalculate_resonite_string(song, chart, exclude_inactive_beats: bool) -> Tuple[str, int]:
+    """
+    Vectorized equivalent of get_beats_as_resonite_string(precalculate_beats(...)[0]), built with numpy.
+
+    The beat number of every note row is computed at once. Note rows and timing events are merged into a single
+    sequence of time increments, in the order precalculate_beats applies them, and the times are their cumulative sum.
+    np.cumsum adds strictly left to right, so the times, and with them the resonite string, are identical
+    to those of precalculate_beats. No Beat objects are created.
+
+    :param song: The song object containing BPM and stop information.
+    :param chart: The chart object containing measure and beat data.
+    :param exclude_inactive_beats: Whether to exclude beats with no arrows.
 
+    :return: A tuple containing the resonite string and the total note count.
+    """
+    if np is None:
+        raise ImportError("numpy is required for the vectorized timing engine.")
+
+    initial_bpm = song.bpms[0][1]
+    measure_lengths = np.array([len(measure) for measure in chart.measures], dtype=np.int64)
+    n_note_rows = int(measure_lengths.sum())
+    if n_note_rows == 0:
+        return "", 0
+    if song.duration == 0:
+        # precalculate_beats fails on the normalized time of the first note row
+        raise ZeroDivisionError("float division by zero")
+
+    # Beat number of every note row, computed exactly like precalculate_beats does
+    measure_indices = np.repeat(np.arange(len(measure_lengths), dtype=np.int64), measure_lengths)
+    rows_in_measure = np.repeat(measure_lengths, measure_lengths)
+    measure_starts = np.repeat(np.cumsum(measure_lengths) - measure_lengths, measure_lengths)
+    note_row_indices = np.arange(n_note_rows, dtype=np.int64) - measure_starts
+    beat_numbers = measure_indices * 4 + (note_row_indices / rows_in_measure) * 4
 
+    # Combine BPM changes and stops into a single sorted event list
+    timing_events = [(beat, False, bpm) for beat, bpm in song.bpms]
+    timing_events += [(beat, True, duration) for beat, duration in song.stops]
+    timing_events.sort(key=lambda x: x[0])
+    event_beats = np.array([event[0] for event in timing_events], dtype=np.float64)
+    event_is_stop = np.array([event[1] for event in timing_events], dtype=bool)
+    event_values = np.array([event[2] for event in timing_events], dtype=np.float64)
+
+    # An event is applied right before the first note row at or after its beat.
+    # Events after the last note row are never applied.
+    event_positions = np.searchsorted(beat_numbers, event_beats, side='left')
+    applied = event_positions < n_note_rows
+    event_beats, event_is_stop, event_values = event_beats[applied], event_is_stop[applied], event_values[applied]
+    n_events = len(event_beats)
+
+    # Merge events and note rows into processing order: by note row, events first, each kind in its own order
+    point_positions = np.concatenate((event_positions[applied], np.arange(n_note_rows)))
+    point_kinds = np.concatenate((np.zeros(n_events, dtype=np.int8), np.ones(n_note_rows, dtype=np.int8)))
+    order = np.lexsort((point_kinds, point_positions))
+    point_beats = np.concatenate((event_beats, beat_numbers))[order]
+    point_is_stop = np.concatenate((event_is_stop, np.zeros(n_note_rows, dtype=bool)))[order]
+    point_is_bpm_change = np.concatenate((~event_is_stop, np.zeros(n_note_rows, dtype=bool)))[order]
+    point_values = np.concatenate((event_values, np.zeros(n_note_rows)))[order]
+    point_is_note_row = (point_kinds[order] == 1)
+
+    # The BPM in effect while moving to each point is the value of the last BPM change before it
+    last_bpm_change = np.where(point_is_bpm_change, np.arange(len(order)), -1)
+    last_bpm_change = np.maximum.accumulate(last_bpm_change)
+    bpms_after = np.where(last_bpm_change >= 0, point_values[np.maximum(last_bpm_change, 0)], initial_bpm)
+    bpms_before = np.concatenate(([initial_bpm], bpms_after[:-1]))
+    if np.any(bpms_before == 0):
+        raise ZeroDivisionError("float division by zero")
+
+    previous_beats = np.concatenate(([0.0], point_beats[:-1]))
+    point_increments = ((point_beats - previous_beats) * 60) / bpms_before
+
+    # Stops add their duration right after the increment that reaches them
+    increment_indices = np.arange(len(order)) + np.cumsum(point_is_stop) - point_is_stop
+    increments = np.empty(len(order) + int(point_is_stop.sum()) + 1)
+    increments[0] = -song.offset  # Start time adjusted by song offset
+    increments[increment_indices + 1] = point_increments
+    increments[increment_indices[point_is_stop] + 2] = point_values[point_is_stop]
+    times = np.cumsum(increments)[increment_indices[point_is_note_row] + 1].tolist()
 
+    note_count = 0
+    resonite_parts = []
+    note_row_index = 0
+    arrows_translation = str.maketrans("24", "11")
+    for measure in chart.measures:
+        n_beats_in_measure_str = f"{len(measure):03d}"
+        for beat in measure:
+            time = times[note_row_index]
+            note_row_index += 1
+
+            arrows_binary_string = beat.translate(arrows_translation)
+            n_arrows = arrows_binary_string.count("1")
+            note_count += n_arrows
+            if exclude_inactive_beats and not n_arrows:
+                continue
 
+            time_string_formatted = "%012.7f" % time if time > 0.0 else format_beat_time(time)
+            resonite_parts.append(f"{time_string_formatted}{arrows_binary_string}{n_beats_in_measure_str}")
 
+    return "".join(resonite_parts), note_count
 
 
 def get_beats_as_resonite_string(beats: List[Beat]) -> str:
@@ -116,6 +234,32 @@ def get_beats_as_resonite_string(beats: List[Beat]) -> str:
     return resonite_string
 
 
+def get_resonite_record_width(n_arrows: int) -> int:
+    """
+    :return: The width of each record of a resonite string for a chart with n_arrows arrows.
+    """
+    return TIME_FIELD_WIDTH + n_arrows + MEASURE_SIZE_FIELD_WIDTH
+
+
+def find_resonite_record_index(resonite_string: str, record_width: int, time: float) -> int:
+    """
+    Binary searches the records of a resonite string, which are in time order, by their time field.
+    Only the time fields of the records visited are parsed.
+
+    :param resonite_string: The resonite string.
+    :param record_width: The width of each record, see get_resonite_record_width.
+    :param time: The time in seconds to search for.
+    :return: The index of the first record at or after the time, or the number of records if there is none.
+    """
+    low, high = 0, len(resonite_string) // record_width
+    while low < high:
+        middle = (low + high) // 2
+        record_start = middle * record_width
+        if float(resonite_string[record_start:record_start + TIME_FIELD_WIDTH]) < time:
+            low = middle + 1
+        else:
+            high = middle
+    return low
 
 
 if __name__ == "__main__":
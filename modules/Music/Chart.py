@@ -1,7 +1,12 @@
-from typing import List, Tuple, Dict, Any
-from modules.Music.Beat import Beat
+from typing import List, Tuple, Dict, Any, TYPE_CHECKING
+from modules.ChartNotesCache import ChartNotesNotFoundError
+from modules.Music.Beat import Beat, get_resonite_record_width, find_resonite_record_index
 from typing import Optional
 from uuid import uuid4
+from modules.utils.CompressionUtils import FORMAT_RAW, FORMAT_GZIP, CONTENT_ENCODINGS, compress_text_for_serving, decompress_text
+
+if TYPE_CHECKING:
+    from modules.ChartNotesCache import ChartNotesCache, ChartNotes
 
 class Chart:
     def __init__(self,
@@ -12,6 +17,11 @@ class Chart:
                  measures: list[list[[str]]] = None,
                  note_count: int = 0,
                  beats_as_resonite_string: str = "",
+                 compressed_beats_as_resonite_string: Optional[bytes] = None,
+                 beats_format: int = 0,
+                 brotli_beats_as_resonite_string: Optional[bytes] = None,
+                 has_brotli_beats_as_resonite_string: bool = False,
+                 notes_cache: Optional["ChartNotesCache"] = None,
                  ):
         """
         :param mode: "dance-single" or "dance-double"
@@ -32,6 +42,15 @@ class Chart:
         06 is a measure with 8 beats.
         08 is a measure with 4 beats.
 
+        :param compressed_beats_as_resonite_string: The resonite string as stored in the database, used instead of
+                                                    beats_as_resonite_string. It is decompressed each time it is read,
+                                                    so only the compressed string is kept in memory.
+        :param beats_format: The compression format of compressed_beats_as_resonite_string.
+        :param brotli_beats_as_resonite_string: The resonite string compressed with brotli, if it was produced.
+        :param has_brotli_beats_as_resonite_string: Whether the database has the brotli string, when it is read through
+                                                    notes_cache.
+        :param notes_cache: Reads the compressed resonite strings from the database when they are needed, instead of
+                            keeping them in memory. The chart is then created with only its metadata and beats_format.
         """
         self.mode = mode
         self.difficulty_name = difficulty_name
@@ -40,9 +59,159 @@ class Chart:
 
         self.note_count = note_count
         self.beats: List[Beat] = []
-        self.beats_as_resonite_string = beats_as_resonite_string
+        self._beats_as_resonite_string = beats_as_resonite_string
+        self._compressed_beats_as_resonite_string = compressed_beats_as_resonite_string
+        self._beats_format = beats_format
+        self._brotli_beats_as_resonite_string = brotli_beats_as_resonite_string
+        self._has_brotli_beats_as_resonite_string = \
+            brotli_beats_as_resonite_string is not None or has_brotli_beats_as_resonite_string
+        self._notes_cache = notes_cache
         self.chart_id = chart_id or str(uuid4())
 
+    def _get_notes(self) -> Optional["ChartNotes"]:
+        """
+        :return: The compressed resonite string, its format and its brotli encoding, read through the notes cache
+                 if they are not in memory. None if the chart has no compressed resonite string.
+        :raises ChartNotesNotFoundError: If the notes are read through the notes cache and are no longer in the database.
+        """
+        if self._compressed_beats_as_resonite_string is not None:
+            return (self._compressed_beats_as_resonite_string, self._beats_format,
+                    self._brotli_beats_as_resonite_string)
+        if self._notes_cache is not None:
+            notes = self._notes_cache.get(self.chart_id)
+            if notes is None:
+                raise ChartNotesNotFoundError(f"The notes of chart {self.chart_id} are no longer in the database.")
+            return notes
+        return None
+
+    @property
+    def beats_as_resonite_string(self) -> str:
+        notes = self._get_notes()
+        if notes is not None:
+            compressed_beats_as_resonite_string, beats_format, _ = notes
+            return decompress_text(compressed_beats_as_resonite_string, beats_format)
+        return self._beats_as_resonite_string
+
+    @beats_as_resonite_string.setter
+    def beats_as_resonite_string(self, beats_as_resonite_string: str):
+        self._beats_as_resonite_string = beats_as_resonite_string
+        self._compressed_beats_as_resonite_string = None
+        self._beats_format = FORMAT_RAW
+        self._brotli_beats_as_resonite_string = None
+        self._has_brotli_beats_as_resonite_string = False
+        self._notes_cache = None
+
+    @property
+    def compressed_beats_as_resonite_string(self) -> Optional[bytes]:
+        notes = self._get_notes()
+        return notes[0] if notes is not None else None
+
+    @property
+    def brotli_beats_as_resonite_string(self) -> Optional[bytes]:
+        if self._brotli_beats_as_resonite_string is not None or not self._has_brotli_beats_as_resonite_string:
+            return self._brotli_beats_as_resonite_string
+        notes = self._get_notes()
+        return notes[2] if notes is not None else None
+
+    @property
+    def has_compressed_beats_as_resonite_string(self) -> bool:
+        return self._compressed_beats_as_resonite_string is not None or self._notes_cache is not None
+
+    @property
+    def beats_format(self) -> int:
+        return self._beats_format
+
+    def compress_beats_as_resonite_string(self):
+        """
+        Replaces the resonite string with its gzip encoding, and its brotli encoding if brotli is installed,
+        so they can be stored and served without compressing them again.
+        """
+        if self.has_compressed_beats_as_resonite_string and self._beats_format == FORMAT_GZIP:
+            return
+        self._compressed_beats_as_resonite_string, self._brotli_beats_as_resonite_string = \
+            compress_text_for_serving(self.beats_as_resonite_string)
+        self._has_brotli_beats_as_resonite_string = self._brotli_beats_as_resonite_string is not None
+        self._beats_format = FORMAT_GZIP
+        self._beats_as_resonite_string = ""
+        self._notes_cache = None
+
+    def release_notes(self, notes_cache: "ChartNotesCache"):
+        """
+        Drops the compressed resonite strings, and the beats and measures they were calculated from, once the chart
+        is stored in the database. From then on, the resonite strings are read through notes_cache.
+        Does nothing if the resonite string is not compressed, as only compressed strings are stored.
+        """
+        if self._compressed_beats_as_resonite_string is None:
+            return
+        self._notes_cache = notes_cache
+        self._compressed_beats_as_resonite_string = None
+        self._brotli_beats_as_resonite_string = None
+        self.beats = []
+        self.measures = None
+
+    @property
+    def content_encodings(self) -> List[str]:
+        """
+        :return: The Content-Encodings the resonite string can be served with as is, e.g. ["br", "gzip"].
+        """
+        content_encodings = []
+        if self._has_brotli_beats_as_resonite_string:
+            content_encodings.append("br")
+        if self.has_compressed_beats_as_resonite_string and self._beats_format in CONTENT_ENCODINGS:
+            content_encodings.append(CONTENT_ENCODINGS[self._beats_format])
+        return content_encodings
+
+    def get_encoded_beats_as_resonite_string(self, content_encoding: str) -> bytes:
+        """
+        :param content_encoding: One of content_encodings, or "identity" for the uncompressed string.
+        :return: The resonite string in that encoding.
+        """
+        if content_encoding != "identity":
+            # Read once, so both strings come from the same lookup in the notes cache
+            notes = self._get_notes()
+            if notes is not None:
+                compressed_beats_as_resonite_string, beats_format, brotli_beats_as_resonite_string = notes
+                if content_encoding == "br" and brotli_beats_as_resonite_string is not None:
+                    return brotli_beats_as_resonite_string
+                if CONTENT_ENCODINGS.get(beats_format) == content_encoding:
+                    return compressed_beats_as_resonite_string
+            raise ValueError(f"The resonite string is not available with Content-Encoding {content_encoding}")
+        return self.beats_as_resonite_string.encode('utf-8')
+
+    @property
+    def arrow_count(self) -> int:
+        return 8 if self.is_double_chart else 4
+
+    @property
+    def resonite_record_width(self) -> int:
+        return get_resonite_record_width(self.arrow_count)
+
+    def get_resonite_string_window(self,
+                                   offset: int = 0,
+                                   limit: Optional[int] = None,
+                                   start_time: Optional[float] = None,
+                                   end_time: Optional[float] = None) -> Tuple[str, int, int]:
+        """
+        Slices whole records out of the resonite string, so a client can start playing before it has the whole chart.
+        The window is either offset/limit records, or the records from start_time (inclusive) to end_time (exclusive).
+
+        :param offset: The index of the first record.
+        :param limit: The maximum number of records. None for all records after the offset.
+        :param start_time: The time in seconds of the first record. Overrides offset.
+        :param end_time: The time in seconds the window ends at. Overrides limit.
+        :return: A tuple containing the records, the index of the first record and the total number of records.
+        """
+        beats_as_resonite_string = self.beats_as_resonite_string
+        record_width = self.resonite_record_width
+        record_count = len(beats_as_resonite_string) // record_width
+
+        if start_time is not None:
+            offset = find_resonite_record_index(beats_as_resonite_string, record_width, start_time)
+        offset = min(offset, record_count)
+        stop = record_count if limit is None else min(offset + limit, record_count)
+        if end_time is not None:
+            stop = max(offset, min(stop, find_resonite_record_index(beats_as_resonite_string, record_width, end_time)))
+        return beats_as_resonite_string[offset * record_width:stop * record_width], offset, record_count
 
     @property
     def is_single_chart(self) -> bool:
@@ -0,0 +1,182 @@
+from typing import List, Tuple
+
+from modules.Music.Beat import TIME_FIELD_WIDTH, MEASURE_SIZE_FIELD_WIDTH, get_resonite_record_width
+
+COMPACT_MAGIC = b"RDXC"
+COMPACT_VERSION = 1
+# Times in the resonite string have 7 decimals, so they are stored as whole multiples of 1e-7 seconds
+TICKS_PER_SECOND = 10_000_000
+
+
+def encode_varint(value: int, output: bytearray):
+    """
+    Appends an unsigned LEB128 varint: 7 bits per byte, least significant first, high bit set on all but the last byte.
+    """
+    while value > 0x7F:
+        output.append((value & 0x7F) | 0x80)
+        value >>= 7
+    output.append(value)
+
+
+def decode_varint(data: bytes, position: int) -> Tuple[int, int]:
+    """
+    :return: A tuple containing the value and the position after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError("Truncated varint in compact chart data")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def zigzag_encode(value: int) -> int:
+    # Maps 0, -1, 1, -2, ... to 0, 1, 2, 3, ... so small negative deltas stay small varints
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def zigzag_decode(value: int) -> int:
+    return value >> 1 if value % 2 == 0 else -((value + 1) >> 1)
+
+
+def parse_time_ticks(time_field: str) -> int:
+    """
+    Converts the time field of a record (e.g. "0001.2345678" or "-001.5000000") to ticks, without going through a float.
+    """
+    whole_part, decimal_part = time_field.split(".")
+    ticks = abs(int(whole_part)) * TICKS_PER_SECOND + int(decimal_part)
+    return -ticks if whole_part.startswith("-") else ticks
+
+
+def format_time_ticks(ticks: int) -> str:
+    """
+    Reverses parse_time_ticks, formatting the time like format_beat_time does.
+    """
+    whole_part, decimal_part = divmod(abs(ticks), TICKS_PER_SECOND)
+    return f"{-whole_part if ticks < 0 else whole_part:04d}.{decimal_part:07d}"
+
+
+def encode_compact(resonite_string: str, arrow_count: int) -> bytes:
+    """
+    Encodes a resonite string in the compact binary format. decode_compact reverses it exactly.
+
+    Layout, with all integers as unsigned LEB128 varints:
+    - Header: COMPACT_MAGIC, a version byte, the arrow count, the record count and the exception count
+    - Times: the difference in ticks (1e-7 s) from the previous record's time (from 0 for the first), zigzag encoded
+    - Arrows: one bit per arrow that is "1", record after record, least significant bit first, padded to a whole byte
+    - Measure sizes: the number of runs, then the length and the measure size of each run of equal measure sizes
+    - Exceptions: arrows that are neither "0" nor "1" (e.g. hold ends and mines), as the record index difference
+      from the previous exception, the arrow index and the character (1 byte)
+
+    :param resonite_string: The resonite string, see get_beats_as_resonite_string.
+    :param arrow_count: The number of arrows in each record: 4 for single charts, 8 for double charts.
+    :return: The encoded chart.
+    """
+    record_width = get_resonite_record_width(arrow_count)
+    if len(resonite_string) % record_width:
+        raise ValueError(f"The resonite string is not made of {record_width} character records")
+    record_count = len(resonite_string) // record_width
+
+    times = bytearray()
+    arrow_bits = bytearray((record_count * arrow_count + 7) // 8)
+    measure_runs: List[List[int]] = []
+    exceptions = bytearray()
+    exception_count = 0
+    previous_ticks = 0
+    previous_exception_record_index = 0
+
+    for record_index in range(record_count):
+        record_start = record_index * record_width
+        arrows_start = record_start + TIME_FIELD_WIDTH
+        measure_size_start = arrows_start + arrow_count
+
+        ticks = parse_time_ticks(resonite_string[record_start:arrows_start])
+        encode_varint(zigzag_encode(ticks - previous_ticks), times)
+        previous_ticks = ticks
+
+        for arrow_index, arrow in enumerate(resonite_string[arrows_start:measure_size_start]):
+            if arrow == "1":
+                bit_index = record_index * arrow_count + arrow_index
+                arrow_bits[bit_index >> 3] |= 1 << (bit_index & 7)
+            elif arrow != "0":
+                encode_varint(record_index - previous_exception_record_index, exceptions)
+                encode_varint(arrow_index, exceptions)
+                exceptions.extend(arrow.encode("ascii"))
+                previous_exception_record_index = record_index
+                exception_count += 1
+
+        measure_size = int(resonite_string[measure_size_start:measure_size_start + MEASURE_SIZE_FIELD_WIDTH])
+        if measure_runs and measure_runs[-1][1] == measure_size:
+            measure_runs[-1][0] += 1
+        else:
+            measure_runs.append([1, measure_size])
+
+    output = bytearray(COMPACT_MAGIC)
+    output.append(COMPACT_VERSION)
+    encode_varint(arrow_count, output)
+    encode_varint(record_count, output)
+    encode_varint(exception_count, output)
+    output.extend(times)
+    output.extend(arrow_bits)
+    encode_varint(len(measure_runs), output)
+    for run_length, measure_size in measure_runs:
+        encode_varint(run_length, output)
+        encode_varint(measure_size, output)
+    output.extend(exceptions)
+    return bytes(output)
+
+
+def decode_compact(data: bytes) -> str:
+    """
+    The reference decoder of the compact format, see encode_compact.
+
+    :param data: The encoded chart.
+    :return: The resonite string.
+    """
+    if data[:len(COMPACT_MAGIC)] != COMPACT_MAGIC:
+        raise ValueError("Not compact chart data")
+    position = len(COMPACT_MAGIC)
+    if data[position] != COMPACT_VERSION:
+        raise ValueError(f"Unsupported compact chart version {data[position]}")
+    position += 1
+    arrow_count, position = decode_varint(data, position)
+    record_count, position = decode_varint(data, position)
+    exception_count, position = decode_varint(data, position)
+
+    time_fields = []
+    ticks = 0
+    for _ in range(record_count):
+        delta, position = decode_varint(data, position)
+        ticks += zigzag_decode(delta)
+        time_fields.append(format_time_ticks(ticks))
+
+    arrow_bits_length = (record_count * arrow_count + 7) // 8
+    arrow_bits = data[position:position + arrow_bits_length]
+    position += arrow_bits_length
+    arrows = ["1" if arrow_bits[bit_index >> 3] & (1 << (bit_index & 7)) else "0"
+              for bit_index in range(record_count * arrow_count)]
+
+    measure_size_fields = []
+    run_count, position = decode_varint(data, position)
+    for _ in range(run_count):
+        run_length, position = decode_varint(data, position)
+        measure_size, position = decode_varint(data, position)
+        measure_size_fields.extend([f"{measure_size:0{MEASURE_SIZE_FIELD_WIDTH}d}"] * run_length)
+
+    record_index = 0
+    for _ in range(exception_count):
+        record_index_delta, position = decode_varint(data, position)
+        arrow_index, position = decode_varint(data, position)
+        record_index += record_index_delta
+        arrows[record_index * arrow_count + arrow_index] = chr(data[position])
+        position += 1
+
+    if len(measure_size_fields) != record_count:
+        raise ValueError("The measure sizes do not match the record count")
+    return "".join(time_fields[i] + "".join(arrows[i * arrow_count:(i + 1) * arrow_count]) + measure_size_fields[i]
+                   for i in range(record_count))
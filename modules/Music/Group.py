@@ -1,28 +1,38 @@
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Dict, Iterable, Callable
+from concurrent.futures import Executor, ProcessPoolExecutor
 import json
 import logging
 from natsort import natsorted
-from modules.Music.Beat import precalculate_beats, get_beats_as_resonite_string
+from modules.Music.Beat import precalculate_beats, get_beats_as_resonite_string, precalculate_resonite_string, use_numpy_timing_engine
 from modules.Music.Chart import Chart
 from modules.Music.Song import Song
 import os
-from modules.utils.FileUtils import read_file_with_encodings
+from modules.utils.FileUtils import decode_with_encodings, compute_content_hash
+from modules.utils.DirectoryIndex import DirectoryIndex
 from uuid import uuid4
 
 from modules.SQLiteConnector import SQLiteConnector
+from modules.AudioJobQueue import AudioJobQueue
+from modules.ChartNotesCache import ChartNotesCache
 
 logger = logging.getLogger(__name__)
 
 class Group:
-    def __init__(self, name: str):
+    def __init__(self, name: str, directory_path: Optional[str] = None):
         """
         :param name: The name of the group
+        :param directory_path: The absolute path of the group directory
         """
         self.name = name
+        self.directory_path = directory_path
         self.songs: List[Song] = []
         self.song_count = 0
         self.single_songs: List[Song] = []
         self.double_songs: List[Song] = []
+        # Rendered by render_response_strings once all songs are added
+        self.display_name = ""
+        # The GUIDs of the charts of all songs, song after song, to fetch a user's personal bests in one query
+        self.chart_ids: List[str] = []
 
     @property
     def is_single_group(self) -> bool:
@@ -33,252 +43,561 @@ class Group:
     def is_double_group(self) -> bool:
         return len(self.double_songs) > 0
 
+    def get_display_name(self) -> str:
+        return f"{self.name} ({len(self.songs)} ♫)"
 
+    def render_response_strings(self):
+        """
+        Renders the strings served for the group and its songs, so routes only look them up.
+        """
+        self.display_name = self.get_display_name()
+        self.chart_ids = [chart.chart_id for song in self.songs for chart in song.charts]
+        for song in self.songs:
+            song.render_response_strings()
+
+
+
+def ingest_song(song_info: dict,
+                song_id: str,
+                sm_file_contents: str,
+                timing_engine: str = "auto",
+                defer_audio_jobs: bool = False) -> Tuple[Song, List[str]]:
+    """
+    Builds a Song from its SM file contents and precalculates the resonite string of each of its charts.
+
+    This is the CPU-bound part of the scan. It runs in a worker process when parallel ingest is enabled,
+    so it must not touch the database; the caller writes the results.
+
+    :param song_info: The song info dict gathered while walking the group directory.
+    :param song_id: The GUID to assign to the song.
+    :param sm_file_contents: The contents of the song's SM file.
+    :param timing_engine: The engine used to precalculate the beats, see use_numpy_timing_engine.
+    :param defer_audio_jobs: Whether to leave ogg conversion and sample creation to the audio job queue.
+    :return: A tuple containing the Song and the GUIDs of the charts whose beats were precalculated.
+    """
+    song = Song(
+                song_id=song_id,
+                name=song_info['song_dir'],
+                audio_file=song_info['audio_file'],
+                directory=song_info['song_path'],
+                sm_file=song_info['sm_file'],
+                sm_file_contents=sm_file_contents,
+                directory_index=song_info['directory_index'],
+                defer_audio_jobs=defer_audio_jobs)
+
+    # Load charts and song info from SM file contents.
+    # Each chart gets a new GUID,
+    # but we'll overwrite this with the existing chart GUID if the chart is already in the database
+    song.load_song_info_and_charts_from_sm_file_contents(song.sm_file_contents)
+
+    precalculated_chart_ids = []
+    if not song.loaded:
+        return song, precalculated_chart_ids
+
+    use_numpy = use_numpy_timing_engine(timing_engine)
+    for chart in song.charts:
+        try:
+            if use_numpy:
+                # Produces the same string without building Beat objects, so chart.beats stays empty
+                resonite_string, note_count = precalculate_resonite_string(song=song, chart=chart, exclude_inactive_beats=True)
+            else:
+                beats, note_count = precalculate_beats(song=song, chart=chart, exclude_inactive_beats=True)
+                resonite_string = get_beats_as_resonite_string(beats)
+                chart.beats = beats
+        except Exception as e:
+            logger.error(f"Error precalculating beats for chart '{chart.difficulty_name}': {e}")
+            continue
 
-def find_songs(root_directory: str, sqlite_db_connector: SQLiteConnector) -> Tuple[List[Group], List[Group], List[Group]]:
+        chart.note_count = note_count
+        chart.beats_as_resonite_string = resonite_string
+        # Compressed here, in the worker process when ingesting in parallel, so it is stored and served as is
+        chart.compress_beats_as_resonite_string()
+        precalculated_chart_ids.append(chart.chart_id)
+
+    return song, precalculated_chart_ids
+
+
+def find_songs(root_directory: str,
+               sqlite_db_connector: SQLiteConnector,
+               ingest_workers: int = 1,
+               timing_engine: str = "auto",
+               audio_job_queue: Optional[AudioJobQueue] = None,
+               chart_notes_cache: Optional[ChartNotesCache] = None) -> Tuple[List[Group], List[Group], List[Group]]:
+    """
+    Scans the root directory for groups and songs, loading unchanged songs from the database
+    and ingesting new or changed songs from their SM files.
+
+    :param root_directory: The directory containing the group directories.
+    :param sqlite_db_connector: The connector used to read and write the song database.
+    :param ingest_workers: The number of worker processes used to ingest new or changed songs.
+                           With 1 (the default), songs are ingested serially in this process.
+    :param timing_engine: The engine used to precalculate the beats, see use_numpy_timing_engine.
+    :param audio_job_queue: Optional queue to run ogg conversions and sample creation on in the background.
+                            Without one, they are done inline while ingesting.
+    :param chart_notes_cache: Optional cache to read the resonite strings of charts through, so charts only keep
+                              their metadata in memory. Without one, charts keep their compressed resonite strings.
+    :return: A tuple containing all groups, groups with single charts and groups with double charts.
+    """
     root_directory = os.path.abspath(root_directory)
-    groups = []
-    single_groups = []
-    double_groups = []
-    valid_sm_file_paths = set()
-    valid_song_directory_paths = set()
-    valid_group_directory_paths = set()
+    group_directory_paths = []
 
-    for group_dir in os.listdir(root_directory):
+    root_directory_index = DirectoryIndex(root_directory)
+    for group_dir in root_directory_index.names:
         if group_dir == "ignore":  # Skip ignored folders
             continue
 
         group_directory_path = os.path.join(root_directory, group_dir)
-        if not os.path.isdir(group_directory_path):
+        if not root_directory_index.is_dir(group_dir):
             logger.warning(f"Skipping non-directory '{group_dir}'.")
             continue
+        group_directory_paths.append(group_directory_path)
 
-        group = Group(group_dir)
-        group_guid = sqlite_db_connector.insert_group(name=group.name, directory_path=group_directory_path)
-        valid_group_directory_paths.add(group_directory_path)
-
-        # Initialize per group lists
-        sm_file_paths = []
-        song_directory_paths = []
-        song_info_list = []
-
-        for song_dir in os.listdir(group_directory_path):
-            song_path = os.path.join(group_directory_path, song_dir)
-            if os.path.isdir(song_path):
-                song_files = os.listdir(song_path)
-                audio_file = next(
-                    (f for f in song_files if f.endswith(('.ogg', '.mp3')) and "reso-dmx-sample" not in f), None)
-                sm_file = next((f for f in song_files if f.endswith(('.sm', '.ssc'))), None)
-                #sm_file = next((f for f in song_files if f.endswith(('.sm'))), None)
-
-                if audio_file and sm_file:
-                    sm_file_path = os.path.join(song_path, sm_file)
-                    sm_file_paths.append(sm_file_path)
-                    song_directory_paths.append(song_path)
-                    # Store info for later processing
-                    song_info_list.append({'song_dir': song_dir,
-                                           'audio_file': audio_file,
-                                           'song_path': song_path,
-                                           'sm_file': sm_file,
-                                           'sm_file_path': sm_file_path})
-
-        # Batch fetch SM files and songs from the database
-        sm_files_from_db = sqlite_db_connector.get_sm_files_for_paths(sm_file_paths)
-
-        for song_info in song_info_list:
-            song_dir = song_info['song_dir']
-            audio_file = song_info['audio_file']
-            song_path = song_info['song_path']
-            sm_file = song_info['sm_file']
-            sm_file_path = song_info['sm_file_path']
-
-            last_modified = os.path.getmtime(sm_file_path)
-            stored_sm_file_entry = sm_files_from_db.get(sm_file_path)
-
-            song_modification_in_db_needed = False
-
-            if stored_sm_file_entry:
-                stored_last_modified = stored_sm_file_entry['last_modified']
-                if last_modified <= stored_last_modified:
-                    # SM file has not changed, load content from db
-                    sm_file_contents = stored_sm_file_entry['content']
-                    # logger.info(f"Loading SM file from database for song '{song_dir}'.")
-                    song = Song(
-                                song_id=stored_sm_file_entry['song_id'],
-                                name=song_dir,
-                                audio_file=audio_file,
-                                directory=song_path,
-                                sm_file=sm_file,
-                                sm_file_contents=sm_file_contents)
-                else:
-                    # SM file has changed, read from filesystem
-                    try:
-                        sm_file_contents = read_file_with_encodings(sm_file_path)
-                    except Exception as e:
-                        logger.error(f"Failed to load {sm_file_path}: {e}")
-                        continue
-                    logger.info(f"SM file has changed, loading from filesystem for song '{song_dir}'.")
-
-                    # Song gets a new ID
-                    song_id = str(uuid4())
-
-                    song = Song(
-                                song_id=song_id,
-                                name=song_dir,
-                                audio_file=audio_file,
-                                directory=song_path,
-                                sm_file=sm_file,
-                                sm_file_contents=sm_file_contents)
-
-
-                    # Update the SM file in the database
-                    sqlite_db_connector.insert_or_update_sm_file(
-                        path=sm_file_path,
-                        song_id=song_id,
-                        content=sm_file_contents)
-                    song_modification_in_db_needed = True
-
-            else:
-                # SM file not in db, read from filesystem
-                try:
-                    sm_file_contents = read_file_with_encodings(sm_file_path)
-                except Exception as e:
-                    logger.error(f"Failed to load {sm_file_path}: {e}")
-                    continue
-                logger.info(f"SM file not in database, loading from filesystem for song '{song_dir}'.")
-
-                # Song gets a new ID
-                song_id = str(uuid4())
-
-                song = Song(
-                            song_id=song_id,
-                            name=song_dir,
-                            audio_file=audio_file,
-                            directory=song_path,
-                            sm_file=sm_file,
-                            sm_file_contents=sm_file_contents)
-
-                # Insert the SM file into the database
-                sqlite_db_connector.insert_or_update_sm_file(
-                                                             path=sm_file_path,
-                                                             song_id=song_id,
-                                                             content=sm_file_contents)
-                song_modification_in_db_needed = True
-
-            # Now that we've loaded the song, modify the song in the database if needed
-            if song_modification_in_db_needed:
-                # Load charts and song info from SM file contents.
-                # Each chart gets a new GUID,
-                # but we'll overwrite this with the existing chart GUID if the chart is already in the database
-                song.load_song_info_and_charts_from_sm_file_contents(song.sm_file_contents)
-
-                if not song.loaded:
-                    continue
-
-                sqlite_db_connector.upsert_song(song_guid=song.song_id,
-                                                group_guid=group_guid,
-                                                name=song.name,
-                                                title=song.title,
-                                                directory_path=song.directory,
-                                                artist=song.artist,
-                                                sample_start=song.sample_start,
-                                                sample_length=song.sample_length,
-                                                duration=song.duration,
-                                                offset=song.offset,
-                                                bpms=song.bpms,
-                                                stops=song.stops,
-                                                chart_guids=song.chart_guids)
-                # Then insert charts into the database
-                for chart in song.charts:
-                    try:
-                        beats, note_count = precalculate_beats(song=song, chart=chart, exclude_inactive_beats=True)
-                    except Exception as e:
-                        logger.error(f"Error precalculating beats for chart '{chart.difficulty_name}': {e}")
-                        continue
-
-                    resonite_string = get_beats_as_resonite_string(beats)
-
-                    chart.note_count = note_count
-                    chart.beats = beats
-                    chart.beats_as_resonite_string = resonite_string
-
-                    sqlite_db_connector.insert_chart(
-                                                     chart_guid=chart.chart_id,
-                                                     song_guid=song.song_id,
-                                                     sm_file_path=sm_file_path,
-                                                     mode=chart.mode,
-                                                     difficulty_name=chart.difficulty_name,
-                                                     difficulty_level=chart.difficulty_level,
-                                                     note_count=chart.note_count,
-                                                     beats_as_resonite_string=chart.beats_as_resonite_string)
-            else:
-                # The song and its charts are up to date in the database.
-
-                # Load charts and song info from sqlite database
-                song_info = sqlite_db_connector.get_song_by_song_guid(song.song_id)
-                song.title = song_info['title']
-                song.artist = song_info['artist']
-                song.sample_start = song_info['sample_start']
-                song.sample_length = song_info['sample_length']
-                song.set_duration(song_info['duration'])
-
-                song.offset = song_info['offset']
-                song.bpms = song_info['bpms']
-
-                song.min_bpm = min(bpm[1] for bpm in song.bpms)
-                song.max_bpm = max(bpm[1] for bpm in song.bpms)
-
-                song.stops = song_info['stops']
-
-                # # Assign the chart guids from the database to each chart, overwriting the new guids we set earlier
-                # chart_guids_from_db = sqlite_db_connector.get_chart_ids_by_song_guid(song.song_id)
-                # song.chart_guids = chart_guids_from_db
-                # for i in range(len(song.charts)):
-                #     song.charts[i].chart_id = chart_guids_from_db[i]
-
-                charts_info = sqlite_db_connector.get_charts_by_song_guid(song.song_id)
-                # First 10 charts. Though there should not ever be more than 5 charts per song
-                for chart_info in charts_info[:10]:
-                    chart = Chart(
-                            chart_id=chart_info["guid"],
-                            difficulty_name=chart_info["difficulty_name"],
-                            difficulty_level=chart_info["difficulty_level"],
-                            measures=None,
-                            mode=chart_info["mode"],
-                            note_count=chart_info["note_count"],
-                            beats_as_resonite_string=chart_info["beats_as_resonite_string"]
-                        )
-                    song.charts.append(chart)
-                    if chart.is_single_chart:
-                        song.single_charts.append(chart)
-                    if chart.is_double_chart:
-                        song.double_charts.append(chart)
-
-            valid_sm_file_paths.add(sm_file_path)
-            valid_song_directory_paths.add(song.directory)
-            group.songs.append(song)
-            if song.is_single_song:
-                group.single_songs.append(song)
-            if song.is_double_song:
-                group.double_songs.append(song)
-
-        groups.append(group)
-
-        if group.is_single_group:
-            single_groups.append(group)
-
-        if group.is_double_group:
-            double_groups.append(group)
-
-        logger.info(f"Processed group '{group.name}' with {len(group.songs)} songs.")
+    groups, valid_song_directory_paths, valid_sm_file_paths = scan_groups(
+                                                                group_directory_paths=group_directory_paths,
+                                                                sqlite_db_connector=sqlite_db_connector,
+                                                                ingest_workers=ingest_workers,
+                                                                timing_engine=timing_engine,
+                                                                audio_job_queue=audio_job_queue,
+                                                                chart_notes_cache=chart_notes_cache)
 
     # Clean up orphaned records
-    sqlite_db_connector.cleanup_orphaned_records(valid_group_directory_paths,
+    sqlite_db_connector.cleanup_orphaned_records(set(group_directory_paths),
                                                  valid_song_directory_paths,
                                                  valid_sm_file_paths)
 
+    single_groups = [group for group in groups if group.is_single_group]
+    double_groups = [group for group in groups if group.is_double_group]
+
     # Sort groups by name (natural sort)
     groups = natsorted(groups, key=lambda x: x.name)
 
     return groups, single_groups, double_groups
 
+
+def rescan_groups(root_directory: str,
+                  group_directory_paths: Iterable[str],
+                  sqlite_db_connector: SQLiteConnector,
+                  ingest_workers: int = 1,
+                  timing_engine: str = "auto",
+                  audio_job_queue: Optional[AudioJobQueue] = None,
+                  chart_notes_cache: Optional[ChartNotesCache] = None,
+                  on_rescanned: Optional[Callable[[Dict[str, Optional[Group]]], None]] = None
+                  ) -> Dict[str, Optional[Group]]:
+    """
+    Rescans only the given group directories, e.g. after a pack was added, removed or changed.
+    Unchanged songs in those groups are loaded from the database, and records of songs, charts and groups
+    that no longer exist are removed. Groups outside of the given directories are not touched.
+
+    :param root_directory: The directory containing the group directories.
+    :param group_directory_paths: The paths of the group directories to rescan.
+    :param sqlite_db_connector: The connector used to read and write the song database.
+    :param ingest_workers: The number of worker processes used to ingest new or changed songs.
+    :param timing_engine: The engine used to precalculate the beats, see use_numpy_timing_engine.
+    :param audio_job_queue: Optional queue to run ogg conversions and sample creation on in the background.
+                            Without one, they are done inline while ingesting.
+    :param chart_notes_cache: Optional cache to read the resonite strings of charts through, so charts only keep
+                              their metadata in memory. Without one, charts keep their compressed resonite strings.
+    :param on_rescanned: Called with the return value before the records that no longer exist are removed,
+                         e.g. to stop serving the previous groups, whose charts may read their notes from the database.
+    :return: A dictionary mapping each group directory path to its rescanned Group,
+             or to None if the directory no longer holds a group.
+    """
+    root_directory = os.path.abspath(root_directory)
+    group_directory_paths = {os.path.join(root_directory, os.path.basename(os.path.normpath(path)))
+                             for path in group_directory_paths}
+    existing_group_directory_paths = [path for path in group_directory_paths
+                                      if os.path.basename(path) != "ignore" and os.path.isdir(path)]
+
+    groups, valid_song_directory_paths, valid_sm_file_paths = scan_groups(
+                                                                group_directory_paths=existing_group_directory_paths,
+                                                                sqlite_db_connector=sqlite_db_connector,
+                                                                ingest_workers=ingest_workers,
+                                                                timing_engine=timing_engine,
+                                                                audio_job_queue=audio_job_queue,
+                                                                chart_notes_cache=chart_notes_cache)
+
+    rescanned_groups: Dict[str, Optional[Group]] = {path: None for path in group_directory_paths}
+    for group in groups:
+        rescanned_groups[group.directory_path] = group
+        logger.info(f"Rescanned group '{group.name}' with {len(group.songs)} songs.")
+    if on_rescanned:
+        on_rescanned(rescanned_groups)
+
+    sqlite_db_connector.cleanup_orphaned_records_in_groups(group_directory_paths,
+                                                           set(existing_group_directory_paths),
+                                                           valid_song_directory_paths,
+                                                           valid_sm_file_paths)
+    return rescanned_groups
+
+
+def scan_groups(group_directory_paths: List[str],
+                sqlite_db_connector: SQLiteConnector,
+                ingest_workers: int = 1,
+                timing_engine: str = "auto",
+                audio_job_queue: Optional[AudioJobQueue] = None,
+                chart_notes_cache: Optional[ChartNotesCache] = None) -> Tuple[List[Group], set, set]:
+    """
+    Builds the groups in the given directories, ingesting new or changed songs and loading the rest from the database.
+
+    :param group_directory_paths: The paths of the group directories to scan.
+    :param sqlite_db_connector: The connector used to read and write the song database.
+    :param ingest_workers: The number of worker processes used to ingest new or changed songs.
+    :param timing_engine: The engine used to precalculate the beats, see use_numpy_timing_engine.
+    :param audio_job_queue: Optional queue to run ogg conversions and sample creation on in the background.
+                            Without one, they are done inline while ingesting.
+    :param chart_notes_cache: Optional cache to read the resonite strings of charts through, so charts only keep
+                              their metadata in memory. Without one, charts keep their compressed resonite strings.
+    :return: A tuple containing the groups (in the given order), the valid song directory paths and the valid SM file paths.
+    """
+    groups = []
+    valid_sm_file_paths = set()
+    valid_song_directory_paths = set()
+
+    # Only the CPU-bound ingest is fanned out to the pool.
+    # Every database write still happens here, in the order the songs were found.
+    executor = ProcessPoolExecutor(max_workers=ingest_workers) if ingest_workers > 1 else None
+    if executor:
+        logger.info(f"Ingesting new or changed songs with {ingest_workers} worker processes.")
+
+    try:
+        scanned_groups = []
+        with sqlite_db_connector.transaction():
+            for group_directory_path in group_directory_paths:
+                group = Group(os.path.basename(group_directory_path), directory_path=group_directory_path)
+                group_guid = sqlite_db_connector.insert_group(name=group.name, directory_path=group_directory_path)
+
+                song_entries = scan_group_directory(group_directory_path=group_directory_path,
+                                                    sqlite_db_connector=sqlite_db_connector,
+                                                    executor=executor,
+                                                    timing_engine=timing_engine,
+                                                    defer_audio_jobs=audio_job_queue is not None)
+                scanned_groups.append((group, group_guid, song_entries))
+
+        for group, group_guid, song_entries in scanned_groups:
+            # The writes for a whole group are committed at once rather than per song and chart
+            with sqlite_db_connector.transaction():
+                for song_entry in song_entries:
+                    song = load_scanned_song(song_entry=song_entry,
+                                             group_guid=group_guid,
+                                             sqlite_db_connector=sqlite_db_connector,
+                                             timing_engine=timing_engine,
+                                             defer_audio_jobs=audio_job_queue is not None,
+                                             chart_notes_cache=chart_notes_cache)
+                    if song is None:
+                        continue
+
+                    valid_sm_file_paths.add(song_entry['song_info']['sm_file_path'])
+                    valid_song_directory_paths.add(song.directory)
+                    group.songs.append(song)
+                    if song.is_single_song:
+                        group.single_songs.append(song)
+                    if song.is_double_song:
+                        group.double_songs.append(song)
+
+            group.render_response_strings()
+
+            # Submitted after the commit, since the job queue writes job state to the database from its own threads
+            if audio_job_queue:
+                for song in group.songs:
+                    audio_job_queue.submit_song_jobs(song)
+
+            groups.append(group)
+            logger.info(f"Processed group '{group.name}' with {len(group.songs)} songs.")
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return groups, valid_song_directory_paths, valid_sm_file_paths
+
+
+def scan_group_directory(group_directory_path: str,
+                         sqlite_db_connector: SQLiteConnector,
+                         executor: Optional[Executor] = None,
+                         timing_engine: str = "auto",
+                         defer_audio_jobs: bool = False) -> List[dict]:
+    """
+    Finds the songs in a group directory and decides, per song, whether it can be loaded from the database
+    or has to be ingested from its SM file. Songs that need ingesting are submitted to the executor if one is given.
+
+    :param group_directory_path: The path of the group directory.
+    :param sqlite_db_connector: The connector used to read the song database.
+    :param executor: Optional executor to run ingest_song on.
+    :param timing_engine: The engine used to precalculate the beats, see use_numpy_timing_engine.
+    :param defer_audio_jobs: Whether ingested songs leave ogg conversion and sample creation to the audio job queue.
+    :return: A list of song entries, in directory order, to be passed to load_scanned_song.
+    """
+    sm_file_paths = []
+    song_info_list = []
+
+    # Each directory is listed once, and everything the scan and Song need is resolved from these indexes
+    group_directory_index = DirectoryIndex(group_directory_path)
+    for song_dir in group_directory_index.names:
+        song_path = os.path.join(group_directory_path, song_dir)
+        if group_directory_index.is_dir(song_dir):
+            song_directory_index = DirectoryIndex(song_path)
+            song_files = song_directory_index.names
+            audio_file = next(
+                (f for f in song_files if f.endswith(('.ogg', '.mp3')) and "reso-dmx-sample" not in f), None)
+            sm_file = next((f for f in song_files if f.endswith(('.sm', '.ssc'))), None)
+            #sm_file = next((f for f in song_files if f.endswith(('.sm'))), None)
+
+            if audio_file and sm_file:
+                sm_file_path = os.path.join(song_path, sm_file)
+                sm_file_paths.append(sm_file_path)
+                # Store info for later processing
+                song_info_list.append({'song_dir': song_dir,
+                                       'audio_file': audio_file,
+                                       'song_path': song_path,
+                                       'sm_file': sm_file,
+                                       'sm_file_path': sm_file_path,
+                                       'directory_index': song_directory_index})
+
+    # Batch fetch SM files and songs from the database
+    # The stored contents are not needed: unchanged songs are loaded from the songs and charts tables
+    sm_files_from_db = sqlite_db_connector.get_sm_files_for_paths(sm_file_paths, include_content=False)
+
+    song_entries = []
+    for song_info in song_info_list:
+        song_dir = song_info['song_dir']
+        sm_file_path = song_info['sm_file_path']
+
+        sm_file_stat = song_info['directory_index'].stat(song_info['sm_file'])
+        stored_sm_file_entry = sm_files_from_db.get(sm_file_path)
+
+        # Records stored before sizes were recorded only have the modification time to go by
+        if (stored_sm_file_entry and sm_file_stat.st_mtime <= stored_sm_file_entry['last_modified']
+                and stored_sm_file_entry['size'] in (None, sm_file_stat.st_size)):
+            # SM file has not changed, load the song from db
+            # logger.info(f"Loading SM file from database for song '{song_dir}'.")
+            song_entries.append({'song_info': song_info,
+                                 'song_id': stored_sm_file_entry['song_id'],
+                                 'sm_file_contents': None,
+                                 'ingest': False})
+            continue
+
+        # SM file is not in the database or its size or modification time changed, read from filesystem
+        try:
+            with open(sm_file_path, 'rb') as f:
+                sm_file_bytes = f.read()
+        except OSError as e:
+            logger.error(f"Failed to load {sm_file_path}: {e}")
+            continue
+
+        sm_file_contents = decode_with_encodings(sm_file_bytes, sm_file_path)
+        new_sm_file_stat = {'last_modified': sm_file_stat.st_mtime,
+                            'size': sm_file_stat.st_size,
+                            'content_hash': compute_content_hash(sm_file_bytes)}
+
+        if stored_sm_file_entry and sm_file_content_is_unchanged(stored_sm_file_entry=stored_sm_file_entry,
+                                                                 sm_file_path=sm_file_path,
+                                                                 sm_file_contents=sm_file_contents,
+                                                                 content_hash=new_sm_file_stat['content_hash'],
+                                                                 sqlite_db_connector=sqlite_db_connector):
+            # Copied, restored or touched, but the same bytes. The song keeps its GUID, and so its scores.
+            logger.info(f"SM file was modified but its content did not change, loading from database for song '{song_dir}'.")
+            song_entries.append({'song_info': song_info,
+                                 'song_id': stored_sm_file_entry['song_id'],
+                                 'sm_file_contents': None,
+                                 'sm_file_stat': new_sm_file_stat,
+                                 'ingest': False})
+            continue
+
+        if stored_sm_file_entry:
+            logger.info(f"SM file has changed, loading from filesystem for song '{song_dir}'.")
+        else:
+            logger.info(f"SM file not in database, loading from filesystem for song '{song_dir}'.")
+
+        # Song gets a new ID
+        song_id = str(uuid4())
+        song_entry = {'song_info': song_info,
+                      'song_id': song_id,
+                      'sm_file_contents': sm_file_contents,
+                      'sm_file_stat': new_sm_file_stat,
+                      'ingest': True}
+        if executor:
+            song_entry['future'] = executor.submit(ingest_song, song_info, song_id, sm_file_contents,
+                                                   timing_engine, defer_audio_jobs)
+        song_entries.append(song_entry)
+
+    return song_entries
+
+
+def sm_file_content_is_unchanged(stored_sm_file_entry: dict,
+                                 sm_file_path: str,
+                                 sm_file_contents: str,
+                                 content_hash: str,
+                                 sqlite_db_connector: SQLiteConnector) -> bool:
+    """
+    Compares an SM file read from the filesystem with the one stored in the database.
+
+    :param stored_sm_file_entry: The stored record, as returned by get_sm_files_for_paths.
+    :param sm_file_path: Path of the SM file.
+    :param sm_file_contents: The decoded contents of the SM file.
+    :param content_hash: The hash of the bytes of the SM file.
+    :param sqlite_db_connector: The connector used to read the stored contents of records that have no hash.
+    :return: Whether the SM file has the content it had when it was stored.
+    """
+    if stored_sm_file_entry['content_hash'] is not None:
+        return stored_sm_file_entry['content_hash'] == content_hash
+
+    # Stored before hashes were recorded, so compare the contents instead
+    stored_sm_file_entry = sqlite_db_connector.get_sm_files_for_paths([sm_file_path]).get(sm_file_path)
+    return stored_sm_file_entry is not None and stored_sm_file_entry['content'] == sm_file_contents
+
+
+def load_scanned_song(song_entry: dict,
+                      group_guid: str,
+                      sqlite_db_connector: SQLiteConnector,
+                      timing_engine: str = "auto",
+                      defer_audio_jobs: bool = False,
+                      chart_notes_cache: Optional[ChartNotesCache] = None) -> Optional[Song]:
+    """
+    Turns a song entry from scan_group_directory into a Song, either by writing the ingested song
+    and its charts to the database or by loading the song and its charts from the database.
+
+    :param song_entry: A song entry returned by scan_group_directory.
+    :param group_guid: The GUID of the group the song belongs to.
+    :param sqlite_db_connector: The connector used to read and write the song database.
+    :param timing_engine: The engine used to precalculate the beats, see use_numpy_timing_engine.
+    :param defer_audio_jobs: Whether the song leaves ogg conversion and sample creation to the audio job queue.
+                             The caller submits the song's jobs.
+    :param chart_notes_cache: Optional cache the charts read their resonite strings through, once they are stored.
+    :return: The Song, or None if the song could not be loaded.
+    """
+    song_info = song_entry['song_info']
+    sm_file_path = song_info['sm_file_path']
+
+    if not song_entry['ingest']:
+        song = Song(
+                    song_id=song_entry['song_id'],
+                    name=song_info['song_dir'],
+                    audio_file=song_info['audio_file'],
+                    directory=song_info['song_path'],
+                    sm_file=song_info['sm_file'],
+                    sm_file_contents=song_entry['sm_file_contents'],
+                    directory_index=song_info['directory_index'],
+                    defer_audio_jobs=defer_audio_jobs)
+        if not load_song_from_database(song=song,
+                                       sqlite_db_connector=sqlite_db_connector,
+                                       chart_notes_cache=chart_notes_cache):
+            logger.warning(f"Song '{song_info['song_dir']}' is not in the database, skipping it.")
+            return None
+        if 'sm_file_stat' in song_entry:
+            sqlite_db_connector.update_sm_file_stat(path=sm_file_path, **song_entry['sm_file_stat'])
+        return song
+
+    if 'future' in song_entry:
+        try:
+            song, precalculated_chart_ids = song_entry['future'].result()
+        except Exception as e:
+            logger.error(f"Failed to ingest song '{song_info['song_dir']}' in a worker process: {e}")
+            return None
+    else:
+        song, precalculated_chart_ids = ingest_song(song_info=song_info,
+                                                    song_id=song_entry['song_id'],
+                                                    sm_file_contents=song_entry['sm_file_contents'],
+                                                    timing_engine=timing_engine,
+                                                    defer_audio_jobs=defer_audio_jobs)
+
+    # Update the SM file in the database
+    sqlite_db_connector.insert_or_update_sm_file(
+                                                 path=sm_file_path,
+                                                 song_id=song.song_id,
+                                                 content=song.sm_file_contents,
+                                                 **song_entry['sm_file_stat'])
+
+    # Now that we've loaded the song, modify the song in the database
+    if not song.loaded:
+        return None
+
+    sqlite_db_connector.upsert_song(song_guid=song.song_id,
+                                    group_guid=group_guid,
+                                    name=song.name,
+                                    title=song.title,
+                                    directory_path=song.directory,
+                                    artist=song.artist,
+                                    sample_start=song.sample_start,
+                                    sample_length=song.sample_length,
+                                    duration=song.duration,
+                                    offset=song.offset,
+                                    bpms=song.bpms,
+                                    stops=song.stops,
+                                    chart_guids=song.chart_guids)
+    # Then insert charts into the database
+    inserted_chart_guids = sqlite_db_connector.insert_charts({"chart_guid": chart.chart_id,
+                                                              "song_guid": song.song_id,
+                                                              "sm_file_path": sm_file_path,
+                                                              "mode": chart.mode,
+                                                              "difficulty_name": chart.difficulty_name,
+                                                              "difficulty_level": chart.difficulty_level,
+                                                              "note_count": chart.note_count,
+                                                              "compressed_beats_as_resonite_string": chart.compressed_beats_as_resonite_string,
+                                                              "beats_format": chart.beats_format,
+                                                              "brotli_beats_as_resonite_string": chart.brotli_beats_as_resonite_string}
+                                                             for chart in song.charts if chart.chart_id in precalculated_chart_ids)
+    if chart_notes_cache is not None:
+        # Charts that were not inserted (e.g. a duplicate difficulty) keep their resonite strings in memory
+        for chart in song.charts:
+            if chart.chart_id in inserted_chart_guids:
+                chart.release_notes(chart_notes_cache)
+    return song
+
+
+def load_song_from_database(song: Song,
+                            sqlite_db_connector: SQLiteConnector,
+                            chart_notes_cache: Optional[ChartNotesCache] = None) -> bool:
+    """
+    Populates an up to date song and its charts from the database.
+
+    :param song: The song, created with the song GUID stored for its SM file.
+    :param sqlite_db_connector: The connector used to read the song database.
+    :param chart_notes_cache: Optional cache the charts read their resonite strings through.
+                              Without one, the compressed resonite strings are loaded with the charts.
+    :return: Whether the song was found. It is not if its SM file was stored but the song failed to load.
+    """
+    # Load charts and song info from sqlite database
+    song_info = sqlite_db_connector.get_song_by_song_guid(song.song_id)
+    if song_info is None:
+        return False
+    song.title = song_info['title']
+    song.artist = song_info['artist']
+    song.sample_start = song_info['sample_start']
+    song.sample_length = song_info['sample_length']
+    song.set_duration(song_info['duration'])
+
+    song.offset = song_info['offset']
+    song.bpms = song_info['bpms']
+
+    song.min_bpm = min(bpm[1] for bpm in song.bpms)
+    song.max_bpm = max(bpm[1] for bpm in song.bpms)
+
+    song.stops = song_info['stops']
+
+    # # Assign the chart guids from the database to each chart, overwriting the new guids we set earlier
+    # chart_guids_from_db = sqlite_db_connector.get_chart_ids_by_song_guid(song.song_id)
+    # song.chart_guids = chart_guids_from_db
+    # for i in range(len(song.charts)):
+    #     song.charts[i].chart_id = chart_guids_from_db[i]
+
+    charts_info = sqlite_db_connector.get_charts_by_song_guid(song.song_id, include_notes=chart_notes_cache is None)
+    # First 10 charts. Though there should not ever be more than 5 charts per song
+    for chart_info in charts_info[:10]:
+        chart = Chart(
+                chart_id=chart_info["guid"],
+                difficulty_name=chart_info["difficulty_name"],
+                difficulty_level=chart_info["difficulty_level"],
+                measures=None,
+                mode=chart_info["mode"],
+                note_count=chart_info["note_count"],
+                compressed_beats_as_resonite_string=chart_info["compressed_beats_as_resonite_string"],
+                beats_format=chart_info["beats_format"],
+                brotli_beats_as_resonite_string=chart_info["brotli_beats_as_resonite_string"],
+                has_brotli_beats_as_resonite_string=chart_info["has_brotli_beats_as_resonite_string"],
+                notes_cache=chart_notes_cache
+            )
+        song.charts.append(chart)
+        if chart.is_single_chart:
+            song.single_charts.append(chart)
+        if chart.is_double_chart:
+            song.double_charts.append(chart)
+    return True
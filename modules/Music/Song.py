@@ -8,8 +8,9 @@ from mutagen.id3 import ID3
 from mutagen.oggvorbis import OggVorbis
 from mutagen.mp3 import MP3
 from modules.Music.Chart import Chart
-from pydub import AudioSegment
+from modules.utils.AudioUtils import SAMPLE_FILE_NAME, CONVERTIBLE_AUDIO_EXTENSIONS, convert_audio_to_ogg, export_sample_ogg
 from modules.utils.StringUtils import format_seconds
+from modules.utils.DirectoryIndex import DirectoryIndex
 import logging
 import json
 import simfile
@@ -19,15 +20,42 @@ from simfile.timing import Beat as SimfileBeat
 logger = logging.getLogger(__name__)
 current_id = 0
 
+# The width each chart's block is padded to by get_chart_blocks
+CHART_BLOCK_WIDTH = 45
+# Width of a personal best field in fixed-width responses, e.g. "95.50%" or "100%  "
+PERSONAL_BEST_WIDTH = 6
+
+
+def format_personal_best(score: Optional[float]) -> str:
+    """
+    Formats a personal best percentage with 2 decimals, "100%" for a perfect score, and "00.00%" if there is none.
+    """
+    if score is not None:
+        if score == 100 or score == 100.00:
+            return "100%"
+        return f"{score:.2f}%"
+    return "00.00%"
+
+
 class Song:
-    def __init__(self, song_id: Optional[str], name: str, audio_file: str, directory: str, sm_file: str, sm_file_contents: Optional[str] = None):
+    def __init__(self, song_id: Optional[str], name: str, audio_file: str, directory: str, sm_file: str, sm_file_contents: Optional[str] = None,
+                 directory_index: Optional[DirectoryIndex] = None, defer_audio_jobs: bool = False):
         """
         :param name: The name of the song
         :param audio_file: The audio file filename
         :param sm_file: The sm file filename
         :param directory: The directory of the song, containing the audio and sm files
+        :param directory_index: An index of the song directory taken during the scan. If not given, one is built here.
+        :param defer_audio_jobs: Whether to leave ogg conversion and sample creation to the audio job queue
+                                 instead of doing them inline.
         """
         self.directory = directory
+        # All file discovery for the song is resolved against this index
+        self.directory_index = directory_index or DirectoryIndex(directory)
+        self.defer_audio_jobs = defer_audio_jobs
+        # Set while the audio job queue has yet to convert the audio to ogg or create the sample
+        self.pending_ogg_audio_file_path: Optional[str] = None
+        self.sample_pending = False
         self.folder_name = os.path.basename(directory)
         self.name = name
 
@@ -53,6 +81,12 @@ class Song:
         self.sample_start = 0.0
         self.sample_length = 0.0
         self.offset = 0.0
+        # Strings served for the song, rendered once it is loaded by render_response_strings
+        self.bpm_display = ""
+        self.details = ""
+        self.chart_levels = ""
+        self.chart_block_prefixes: List[str] = []
+        self.chart_blocks_without_personal_bests = ""
         self.song_id = song_id or str(uuid4())
         self.detect_jacket()
         self.detect_background()
@@ -75,23 +109,22 @@ class Song:
         # Check if an ogg file with the same base name already exists in the directory
         base_name = os.path.splitext(os.path.basename(original_audio_file_path))[0]
         ogg_file_path = os.path.join(self.directory, f"{base_name}.ogg")
-        if os.path.exists(ogg_file_path):
+        if self.directory_index.exists(f"{base_name}.ogg"):
             return ogg_file_path
 
+        if self.defer_audio_jobs and original_audio_file_path.endswith(CONVERTIBLE_AUDIO_EXTENSIONS):
+            # The audio job queue converts it. Until then, the original audio is served.
+            self.pending_ogg_audio_file_path = ogg_file_path
+            return original_audio_file_path
+
         # Convert the audio to ogg format and save it in the directory with the same base name
         try:
-            if original_audio_file_path.endswith('.mp3'):
-                audio = AudioSegment.from_mp3(original_audio_file_path)
-            elif original_audio_file_path.endswith('.wav'):
-                audio = AudioSegment.from_wav(original_audio_file_path)
-            else:
-                logger.info(f"Unsupported audio format for conversion in {self.directory}")
-                return original_audio_file_path  # Return original if format is unsupported
-
-            # Export the audio as an ogg file
-            audio.export(ogg_file_path, format='ogg')
+            convert_audio_to_ogg(original_audio_file_path, ogg_file_path)
+            self.directory_index.add(os.path.basename(ogg_file_path))
             logger.info(f"Converted {original_audio_file_path} to {ogg_file_path}")
-
+        except ValueError:
+            logger.info(f"Unsupported audio format for conversion in {self.directory}")
+            return original_audio_file_path  # Return original if format is unsupported
         except Exception as e:
             logger.error(f"Failed to convert {original_audio_file_path} to ogg: {e}")
             return original_audio_file_path  # Return original path if conversion fails
@@ -100,50 +133,37 @@ class Song:
 
     def create_sample_ogg(self):
         # Check if the sample.ogg already exists
-        sample_path = os.path.join(self.directory, 'reso-dmx-sample.ogg')
-        if os.path.exists(sample_path):
+        sample_path = os.path.join(self.directory, SAMPLE_FILE_NAME)
+        if self.directory_index.exists(SAMPLE_FILE_NAME):
             # logger.info(f"A sample file already exists for the song {self.name} in {self.directory}")
             return
 
-        try:
-            # Load the original audio file
-            if self.audio_file_path.endswith('.mp3'):
-                original_audio = AudioSegment.from_mp3(self.audio_file_path)
-            elif self.audio_file_path.endswith('.ogg'):
-                original_audio = AudioSegment.from_ogg(self.audio_file_path)
-            elif self.audio_file_path.endswith('.wav'):
-                original_audio = AudioSegment.from_wav(self.audio_file_path)
-            else:
-                logger.info(f"Unsupported audio format for the song {self.name}")
-                return
-
-            # Define the start and end time in milliseconds for the sample
-            start_ms = self.sample_start * 1000
-            end_ms = start_ms + (self.sample_length * 1000)
-
-            # Cut the sample from the original audio
-            sample = original_audio[start_ms:end_ms]
-
-            # Apply fade out to the last 10% of the sample_length
-            fade_duration = self.sample_length * 0.1 * 1000  # Last 10% of the sample_length
-            sample_with_fadeout = sample.fade_out(int(fade_duration))
+        if self.defer_audio_jobs:
+            # The audio job queue creates it
+            self.sample_pending = True
+            return
 
-            # Export the sample as an ogg file
-            sample_with_fadeout.export(sample_path, format='ogg')
+        try:
+            export_sample_ogg(audio_file_path=self.audio_file_path,
+                              sample_path=sample_path,
+                              sample_start=self.sample_start,
+                              sample_length=self.sample_length)
+            self.directory_index.add(SAMPLE_FILE_NAME)
             logger.info(f"Created a sample file for the song {self.name} in {self.directory}")
-
+        except ValueError:
+            logger.info(f"Unsupported audio format for the song {self.name}")
         except Exception as e:
             logger.error(f"Failed to create sample for {self.name} in {self.directory} due to error: {e}")
 
     def detect_jacket(self):
         # Look for a file whose extension is jpg or png, and filename ends with jacket (not case sensitive)
-        jacket_files = [f for f in os.listdir(self.directory) if f.lower().endswith(('jacket.jpg', 'jacket.png'))]
+        jacket_files = [f for f in self.directory_index.names if f.lower().endswith(('jacket.jpg', 'jacket.png'))]
         if jacket_files:
             self.jacket = jacket_files[0]
             return
 
         # Filter out files ending with "bg" or "background" before looking for any jpg or png
-        other_files = [f for f in os.listdir(self.directory)
+        other_files = [f for f in self.directory_index.names
                        if (f.lower().endswith(('.jpg', '.png'))
                            and not any(
                         f.lower().endswith(bg) for bg in ('bg.jpg',
@@ -155,16 +175,64 @@ class Song:
 
     def detect_background(self):
         # Look for a file whose extension is jpg or png, and filename ends with background (not case sensitive)
-        background_files = [f for f in os.listdir(self.directory) if f.lower().endswith(('bg.jpg',
-                                                                                         'bg.png',
-                                                                                         'background.jpg',
-                                                                                         'background.png'))]
+        background_files = [f for f in self.directory_index.names if f.lower().endswith(('bg.jpg',
+                                                                                        'bg.png',
+                                                                                        'background.jpg',
+                                                                                        'background.png'))]
         self.background = background_files[0] if background_files else None
 
     def set_duration(self, duration: float):
         self.duration = duration
         self.duration_str = format_seconds(duration)
 
+    def get_bpm_display(self) -> str:
+        # Check if the whole number part of the BPMs is within 1
+        min_bpm_int = int(self.min_bpm)
+        max_bpm_int = int(self.max_bpm)
+
+        if abs(min_bpm_int - max_bpm_int) <= 1:
+            return f"BPM: {max_bpm_int}"  # Display the max BPM as the single BPM
+        return f"BPM Range: {min_bpm_int} - {max_bpm_int}"
+
+    def get_details(self) -> str:
+        """
+        :return: The title, artist, BPM and duration of the song, one per line, as shown on the song wheel.
+        """
+        details = [
+            self.title,
+            self.artist,
+            self.get_bpm_display(),
+            f"Duration: {self.duration_str}"
+        ]
+        return '\n'.join(details)
+
+    def get_chart_levels(self) -> str:
+        """
+        :return: The difficulty levels of the charts, separated by slashes. e.g. "3/6/9/12"
+        """
+        return "/".join(str(chart.difficulty_level) for chart in self.charts)
+
+    def get_chart_blocks(self, personal_bests: Dict[str, Optional[float]]) -> str:
+        """
+        :param personal_bests: Chart GUID -> the user's personal best percentage on the chart, or None.
+        :return: A block per chart with its level, note count and personal best, each padded to CHART_BLOCK_WIDTH.
+        """
+        return "".join((prefix + format_personal_best(personal_bests.get(chart.chart_id))).ljust(CHART_BLOCK_WIDTH)
+                       for prefix, chart in zip(self.chart_block_prefixes, self.charts))
+
+    def render_response_strings(self):
+        """
+        Renders the strings served for the song. They only depend on the song's metadata and charts,
+        so they are rendered once after the song is loaded instead of on every request.
+        The chart blocks are rendered up to the personal best, which is spliced in per user.
+        """
+        self.bpm_display = self.get_bpm_display()
+        self.details = self.get_details()
+        self.chart_levels = self.get_chart_levels()
+        self.chart_block_prefixes = [f"<b>Lv. {str(chart.difficulty_level).rjust(2)}</b>\n{chart.note_count} Notes\nPB: "
+                                     for chart in self.charts]
+        self.chart_blocks_without_personal_bests = self.get_chart_blocks({})
+
 
     def load_song_info_and_charts_from_sm_file_contents(self, sm_file_contents: str):
         """
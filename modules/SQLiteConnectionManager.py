@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import logging
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteConnectionManager:
+    def __init__(self,
+                 db_path: str,
+                 busy_timeout_seconds: float = 30.0,
+                 cache_size_kib: int = 65536,
+                 mmap_size_bytes: int = 268435456,
+                 synchronous: str = "NORMAL"):
+        """
+        Gives each thread its own connection to a SQLite database.
+
+        The database is put in WAL mode, so readers see the last committed state and never wait for a writer.
+        Writers wait up to busy_timeout_seconds for each other instead of failing with "database is locked".
+        Connections of threads that have exited are closed the next time a connection is opened, and connections
+        inherited from a parent process are discarded, so the manager can be shared with forked worker processes.
+
+        :param db_path: Path to the SQLite database file.
+        :param busy_timeout_seconds: How long a statement waits for a lock held by another connection.
+        :param cache_size_kib: The page cache size of each connection, in KiB.
+        :param mmap_size_bytes: How much of the database file each connection memory-maps. 0 disables mmap.
+        :param synchronous: The synchronous pragma. NORMAL is safe with WAL and only syncs at checkpoints.
+        """
+        self.db_path = db_path
+        self.busy_timeout_seconds = busy_timeout_seconds
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size_bytes = mmap_size_bytes
+        self.synchronous = synchronous
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Thread ID -> (thread, connection), to close the connections of exited threads
+        self._connections: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+        self._pid = os.getpid()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        :return: The calling thread's connection, opened on first use.
+        """
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread is off only so close_all and the exited thread cleanup can close the connection
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_seconds, check_same_thread=False)
+        # journal_mode is persistent, but setting it again is a no-op
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size_bytes)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+
+        thread = threading.current_thread()
+        with self._lock:
+            self._close_connections_of_exited_threads()
+            self._connections[thread.ident] = (thread, conn)
+        return conn
+
+    def _close_connections_of_exited_threads(self):
+        for thread_id, (thread, conn) in list(self._connections.items()):
+            if not thread.is_alive():
+                conn.close()
+                del self._connections[thread_id]
+
+    def _reset_after_fork(self):
+        """
+        Drops the connections inherited from the parent process without closing them.
+        Using (or closing) a SQLite connection in a forked child can corrupt the parent's locks.
+        """
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._pid = os.getpid()
+        logger.info(f"Discarded SQLite connections inherited by process {self._pid}.")
+
+    def close(self):
+        """
+        Closes the calling thread's connection.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+        conn.close()
+
+    def close_all(self):
+        """
+        Closes the connections of all threads. Threads that use the manager again get a new connection.
+        """
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for _, conn in connections:
+            conn.close()
+        self._local = threading.local()
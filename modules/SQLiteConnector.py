@@ -1,25 +1,50 @@
-import sqlite3
 import os
 import time
 import json
-from typing import Optional, List, Dict
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Iterable, Set, Tuple
 from uuid import uuid4
-from modules.MongoDBClient import MongoDBClient
+from modules.ScoreStore import ScoreStore, ScoreStoreUnavailableError
+from modules.SQLiteConnectionManager import SQLiteConnectionManager
+from modules.utils.CompressionUtils import (FORMAT_RAW, FORMAT_GZIP, brotli, compress_text, compress_text_for_serving,
+                                            decompress_text)
 import logging
 
 logger = logging.getLogger(__name__)
 
+# The number of rows migrate_to_compressed_storage compresses per transaction, so the write lock is held briefly
+MIGRATION_BATCH_SIZE = 200
+
 class SQLiteConnector:
-    def __init__(self, db_path: str, mongodb_client: MongoDBClient):
+    def __init__(self,
+                 db_path: str,
+                 score_store: ScoreStore,
+                 connection_manager: Optional[SQLiteConnectionManager] = None):
         """
         Initializes the SQLiteConnector.
 
         :param db_path: Path to the SQLite database file.
+        :param score_store: The store the scores of deleted charts are deleted from.
+        :param connection_manager: Optional manager to take connections from, e.g. one with tuned pragmas.
+                                   By default, one is created for db_path.
         """
         self.db_path = os.path.abspath(db_path)
-        self.conn = None
+        # Each thread (request handlers, the rescanner, audio jobs) uses its own connection
+        self.connection_manager = connection_manager or SQLiteConnectionManager(self.db_path)
+        # Serializes writers within this process, so a long scan transaction does not make
+        # other writers time out waiting for SQLite's write lock
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
         self.create_db_if_not_exists()
-        self.mongodb_client = mongodb_client
+        self.score_store = score_store
+
+    @property
+    def conn(self):
+        """
+        :return: The calling thread's connection.
+        """
+        return self.connection_manager.connection
 
     def create_db_if_not_exists(self):
         """
@@ -27,7 +52,6 @@ class SQLiteConnector:
         """
         if not os.path.exists(self.db_path):
             logger.info(f"Database does not exist. Creating new database at {self.db_path}.")
-        self.conn = sqlite3.connect(self.db_path)
         self.initialize_tables()
 
     def initialize_tables(self):
@@ -65,7 +89,9 @@ class SQLiteConnector:
                 difficulty_level INTEGER NOT NULL,
                 mode TEXT,
                 note_count INTEGER,
-                beats_as_resonite_string TEXT,
+                beats_as_resonite_string BLOB,
+                beats_format INTEGER NOT NULL DEFAULT 0,
+                brotli_beats_as_resonite_string BLOB,
                 FOREIGN KEY(song_guid) REFERENCES songs(guid),
                 UNIQUE(song_guid, difficulty_name, difficulty_level)
             );
@@ -74,33 +100,186 @@ class SQLiteConnector:
                 path TEXT PRIMARY KEY,
                 song_id TEXT,
                 last_modified REAL NOT NULL,
-                content TEXT NOT NULL
+                content BLOB NOT NULL,
+                content_format INTEGER NOT NULL DEFAULT 0,
+                size INTEGER,
+                content_hash TEXT
+            );
+
+            CREATE TABLE IF NOT EXISTS audio_jobs (
+                target_path TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                source_path TEXT NOT NULL,
+                source_last_modified REAL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                updated_at REAL
+            );
+
+            CREATE TABLE IF NOT EXISTS pending_scores (
+                user_id TEXT NOT NULL,
+                chart_guid TEXT NOT NULL,
+                percentage_score REAL NOT NULL,
+                timestamp INTEGER NOT NULL,
+                revision INTEGER NOT NULL DEFAULT 1,
+                claimed_by TEXT,
+                claimed_at REAL,
+                PRIMARY KEY (user_id, chart_guid)
+            );
+
+            CREATE TABLE IF NOT EXISTS score_changes (
+                user_id TEXT PRIMARY KEY,
+                revision INTEGER NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS settings_changes (
+                user_id TEXT PRIMARY KEY,
+                revision INTEGER NOT NULL
             );
         """)
         self.conn.commit()
+        self.add_missing_columns()
+        self.migrate_to_compressed_storage()
 
-    def insert_group(self, name: str, directory_path: str) -> str:
+    def add_missing_columns(self):
+        """
+        Adds the columns introduced since a database was created. CREATE TABLE IF NOT EXISTS does not add them.
+        """
+        # (table, column, column definition)
+        columns = [("sm_files", "content_format", f"INTEGER NOT NULL DEFAULT {FORMAT_RAW}"),
+                   ("sm_files", "size", "INTEGER"),
+                   ("sm_files", "content_hash", "TEXT"),
+                   ("charts", "beats_format", f"INTEGER NOT NULL DEFAULT {FORMAT_RAW}"),
+                   ("charts", "brotli_beats_as_resonite_string", "BLOB"),
+                   ("pending_scores", "claimed_by", "TEXT"),
+                   ("pending_scores", "claimed_at", "REAL")]
+        with self.transaction():
+            cursor = self.conn.cursor()
+            for table, column, column_definition in columns:
+                cursor.execute(f"PRAGMA table_info({table})")
+                if column not in {row[1] for row in cursor.fetchall()}:
+                    logger.info(f"Adding {table}.{column} to the database.")
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_definition}")
+
+    def migrate_to_compressed_storage(self):
+        """
+        Compresses the rows of a database created before SM files and chart strings were stored compressed.
+        Chart strings stored in a format that cannot be served as is are recompressed with gzip,
+        and brotli encodings are added once brotli is installed.
+
+        Rows are compressed outside of a transaction and written in batches of MIGRATION_BATCH_SIZE,
+        so the write lock is only held while a batch is written, and progress is logged per batch.
+        """
         cursor = self.conn.cursor()
-        cursor.execute("SELECT guid FROM groups WHERE directory_path = ?", (directory_path,))
-        row = cursor.fetchone()
-        if row:
-            guid = row[0]
-        else:
-            guid = str(uuid4())
-            cursor.execute("INSERT INTO groups (guid, name, directory_path) VALUES (?, ?, ?)", (guid, name, directory_path))
-            self.conn.commit()
+        cursor.execute("SELECT count(*) FROM sm_files WHERE content_format = ?", (FORMAT_RAW,))
+        sm_file_count = cursor.fetchone()[0]
+        missing_brotli_condition = " OR brotli_beats_as_resonite_string IS NULL" if brotli is not None else ""
+        charts_condition = f"beats_as_resonite_string IS NOT NULL AND (beats_format != ?{missing_brotli_condition})"
+        cursor.execute(f"SELECT count(*) FROM charts WHERE {charts_condition}", (FORMAT_GZIP,))
+        chart_count = cursor.fetchone()[0]
+        if not sm_file_count and not chart_count:
+            return
+        logger.info(f"Compressing {sm_file_count} SM files and {chart_count} charts.")
+
+        # Paged by primary key, so each row is read once whatever the outcome of its update
+        migrated_sm_file_count = 0
+        last_path = ""
+        while True:
+            cursor.execute("SELECT path, content FROM sm_files WHERE content_format = ? AND path > ? ORDER BY path LIMIT ?",
+                           (FORMAT_RAW, last_path, MIGRATION_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_path = rows[-1][0]
+            updates = [(*compress_text(decompress_text(content, FORMAT_RAW)), path) for path, content in rows]
+            with self.transaction():
+                self.conn.executemany("UPDATE sm_files SET content = ?, content_format = ? WHERE path = ?", updates)
+            migrated_sm_file_count += len(updates)
+            logger.info(f"Compressed {migrated_sm_file_count} of {sm_file_count} SM files.")
+
+        migrated_chart_count = 0
+        last_guid = ""
+        while True:
+            cursor.execute(f"""
+                SELECT guid, beats_as_resonite_string, beats_format FROM charts
+                WHERE {charts_condition} AND guid > ? ORDER BY guid LIMIT ?
+            """, (FORMAT_GZIP, last_guid, MIGRATION_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_guid = rows[-1][0]
+            updates = []
+            for guid, beats_as_resonite_string, beats_format in rows:
+                gzip_data, brotli_data = compress_text_for_serving(decompress_text(beats_as_resonite_string, beats_format))
+                updates.append((gzip_data, FORMAT_GZIP, brotli_data, guid))
+            with self.transaction():
+                self.conn.executemany("UPDATE charts SET beats_as_resonite_string = ?, beats_format = ?, "
+                                      "brotli_beats_as_resonite_string = ? WHERE guid = ?", updates)
+            migrated_chart_count += len(updates)
+            logger.info(f"Compressed {migrated_chart_count} of {chart_count} charts.")
+
+        logger.info(f"Compressed {migrated_sm_file_count + migrated_chart_count} rows. Reclaiming the space they used.")
+        self.conn.execute("VACUUM")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Makes the writes done inside the block a single transaction, which is committed when the block exits
+        and rolled back if it raises. The write methods commit on their own outside of a transaction.
+        Transactions can be nested; only the outermost one commits.
+        """
+        with self._lock:
+            self._transaction_depth += 1
+            try:
+                yield
+            except BaseException:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0:
+                    self.conn.rollback()
+                raise
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.conn.commit()
+
+    def insert_group(self, name: str, directory_path: str) -> str:
+        new_guid = str(uuid4())
+        with self.transaction():
+            cursor = self.conn.cursor()
+            # The no-op update makes RETURNING yield the existing GUID on a conflict
+            cursor.execute("""
+                INSERT INTO groups (guid, name, directory_path) VALUES (?, ?, ?)
+                ON CONFLICT(directory_path) DO UPDATE SET name = groups.name
+                RETURNING guid
+            """, (new_guid, name, directory_path))
+            guid = cursor.fetchone()[0]
+        if guid == new_guid:
             logger.info(f"New group added: {directory_path} (GUID: {guid})")
         return guid
 
-    def get_sm_files_for_paths(self, paths: List[str]) -> Dict[str, Dict]:
+    def get_sm_files_for_paths(self, paths: List[str], include_content: bool = True) -> Dict[str, Dict]:
+        """
+        :param paths: Paths of the SM files.
+        :param include_content: Whether to read and decompress the content of the SM files.
+                                Without it, 'content' is None.
+        :return: The SM file records found, by path. 'size' and 'content_hash' are None for records
+                 stored before they were recorded.
+        """
         cursor = self.conn.cursor()
         if not paths:
             return {}
         placeholders = ','.join(['?'] * len(paths))
-        query = f"SELECT song_id, path, last_modified, content FROM sm_files WHERE path IN ({placeholders})"
+        content_columns = "content, content_format" if include_content else "NULL, NULL"
+        query = (f"SELECT song_id, path, last_modified, size, content_hash, {content_columns} "
+                 f"FROM sm_files WHERE path IN ({placeholders})")
         cursor.execute(query, paths)
         rows = cursor.fetchall()
-        return {row[1]: {'song_id': row[0], 'last_modified': row[2], 'content': row[3]} for row in rows}
+        return {row[1]: {'song_id': row[0],
+                         'last_modified': row[2],
+                         'size': row[3],
+                         'content_hash': row[4],
+                         'content': decompress_text(row[5], row[6])}
+                for row in rows}
 
     def get_songs_by_directory_paths(self, paths: List[str]) -> Dict[str, str]:
         cursor = self.conn.cursor()
@@ -124,16 +303,21 @@ class SQLiteConnector:
         row = cursor.fetchone()
         return json.loads(row[0]) if row else []
 
-    def get_charts_by_song_guid(self, song_guid: str) -> List[Dict]:
+    def get_charts_by_song_guid(self, song_guid: str, include_notes: bool = True) -> List[Dict]:
         """
         Retrieves all charts for a song by song GUID, sorted by difficulty level and note count.
+        The resonite strings are returned compressed, along with their format; see decompress_text.
         :param song_guid:
+        :param include_notes: Whether to return the resonite strings. Without them, only the metadata is read;
+                              see get_chart_notes.
         :return:
         """
+        notes_columns = "beats_as_resonite_string, brotli_beats_as_resonite_string" if include_notes else "NULL, NULL"
         cursor = self.conn.cursor()
         cursor.execute(
-            """
-            SELECT guid, path, difficulty_name, difficulty_level, mode, note_count, beats_as_resonite_string 
+            f"""
+            SELECT guid, path, difficulty_name, difficulty_level, mode, note_count, beats_format,
+                   brotli_beats_as_resonite_string IS NOT NULL, {notes_columns}
             FROM charts 
             WHERE song_guid = ? 
             ORDER BY difficulty_level ASC, note_count ASC
@@ -149,11 +333,25 @@ class SQLiteConnector:
                 "difficulty_level": row[3],
                 "mode": row[4],
                 "note_count": row[5],
-                "beats_as_resonite_string": row[6],
+                "beats_format": row[6],
+                "has_brotli_beats_as_resonite_string": bool(row[7]),
+                "compressed_beats_as_resonite_string": row[8],
+                "brotli_beats_as_resonite_string": row[9],
             }
             for row in rows
         ]
 
+    def get_chart_notes(self, chart_guid: str) -> Optional[Tuple[bytes, int, Optional[bytes]]]:
+        """
+        :return: A tuple containing the chart's compressed resonite string, its format and its brotli encoding
+                 (or None), or None if the chart is not in the database.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT beats_as_resonite_string, beats_format, brotli_beats_as_resonite_string FROM charts WHERE guid = ?
+        """, (chart_guid,))
+        return cursor.fetchone()
+
     def get_song_by_song_guid(self, song_guid: str) -> Optional[Dict]:
         cursor = self.conn.cursor()
         cursor.execute("SELECT * FROM songs WHERE guid = ?", (song_guid,))
@@ -193,24 +391,29 @@ class SQLiteConnector:
                     stops: List[float],
                     chart_guids: List[str]
                     ):
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT guid FROM songs WHERE directory_path = ?", (directory_path,))
-        row = cursor.fetchone()
-        if row:
-            guid = row[0]
-            # Update the song's name and group_guid if necessary
+        """
+        Inserts a song, or replaces the song stored for the same directory.
+
+        A song that is ingested again (because its SM file changed) gets a new GUID, which is also the GUID stored
+        for its SM file. The stored song takes over that GUID, and the new charts are inserted with the new GUID.
+        The charts of the previous GUID are deleted by the cleanup of orphaned records, so they can still be served
+        until the rescanned groups replace the ones being served.
+        """
+        with self.transaction():
+            cursor = self.conn.cursor()
             cursor.execute("""
-                UPDATE songs SET name = ?, group_guid = ?, chart_guids = ? WHERE guid = ?
-            """, (name, group_guid, json.dumps(chart_guids), guid))
-            self.conn.commit()
-        else:
-            cursor.execute("INSERT INTO songs (guid, group_guid, chart_guids, name, title, directory_path, artist, "
-                           "sample_start, sample_length, duration, offset, bpms, stops) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                            (song_guid, group_guid, json.dumps(chart_guids), name, title, directory_path, artist,
-                             sample_start, sample_length, duration, offset, json.dumps(bpms), json.dumps(stops)))
-
-            self.conn.commit()
-            logger.info(f"New song added: {name} (GUID: {song_guid})")
+                INSERT INTO songs (guid, group_guid, chart_guids, name, title, directory_path, artist,
+                                   sample_start, sample_length, duration, offset, bpms, stops)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(directory_path)
+                DO UPDATE SET guid = excluded.guid, group_guid = excluded.group_guid, chart_guids = excluded.chart_guids,
+                              name = excluded.name, title = excluded.title, artist = excluded.artist,
+                              sample_start = excluded.sample_start, sample_length = excluded.sample_length,
+                              duration = excluded.duration, offset = excluded.offset, bpms = excluded.bpms,
+                              stops = excluded.stops
+            """, (song_guid, group_guid, json.dumps(chart_guids), name, title, directory_path, artist,
+                  sample_start, sample_length, duration, offset, json.dumps(bpms), json.dumps(stops)))
+        logger.info(f"Song added or updated: {name} (GUID: {song_guid})")
 
     def get_chart_id(self, song_guid: str, difficulty_name: str, difficulty_level: int) -> Optional[str]:
         cursor = self.conn.cursor()
@@ -230,46 +433,98 @@ class SQLiteConnector:
                      difficulty_level: int,
                      note_count: int,
                      beats_as_resonite_string: str):
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            SELECT guid FROM charts
-            WHERE song_guid = ? AND difficulty_name = ? AND difficulty_level = ?
-        """, (song_guid, difficulty_name, difficulty_level))
-        row = cursor.fetchone()
-        # If the chart already exists, nothing to do
-        if row:
-            return
+        self.insert_charts([{"chart_guid": chart_guid,
+                             "song_guid": song_guid,
+                             "sm_file_path": sm_file_path,
+                             "mode": mode,
+                             "difficulty_name": difficulty_name,
+                             "difficulty_level": difficulty_level,
+                             "note_count": note_count,
+                             "beats_as_resonite_string": beats_as_resonite_string}])
+
+    def insert_charts(self, charts: Iterable[Dict]) -> Set[str]:
+        """
+        Inserts charts in one statement. A chart is skipped if its song already has a chart
+        with the same difficulty name and level.
 
-        cursor.execute("""
-            INSERT INTO charts (guid, song_guid, path, difficulty_name, difficulty_level, mode, note_count, beats_as_resonite_string)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (chart_guid, song_guid, sm_file_path, difficulty_name,
-              difficulty_level, mode, note_count, beats_as_resonite_string))
-        self.conn.commit()
-        logger.info(f"New chart added: {difficulty_name} (Level: {difficulty_level}, GUID: {chart_guid})")
+        :param charts: Dicts with the keyword arguments of insert_chart. Instead of beats_as_resonite_string,
+                       a dict can hold the string already compressed, as compressed_beats_as_resonite_string,
+                       beats_format and brotli_beats_as_resonite_string (see Chart.compress_beats_as_resonite_string).
+        :return: The GUIDs of the charts that were inserted.
+        """
+        charts = list(charts)
+        if not charts:
+            return set()
+        rows = []
+        for chart in charts:
+            if "compressed_beats_as_resonite_string" not in chart:
+                gzip_data, brotli_data = compress_text_for_serving(chart["beats_as_resonite_string"])
+                chart = {**chart,
+                         "compressed_beats_as_resonite_string": gzip_data,
+                         "beats_format": FORMAT_GZIP,
+                         "brotli_beats_as_resonite_string": brotli_data}
+            rows.append(chart)
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.executemany("""
+                INSERT INTO charts (guid, song_guid, path, difficulty_name, difficulty_level, mode, note_count,
+                                    beats_as_resonite_string, beats_format, brotli_beats_as_resonite_string)
+                VALUES (:chart_guid, :song_guid, :sm_file_path, :difficulty_name, :difficulty_level, :mode, :note_count,
+                        :compressed_beats_as_resonite_string, :beats_format, :brotli_beats_as_resonite_string)
+                ON CONFLICT(song_guid, difficulty_name, difficulty_level) DO NOTHING
+            """, rows)
+            chart_guids = [chart["chart_guid"] for chart in charts]
+            cursor.execute(f"SELECT guid FROM charts WHERE guid IN ({','.join('?' * len(chart_guids))})", chart_guids)
+            inserted_chart_guids = {row[0] for row in cursor.fetchall()}
+        for chart in charts:
+            logger.info(f"New chart added: {chart['difficulty_name']} (Level: {chart['difficulty_level']}, GUID: {chart['chart_guid']})")
+        return inserted_chart_guids
 
     def delete_charts_by_song_guid(self, song_guid: str):
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM charts WHERE song_guid = ?", (song_guid,))
-        self.conn.commit()
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("DELETE FROM charts WHERE song_guid = ?", (song_guid,))
         logger.info(f"Deleted all charts for song GUID: {song_guid}")
 
-    def insert_or_update_sm_file(self, song_id: str, path: str, content: str) -> None:
+    def insert_or_update_sm_file(self,
+                                 song_id: str,
+                                 path: str,
+                                 content: str,
+                                 last_modified: Optional[float] = None,
+                                 size: Optional[int] = None,
+                                 content_hash: Optional[str] = None) -> None:
         """
         Inserts or updates an SM file record in the database.
 
         :param path: Path of the SM file.
-        :param content: Content of the SM file.
+        :param content: Content of the SM file. Stored compressed.
+        :param last_modified: Modification time of the SM file, if already known from the scan. Read from the file otherwise.
+        :param size: Size of the SM file in bytes, if known.
+        :param content_hash: Hash of the bytes of the SM file (see compute_content_hash), if known.
         """
-        last_modified = os.path.getmtime(path)
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT INTO sm_files (path, song_id, last_modified, content)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(path)
-            DO UPDATE SET song_id=excluded.song_id, last_modified = excluded.last_modified, content = excluded.content;
-        """, (path, song_id, last_modified, content))
-        self.conn.commit()
+        if last_modified is None:
+            last_modified = os.path.getmtime(path)
+        compressed_content, content_format = compress_text(content)
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                INSERT INTO sm_files (path, song_id, last_modified, content, content_format, size, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path)
+                DO UPDATE SET song_id=excluded.song_id, last_modified = excluded.last_modified, content = excluded.content,
+                              content_format = excluded.content_format, size = excluded.size,
+                              content_hash = excluded.content_hash;
+            """, (path, song_id, last_modified, compressed_content, content_format, size, content_hash))
+
+    def update_sm_file_stat(self, path: str, last_modified: float, size: int, content_hash: str) -> None:
+        """
+        Records the new modification time and size of an SM file whose bytes did not change,
+        so the next scan can tell it is unchanged without hashing it.
+        """
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("UPDATE sm_files SET last_modified = ?, size = ?, content_hash = ? WHERE path = ?",
+                           (last_modified, size, content_hash, path))
 
     def get_sm_file_last_modified(self, path: str) -> Optional[float]:
         """
@@ -283,71 +538,365 @@ class SQLiteConnector:
         row = cursor.fetchone()
         return row[0] if row else None
 
+    def get_audio_job(self, target_path: str) -> Optional[Dict]:
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT kind, source_path, source_last_modified, status, attempts, last_error
+            FROM audio_jobs WHERE target_path = ?
+        """, (target_path,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            "target_path": target_path,
+            "kind": row[0],
+            "source_path": row[1],
+            "source_last_modified": row[2],
+            "status": row[3],
+            "attempts": row[4],
+            "last_error": row[5],
+        }
+
+    def upsert_audio_job(self,
+                         target_path: str,
+                         kind: str,
+                         source_path: str,
+                         source_last_modified: float,
+                         status: str,
+                         attempts: int,
+                         last_error: Optional[str] = None) -> None:
+        """
+        Inserts or updates the persisted state of a background audio job.
+
+        :param target_path: The file the job writes. Identifies the job.
+        :param kind: "transcode" or "sample".
+        :param source_path: The audio file the job reads.
+        :param source_last_modified: Modification time of the source when the job was submitted.
+        :param status: "pending", "running", "done" or "failed".
+        :param attempts: The number of attempts made so far.
+        :param last_error: The error of the last failed attempt, if any.
+        """
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                INSERT INTO audio_jobs (target_path, kind, source_path, source_last_modified, status, attempts, last_error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(target_path)
+                DO UPDATE SET kind = excluded.kind, source_path = excluded.source_path,
+                              source_last_modified = excluded.source_last_modified, status = excluded.status,
+                              attempts = excluded.attempts, last_error = excluded.last_error, updated_at = excluded.updated_at;
+            """, (target_path, kind, source_path, source_last_modified, status, attempts, last_error, time.time()))
+
+    def upsert_pending_score(self, user_id: str, chart_guid: str, percentage_score: float, timestamp: int) -> None:
+        """
+        Spools a score that has not been written to MongoDB yet, replacing the user's pending score on the chart.
+        The revision is incremented, so a flush that read the replaced score does not delete this one.
+        A claim on the replaced score is kept, so no other flush writes this one before the replaced one is written.
+        """
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                INSERT INTO pending_scores (user_id, chart_guid, percentage_score, timestamp)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, chart_guid)
+                DO UPDATE SET percentage_score = excluded.percentage_score, timestamp = excluded.timestamp,
+                              revision = pending_scores.revision + 1;
+            """, (user_id, chart_guid, percentage_score, timestamp))
+
+    def get_pending_scores(self, limit: Optional[int] = None) -> List[Dict]:
+        """
+        :param limit: The maximum number of scores to return, oldest first. None for all of them.
+        :return: Dicts with the user_id, chart_guid, percentage_score, timestamp and revision of each pending score.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT user_id, chart_guid, percentage_score, timestamp, revision FROM pending_scores
+            ORDER BY timestamp LIMIT ?
+        """, (-1 if limit is None else limit,))
+        return [{"user_id": row[0], "chart_guid": row[1], "percentage_score": row[2], "timestamp": row[3],
+                 "revision": row[4]} for row in cursor.fetchall()]
+
+    def claim_pending_scores(self, claimant: str, limit: int, claim_timeout_seconds: float) -> List[Dict]:
+        """
+        Claims pending scores for a flush, oldest first, so flushes of other processes sharing the spool skip them.
+        Claims are taken in a single statement, so two flushes never claim the same score.
+
+        :param claimant: Identifies the flush. Its claims are released by release_pending_scores.
+        :param limit: The maximum number of scores to claim.
+        :param claim_timeout_seconds: How long until a claim that was not released (e.g. by a crashed process)
+                                      can be taken over.
+        :return: Dicts like those returned by get_pending_scores.
+        """
+        now = time.time()
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.execute("""
+                UPDATE pending_scores SET claimed_by = ?, claimed_at = ?
+                WHERE rowid IN (SELECT rowid FROM pending_scores WHERE claimed_by IS NULL OR claimed_at < ?
+                                ORDER BY timestamp LIMIT ?)
+                RETURNING user_id, chart_guid, percentage_score, timestamp, revision
+            """, (claimant, now, now - claim_timeout_seconds, limit))
+            rows = cursor.fetchall()
+        return [{"user_id": row[0], "chart_guid": row[1], "percentage_score": row[2], "timestamp": row[3],
+                 "revision": row[4]} for row in sorted(rows, key=lambda row: row[3])]
+
+    def release_pending_scores(self, claimant: str) -> None:
+        """
+        Releases the claims of a flush on the scores it did not delete, e.g. those replaced while it was writing.
+        """
+        with self.transaction():
+            self.conn.execute("UPDATE pending_scores SET claimed_by = NULL, claimed_at = NULL WHERE claimed_by = ?",
+                              (claimant,))
+
+    def get_pending_scores_for_user(self, user_id: str, chart_guids: List[str]) -> Dict[str, Dict]:
+        """
+        :return: Chart GUID -> the user's pending score on the chart, for the charts that have one.
+        """
+        if not chart_guids:
+            return {}
+        placeholders = ','.join('?' * len(chart_guids))
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT chart_guid, percentage_score, timestamp FROM pending_scores
+            WHERE user_id = ? AND chart_guid IN ({placeholders})
+        """, (user_id, *chart_guids))
+        return {row[0]: {"user_id": user_id, "chart_guid": row[0], "percentage_score": row[1], "timestamp": row[2]}
+                for row in cursor.fetchall()}
+
+    def get_pending_scores_for_chart(self, chart_guid: str) -> List[Dict]:
+        """
+        :return: Dicts with the user_id, chart_guid, percentage_score and timestamp of each pending score on the chart.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT user_id, percentage_score, timestamp FROM pending_scores WHERE chart_guid = ?
+        """, (chart_guid,))
+        return [{"user_id": row[0], "chart_guid": chart_guid, "percentage_score": row[1], "timestamp": row[2]}
+                for row in cursor.fetchall()]
+
+    def count_pending_scores(self) -> int:
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT count(*) FROM pending_scores")
+        return cursor.fetchone()[0]
+
+    def delete_pending_scores(self, scores: Iterable[Dict]) -> None:
+        """
+        Deletes pending scores once they are written to MongoDB. A score replaced since it was read is kept.
+
+        :param scores: Dicts returned by get_pending_scores.
+        """
+        with self.transaction():
+            self.conn.executemany("""
+                DELETE FROM pending_scores WHERE user_id = :user_id AND chart_guid = :chart_guid AND revision = :revision
+            """, list(scores))
+
+    def delete_pending_score(self, user_id: str, chart_guid: str) -> None:
+        """
+        Deletes the user's pending score on the chart, whatever its revision.
+        """
+        with self.transaction():
+            self.conn.execute("DELETE FROM pending_scores WHERE user_id = ? AND chart_guid = ?", (user_id, chart_guid))
+
+    def record_score_changes(self, user_ids: Iterable[str]) -> None:
+        """
+        Increments the score revision of each user, once their scores changed in the score store.
+        Server workers compare it with the revision they last saw, to drop the scores of the user they cached.
+        """
+        with self.transaction():
+            self.conn.executemany("""
+                INSERT INTO score_changes (user_id, revision) VALUES (?, 1)
+                ON CONFLICT(user_id) DO UPDATE SET revision = score_changes.revision + 1;
+            """, [(user_id,) for user_id in user_ids])
+
+    def get_score_revision(self, user_id: str) -> int:
+        """
+        :return: The number of times the scores of the user changed, as recorded by record_score_changes.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT revision FROM score_changes WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def record_settings_change(self, user_id: str) -> None:
+        """
+        Increments the settings revision of the user, once their settings changed in the score store.
+        Like the score revision, it lets server workers drop the settings of the user they cached.
+        """
+        with self.transaction():
+            self.conn.execute("""
+                INSERT INTO settings_changes (user_id, revision) VALUES (?, 1)
+                ON CONFLICT(user_id) DO UPDATE SET revision = settings_changes.revision + 1;
+            """, (user_id,))
+
+    def get_settings_revision(self, user_id: str) -> int:
+        """
+        :return: The number of times the settings of the user changed, as recorded by record_settings_change.
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT revision FROM settings_changes WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _delete_scores_for_charts(self, chart_guids: List[str]):
+        # The scan goes on without the score store. The scores are left behind, and no longer shown with a chart.
+        try:
+            self.score_store.delete_scores_for_charts(chart_guids)
+        except ScoreStoreUnavailableError as e:
+            logger.warning(f"Could not delete the scores of {len(chart_guids)} deleted charts: {e}")
+
+    def _delete_charts_of_missing_songs(self, cursor) -> List[str]:
+        """
+        Deletes the charts whose song no longer exists, e.g. the previous charts of a song ingested again,
+        and their pending scores. Their scores in the score store are left to the caller, to delete after the commit.
+
+        :return: The GUIDs of the deleted charts.
+        """
+        cursor.execute("DELETE FROM charts WHERE song_guid NOT IN (SELECT guid FROM songs) RETURNING guid")
+        chart_guids = [row[0] for row in cursor.fetchall()]
+        if chart_guids:
+            logger.info(f"Deleted {len(chart_guids)} charts of songs that no longer exist.")
+            cursor.execute(f"DELETE FROM pending_scores WHERE chart_guid IN ({','.join('?' * len(chart_guids))})",
+                           tuple(chart_guids))
+        return chart_guids
+
     def cleanup_orphaned_records(self,
                                  valid_group_directory_paths: set,
                                  valid_song_directory_paths: set,
                                  valid_sm_file_paths: set):
-        cursor = self.conn.cursor()
+        orphaned_chart_guids = []
+        with self.transaction():
+            cursor = self.conn.cursor()
+
+            # Delete songs not in valid_song_directory_paths
+            cursor.execute("SELECT guid, name, directory_path FROM songs")
+            all_songs = cursor.fetchall()
+            orphaned_song_guids = []
+            for song in all_songs:
+                song_guid, song_name, song_directory_path = song
+                if song_directory_path not in valid_song_directory_paths:
+                    logger.info(f"Deleting orphaned song: Name: {song_name}, Path: {song_directory_path}")
+                    orphaned_song_guids.append(song_guid)
+            if orphaned_song_guids:
+                placeholders = ','.join('?' * len(orphaned_song_guids))
+                cursor.execute(f"DELETE FROM songs WHERE guid IN ({placeholders})", tuple(orphaned_song_guids))
+
+            # Delete charts associated with the songs that were deleted
+            if orphaned_song_guids:
+                # Get a list of all chart GUIDs associated with the orphaned songs
+                cursor.execute("SELECT guid FROM charts WHERE song_guid IN ({})".format(
+                    ','.join(['?'] * len(orphaned_song_guids))), tuple(orphaned_song_guids))
+                orphaned_chart_guids = [row[0] for row in cursor.fetchall()]
+                if orphaned_chart_guids:
+                    placeholders = ','.join('?' * len(orphaned_chart_guids))
+                    cursor.execute(f"DELETE FROM charts WHERE guid IN ({placeholders})", tuple(orphaned_chart_guids))
+                    logger.info(f"Deleted all charts for {len(orphaned_chart_guids)} orphaned songs.")
+                    # Then delete their pending scores. Those in the score store are deleted after the commit.
+                    cursor.execute(f"DELETE FROM pending_scores WHERE chart_guid IN ({placeholders})",
+                                   tuple(orphaned_chart_guids))
+
+            # Delete charts left behind by songs whose GUID was not updated when they were ingested again
+            orphaned_chart_guids.extend(self._delete_charts_of_missing_songs(cursor))
+
+            # Delete groups not in valid_group_directory_paths
+            if valid_group_directory_paths:
+                placeholders = ','.join('?' * len(valid_group_directory_paths))
+                cursor.execute(
+                    f"SELECT guid, name, directory_path FROM groups WHERE directory_path NOT IN ({placeholders})",
+                    tuple(valid_group_directory_paths))
+            else:
+                cursor.execute("SELECT guid, name, directory_path FROM groups")
+            orphaned_groups = cursor.fetchall()
+            for group in orphaned_groups:
+                logger.info(f"Deleting orphaned group: GUID: {group[0]}, Name: {group[1]}, Directory Path: {group[2]}")
+            if orphaned_groups:
+                group_guids = [group[0] for group in orphaned_groups]
+                placeholders = ','.join('?' * len(group_guids))
+                cursor.execute(f"DELETE FROM groups WHERE guid IN ({placeholders})", tuple(group_guids))
+
+            # Delete SM files that are no longer in the filesystem
+            cursor.execute("SELECT path FROM sm_files")
+            db_sm_files = {row[0] for row in cursor.fetchall()}
+            orphaned_sm_files = db_sm_files - valid_sm_file_paths
+            for sm_file in orphaned_sm_files:
+                logger.info(f"Deleting orphaned SM file: Path: {sm_file}")
+            if orphaned_sm_files:
+                placeholders = ','.join('?' * len(orphaned_sm_files))
+                cursor.execute(f"DELETE FROM sm_files WHERE path IN ({placeholders})", tuple(orphaned_sm_files))
+        # Outside of the transaction, so a round trip to a remote score store does not hold the write lock
+        if orphaned_chart_guids:
+            self._delete_scores_for_charts(orphaned_chart_guids)
+        logger.info("Completed cleanup of orphaned records.")
 
-        # Delete songs not in valid_song_directory_paths
-        cursor.execute("SELECT guid, name, directory_path FROM songs")
-        all_songs = cursor.fetchall()
-        orphaned_song_guids = []
-        for song in all_songs:
-            song_guid, song_name, song_directory_path = song
-            if song_directory_path not in valid_song_directory_paths:
-                logger.info(f"Deleting orphaned song: Name: {song_name}, Path: {song_directory_path}")
-                orphaned_song_guids.append(song_guid)
-        if orphaned_song_guids:
-            placeholders = ','.join('?' * len(orphaned_song_guids))
-            cursor.execute(f"DELETE FROM songs WHERE guid IN ({placeholders})", tuple(orphaned_song_guids))
-
-        # Delete charts associated with the songs that were deleted
-        if orphaned_song_guids:
-            # Get a list of all chart GUIDs associated with the orphaned songs
-            cursor.execute("SELECT guid FROM charts WHERE song_guid IN ({})".format(
-                ','.join(['?'] * len(orphaned_song_guids))), tuple(orphaned_song_guids))
-            orphaned_chart_guids = [row[0] for row in cursor.fetchall()]
-            if orphaned_chart_guids:
-                placeholders = ','.join('?' * len(orphaned_chart_guids))
-                cursor.execute(f"DELETE FROM charts WHERE guid IN ({placeholders})", tuple(orphaned_chart_guids))
-                logger.info(f"Deleted all charts for {len(orphaned_chart_guids)} orphaned songs.")
-                # Then delete scores for each chart in the MongoDB database
-                self.mongodb_client.delete_scores_for_charts(orphaned_chart_guids)
-
-        # Delete groups not in valid_group_directory_paths
-        if valid_group_directory_paths:
-            placeholders = ','.join('?' * len(valid_group_directory_paths))
-            cursor.execute(
-                f"SELECT guid, name, directory_path FROM groups WHERE directory_path NOT IN ({placeholders})",
-                tuple(valid_group_directory_paths))
-        else:
-            cursor.execute("SELECT guid, name, directory_path FROM groups")
-        orphaned_groups = cursor.fetchall()
-        for group in orphaned_groups:
-            logger.info(f"Deleting orphaned group: GUID: {group[0]}, Name: {group[1]}, Directory Path: {group[2]}")
-        if orphaned_groups:
-            group_guids = [group[0] for group in orphaned_groups]
-            placeholders = ','.join('?' * len(group_guids))
-            cursor.execute(f"DELETE FROM groups WHERE guid IN ({placeholders})", tuple(group_guids))
-
-        # Delete SM files that are no longer in the filesystem
-        cursor.execute("SELECT path FROM sm_files")
-        db_sm_files = {row[0] for row in cursor.fetchall()}
-        orphaned_sm_files = db_sm_files - valid_sm_file_paths
-        for sm_file in orphaned_sm_files:
-            logger.info(f"Deleting orphaned SM file: Path: {sm_file}")
-        if orphaned_sm_files:
-            placeholders = ','.join('?' * len(orphaned_sm_files))
-            cursor.execute(f"DELETE FROM sm_files WHERE path IN ({placeholders})", tuple(orphaned_sm_files))
+    def cleanup_orphaned_records_in_groups(self,
+                                           group_directory_paths: set,
+                                           valid_group_directory_paths: set,
+                                           valid_song_directory_paths: set,
+                                           valid_sm_file_paths: set):
+        """
+        Like cleanup_orphaned_records, but only considers records that belong to the given group directories.
+        Used after a partial rescan, where the valid paths of all other groups are unknown.
 
-        self.conn.commit()
-        logger.info("Completed cleanup of orphaned records.")
+        :param group_directory_paths: The group directories that were rescanned.
+        :param valid_group_directory_paths: The rescanned group directories that still exist.
+        :param valid_song_directory_paths: The song directories that were found in the rescanned groups.
+        :param valid_sm_file_paths: The SM files that were found in the rescanned groups.
+        """
+        orphaned_chart_guids = []
+        with self.transaction():
+            cursor = self.conn.cursor()
+            prefixes = [os.path.join(path, "") for path in group_directory_paths]
+
+            def in_rescanned_groups(path: str) -> bool:
+                return any(path.startswith(prefix) for prefix in prefixes)
+
+            # Delete songs of the rescanned groups that were not found again
+            cursor.execute("SELECT guid, name, directory_path FROM songs")
+            orphaned_song_guids = []
+            for song_guid, song_name, song_directory_path in cursor.fetchall():
+                if in_rescanned_groups(song_directory_path) and song_directory_path not in valid_song_directory_paths:
+                    logger.info(f"Deleting orphaned song: Name: {song_name}, Path: {song_directory_path}")
+                    orphaned_song_guids.append(song_guid)
+            if orphaned_song_guids:
+                placeholders = ','.join('?' * len(orphaned_song_guids))
+                cursor.execute(f"DELETE FROM songs WHERE guid IN ({placeholders})", tuple(orphaned_song_guids))
+
+                # Delete charts associated with the songs that were deleted, and their pending scores
+                cursor.execute(f"SELECT guid FROM charts WHERE song_guid IN ({placeholders})", tuple(orphaned_song_guids))
+                orphaned_chart_guids = [row[0] for row in cursor.fetchall()]
+                if orphaned_chart_guids:
+                    chart_placeholders = ','.join('?' * len(orphaned_chart_guids))
+                    cursor.execute(f"DELETE FROM charts WHERE guid IN ({chart_placeholders})", tuple(orphaned_chart_guids))
+                    logger.info(f"Deleted all charts for {len(orphaned_chart_guids)} orphaned songs.")
+                    cursor.execute(f"DELETE FROM pending_scores WHERE chart_guid IN ({chart_placeholders})",
+                                   tuple(orphaned_chart_guids))
+
+            # Delete charts left behind by songs that were ingested again with a new GUID
+            orphaned_chart_guids.extend(self._delete_charts_of_missing_songs(cursor))
+
+            # Delete rescanned groups whose directory is gone
+            removed_group_directory_paths = tuple(set(group_directory_paths) - set(valid_group_directory_paths))
+            if removed_group_directory_paths:
+                for path in removed_group_directory_paths:
+                    logger.info(f"Deleting orphaned group: Directory Path: {path}")
+                placeholders = ','.join('?' * len(removed_group_directory_paths))
+                cursor.execute(f"DELETE FROM groups WHERE directory_path IN ({placeholders})", removed_group_directory_paths)
+
+            # Delete SM files of the rescanned groups that are no longer in the filesystem
+            cursor.execute("SELECT path FROM sm_files")
+            orphaned_sm_files = tuple(row[0] for row in cursor.fetchall()
+                                      if in_rescanned_groups(row[0]) and row[0] not in valid_sm_file_paths)
+            for sm_file in orphaned_sm_files:
+                logger.info(f"Deleting orphaned SM file: Path: {sm_file}")
+            if orphaned_sm_files:
+                placeholders = ','.join('?' * len(orphaned_sm_files))
+                cursor.execute(f"DELETE FROM sm_files WHERE path IN ({placeholders})", orphaned_sm_files)
+        # Outside of the transaction, so a round trip to a remote score store does not hold the write lock
+        if orphaned_chart_guids:
+            self._delete_scores_for_charts(orphaned_chart_guids)
+        logger.info(f"Completed cleanup of orphaned records in {len(group_directory_paths)} rescanned groups.")
 
     def close(self):
         """
-        Closes the database connection.
+        Closes the database connections of all threads.
         """
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        self.connection_manager.close_all()
@@ -0,0 +1,156 @@
+import os
+import json
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+from modules.Config import Config
+from modules.ScoreStore import ScoreStore
+from modules.SQLiteConnectionManager import SQLiteConnectionManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../reso-dmx-scores.sqlite3"))
+
+
+class SQLiteScoreStore(ScoreStore):
+    def __init__(self, db_path: str, connection_manager: Optional[SQLiteConnectionManager] = None):
+        """
+        Keeps scores and settings in a local SQLite database, for single server deployments.
+        Reads and writes do not leave the machine, and the server does not need a MongoDB cluster.
+
+        The database is separate from the songs database (reso-dmx.sqlite3), which can be deleted to rescan the songs.
+
+        :param db_path: Path to the SQLite database file.
+        :param connection_manager: Optional manager to take connections from, e.g. one with tuned pragmas.
+                                   By default, one is created for db_path.
+        """
+        self.db_path = os.path.abspath(db_path)
+        self.connection_manager = connection_manager or SQLiteConnectionManager(self.db_path)
+        self.initialize_tables()
+
+    @classmethod
+    def from_config(cls, config: Config) -> "SQLiteScoreStore":
+        db_path = config.score_store_sqlite_path or DEFAULT_DB_PATH
+        return cls(db_path, SQLiteConnectionManager(db_path=db_path,
+                                                    busy_timeout_seconds=config.sqlite_busy_timeout_seconds,
+                                                    cache_size_kib=config.sqlite_cache_size_kib,
+                                                    mmap_size_bytes=config.sqlite_mmap_size_bytes,
+                                                    synchronous=config.sqlite_synchronous))
+
+    @property
+    def conn(self):
+        """
+        :return: The calling thread's connection.
+        """
+        return self.connection_manager.connection
+
+    def initialize_tables(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS scores (
+                user_id TEXT NOT NULL,
+                chart_guid TEXT NOT NULL,
+                percentage_score REAL NOT NULL,
+                timestamp INTEGER NOT NULL,
+                PRIMARY KEY(user_id, chart_guid)
+            );
+
+            CREATE INDEX IF NOT EXISTS scores_by_chart ON scores (chart_guid, percentage_score DESC, timestamp);
+
+            CREATE TABLE IF NOT EXISTS settings (
+                user_id TEXT PRIMARY KEY,
+                settings TEXT NOT NULL
+            );
+        """)
+
+    def add_score(self, user_id: str, chart_guid: str, percentage_score: float, timestamp: int) -> None:
+        self.add_scores_bulk([{"user_id": user_id, "chart_guid": chart_guid,
+                               "percentage_score": percentage_score, "timestamp": timestamp}])
+        logger.info(f"Score for user '{user_id}' on chart '{chart_guid}' updated or added.")
+
+    def add_scores_bulk(self, scores: List[Dict[str, Any]]) -> None:
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO scores (user_id, chart_guid, percentage_score, timestamp)
+                VALUES (:user_id, :chart_guid, :percentage_score, :timestamp)
+                ON CONFLICT(user_id, chart_guid)
+                DO UPDATE SET percentage_score = excluded.percentage_score, timestamp = excluded.timestamp;
+            """, [{key: score[key] for key in ("user_id", "chart_guid", "percentage_score", "timestamp")}
+                  for score in scores])
+
+    def get_user_score(self, user_id: str, chart_guid: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("""
+            SELECT percentage_score, timestamp FROM scores WHERE user_id = ? AND chart_guid = ?
+        """, (user_id, chart_guid)).fetchone()
+        if row is None:
+            return None
+        return {"user_id": user_id, "chart_guid": chart_guid, "percentage_score": row[0], "timestamp": row[1]}
+
+    def get_user_scores_bulk(self, user_id: str, chart_ids: List[str]) -> Dict[str, Optional[float]]:
+        scores = {chart_id: None for chart_id in chart_ids}
+        if not chart_ids:
+            return scores
+        placeholders = ','.join('?' * len(chart_ids))
+        rows = self.conn.execute(f"""
+            SELECT chart_guid, percentage_score FROM scores WHERE user_id = ? AND chart_guid IN ({placeholders})
+        """, (user_id, *chart_ids)).fetchall()
+        scores.update(rows)
+        return scores
+
+    def _select_chart_scores(self, chart_guid: str, limit: int = -1) -> List[Dict[str, Any]]:
+        rows = self.conn.execute("""
+            SELECT user_id, percentage_score, timestamp FROM scores WHERE chart_guid = ?
+            ORDER BY percentage_score DESC, timestamp LIMIT ?
+        """, (chart_guid, limit)).fetchall()
+        return [{"user_id": row[0], "chart_guid": chart_guid, "percentage_score": row[1], "timestamp": row[2]}
+                for row in rows]
+
+    def get_chart_scores(self, chart_guid: str) -> List[Dict[str, Any]]:
+        return self._select_chart_scores(chart_guid)
+
+    def get_top_scores(self, chart_guid: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return self._select_chart_scores(chart_guid, limit)
+
+    def iter_scores(self) -> Iterator[Dict[str, Any]]:
+        for row in self.conn.execute("SELECT user_id, chart_guid, percentage_score, timestamp FROM scores"):
+            yield {"user_id": row[0], "chart_guid": row[1], "percentage_score": row[2], "timestamp": row[3]}
+
+    def delete_scores_for_user(self, user_id: str) -> None:
+        with self.conn:
+            deleted_count = self.conn.execute("DELETE FROM scores WHERE user_id = ?", (user_id,)).rowcount
+        logger.info(f"Deleted {deleted_count} scores for user '{user_id}'.")
+
+    def delete_scores_for_charts(self, chart_guids: List[str]) -> None:
+        if not chart_guids:
+            return
+        placeholders = ','.join('?' * len(chart_guids))
+        with self.conn:
+            deleted_count = self.conn.execute(f"DELETE FROM scores WHERE chart_guid IN ({placeholders})",
+                                              chart_guids).rowcount
+        logger.info(f"Deleted {deleted_count} scores for {len(chart_guids)} charts.")
+
+    def save_user_settings(self, settings: Dict[str, Any]) -> None:
+        user_id = settings["user_id"]
+        with self.conn:
+            # Takes the write lock before reading, so concurrent updates of the same user are not lost
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT settings FROM settings WHERE user_id = ?", (user_id,)).fetchone()
+            merged_settings = json.loads(row[0]) if row else {}
+            merged_settings.update(settings)
+            self.conn.execute("""
+                INSERT INTO settings (user_id, settings) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET settings = excluded.settings;
+            """, (user_id, json.dumps(merged_settings)))
+
+    def get_user_settings(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT settings FROM settings WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def iter_settings(self) -> Iterator[Dict[str, Any]]:
+        for row in self.conn.execute("SELECT settings FROM settings"):
+            yield json.loads(row[0])
+
+    def close(self) -> None:
+        """
+        Closes the database connections of all threads.
+        """
+        self.connection_manager.close_all()
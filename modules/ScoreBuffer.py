@@ -0,0 +1,168 @@
+import threading
+import logging
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from modules.ScoreStore import ScoreStore, ScoreStoreUnavailableError
+from modules.SQLiteConnector import SQLiteConnector
+
+logger = logging.getLogger(__name__)
+
+
+class ScoreBuffer:
+    def __init__(self,
+                 sqlite_db_connector: SQLiteConnector,
+                 score_store: ScoreStore,
+                 flush_interval_seconds: float = 5.0,
+                 flush_threshold: int = 100,
+                 max_batch_size: int = 1000,
+                 write_behind: bool = True,
+                 claim_timeout_seconds: float = 300.0,
+                 start: bool = True):
+        """
+        Buffers score submissions and writes them to MongoDB in the background, so a submission is acknowledged
+        without waiting for a round trip to the cluster.
+
+        Submissions are spooled in the pending_scores table, one per user and chart: a newer submission replaces
+        the pending one, as add_score would have overwritten it. The spool is flushed with bulk writes every
+        flush_interval_seconds, or as soon as flush_threshold scores are pending. Scores left in the spool by a crash
+        or restart are flushed once the buffer is started again. A failed flush is retried at the next interval.
+
+        Server workers sharing the spool each flush it. A flush claims the scores it writes, so a score resubmitted
+        while an older one is being written is only written by a later flush, after the older one.
+
+        Without write_behind, submissions are written to MongoDB right away, and only spooled if it is unreachable.
+
+        Reads go through the buffer too, so a player sees their own pending scores before they are flushed.
+
+        :param sqlite_db_connector: The connector of the spool.
+        :param score_store: The remote store the scores are flushed to, e.g. a MongoDBClient.
+        :param flush_interval_seconds: How often pending scores are flushed.
+        :param flush_threshold: The number of pending scores that triggers a flush before the interval is over.
+        :param max_batch_size: The maximum number of scores written by one bulk write.
+        :param write_behind: Whether to spool every submission, or only those that cannot be written right away.
+        :param claim_timeout_seconds: How long the scores claimed by a flush that never finished (e.g. in a worker
+                                      that was killed) stay claimed.
+        :param start: Whether to start the flush thread now. If False, it is started by start.
+        """
+        self.sqlite_db_connector = sqlite_db_connector
+        self.score_store = score_store
+        self.flush_interval_seconds = flush_interval_seconds
+        self.flush_threshold = flush_threshold
+        self.max_batch_size = max_batch_size
+        self.write_behind = write_behind
+        self.claim_timeout_seconds = claim_timeout_seconds
+
+        self._flush_requested = threading.Event()
+        self._stop_event = threading.Event()
+        # Serializes flushes, so the same scores are not written twice by the thread and by flush callers
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        if start:
+            self.start()
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="ScoreBuffer", daemon=True)
+        self._thread.start()
+
+    def stop(self, flush: bool = True):
+        """
+        Stops the flush thread. Scores that are still pending stay in the spool.
+
+        :param flush: Whether to flush the pending scores first.
+        """
+        self._stop_event.set()
+        self._flush_requested.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.flush()
+
+    def _flush_loop(self):
+        while not self._stop_event.is_set():
+            self._flush_requested.wait(timeout=self.flush_interval_seconds)
+            self._flush_requested.clear()
+            if self._stop_event.is_set():
+                return
+            try:
+                self.flush()
+            except ScoreStoreUnavailableError as e:
+                logger.warning(f"Pending scores are kept until the score store is reachable: {e}")
+            except Exception as e:
+                logger.error(f"Failed to flush pending scores, retrying in {self.flush_interval_seconds}s: {e}")
+
+    def flush(self) -> int:
+        """
+        Writes all pending scores to MongoDB, and removes them from the spool.
+
+        :return: The number of scores written.
+        """
+        written_count = 0
+        with self._flush_lock:
+            while True:
+                # A claimant per batch, since a buffer created before the server forked is shared by its workers
+                claimant = str(uuid4())
+                scores = self.sqlite_db_connector.claim_pending_scores(claimant, limit=self.max_batch_size,
+                                                                       claim_timeout_seconds=self.claim_timeout_seconds)
+                if not scores:
+                    break
+                try:
+                    self.score_store.add_scores_bulk(scores)
+                    with self.sqlite_db_connector.transaction():
+                        self.sqlite_db_connector.delete_pending_scores(scores)
+                        # Other server workers drop the stored scores they cached for these users
+                        self.sqlite_db_connector.record_score_changes({score["user_id"] for score in scores})
+                finally:
+                    self.sqlite_db_connector.release_pending_scores(claimant)
+                written_count += len(scores)
+                if len(scores) < self.max_batch_size:
+                    break
+        return written_count
+
+    def add_score(self, user_id: str, chart_guid: str, percentage_score: float, timestamp: int) -> None:
+        """
+        Spools a score. It is written to MongoDB by the next flush.
+        Without write_behind, it is written right away instead, and only spooled if MongoDB is unreachable.
+        """
+        if not self.write_behind:
+            try:
+                self.score_store.add_score(user_id, chart_guid, percentage_score, timestamp)
+                # Drops a score spooled earlier, so it does not overwrite this one when it is flushed
+                self.sqlite_db_connector.delete_pending_score(user_id, chart_guid)
+                return
+            except ScoreStoreUnavailableError as e:
+                logger.warning(f"Spooling the score of user '{user_id}' on chart '{chart_guid}': {e}")
+        self.sqlite_db_connector.upsert_pending_score(user_id, chart_guid, percentage_score, timestamp)
+        if self.sqlite_db_connector.count_pending_scores() >= self.flush_threshold:
+            self._flush_requested.set()
+
+    def get_user_score(self, user_id: str, chart_guid: str) -> Optional[Dict[str, Any]]:
+        """
+        :return: The user's pending score on the chart if there is one, and their stored score otherwise.
+        """
+        pending_scores = self.sqlite_db_connector.get_pending_scores_for_user(user_id, [chart_guid])
+        if chart_guid in pending_scores:
+            return pending_scores[chart_guid]
+        return self.score_store.get_user_score(user_id, chart_guid)
+
+    def get_chart_scores(self, chart_guid: str) -> List[Dict[str, Any]]:
+        """
+        Like ScoreStore.get_chart_scores, with pending scores in place of the stored ones of the same users.
+        """
+        scores = {score["user_id"]: score for score in self.score_store.get_chart_scores(chart_guid)}
+        for pending_score in self.sqlite_db_connector.get_pending_scores_for_chart(chart_guid):
+            scores[pending_score["user_id"]] = pending_score
+        return list(scores.values())
+
+    def get_user_scores_bulk(self, user_id: str, chart_ids: List[str]) -> Dict[str, Optional[float]]:
+        """
+        Like ScoreStore.get_user_scores_bulk, with the user's pending scores in place of their stored ones.
+        """
+        scores = self.score_store.get_user_scores_bulk(user_id, chart_ids)
+        for chart_guid, pending_score in self.sqlite_db_connector.get_pending_scores_for_user(user_id, chart_ids).items():
+            scores[chart_guid] = pending_score["percentage_score"]
+        return scores
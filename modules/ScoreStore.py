@@ -0,0 +1,193 @@
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional
+
+from modules.Config import Config
+
+logger = logging.getLogger(__name__)
+
+BACKEND_MONGODB = "mongodb"
+BACKEND_SQLITE = "sqlite"
+
+
+class ScoreStoreUnavailableError(Exception):
+    """
+    Raised by a score store that cannot be reached, e.g. while its circuit breaker is open.
+    """
+
+
+class ScoreStore(ABC):
+    """
+    Where user scores and settings are kept. There is at most one score per user and chart.
+
+    Score dicts have the user_id, chart_guid, percentage_score and timestamp of the score.
+    Settings dicts have the user_id and the settings set by set_user_settings.
+    """
+
+    # Whether each call is a round trip over the network, e.g. to a database cluster.
+    # Submissions to a remote store are buffered by a ScoreBuffer.
+    is_remote = False
+
+    @abstractmethod
+    def add_score(self, user_id: str, chart_guid: str, percentage_score: float, timestamp: int) -> None:
+        """
+        Adds or updates a score for a specific user and chart. If a score already exists, it is overwritten.
+        """
+
+    @abstractmethod
+    def add_scores_bulk(self, scores: List[Dict[str, Any]]) -> None:
+        """
+        Adds or updates many scores at once. Like add_score, an existing score is overwritten.
+
+        :param scores: Score dicts, at most one per user and chart.
+        """
+
+    @abstractmethod
+    def get_user_score(self, user_id: str, chart_guid: str) -> Optional[Dict[str, Any]]:
+        """
+        :return: The user's score on the chart, or None if not found.
+        """
+
+    @abstractmethod
+    def get_user_scores_bulk(self, user_id: str, chart_ids: List[str]) -> Dict[str, Optional[float]]:
+        """
+        :return: Chart GUID -> the user's percentage score on the chart, or None if not found, for each chart.
+        """
+
+    @abstractmethod
+    def get_chart_scores(self, chart_guid: str) -> List[Dict[str, Any]]:
+        """
+        :return: The score of every user on the chart, best first.
+        """
+
+    @abstractmethod
+    def get_top_scores(self, chart_guid: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        :return: The best limit scores on the chart, best first.
+        """
+
+    @abstractmethod
+    def iter_scores(self) -> Iterator[Dict[str, Any]]:
+        """
+        :return: An iterator over every score, e.g. to copy them to another store.
+        """
+
+    @abstractmethod
+    def delete_scores_for_user(self, user_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def delete_scores_for_charts(self, chart_guids: List[str]) -> None:
+        pass
+
+    def delete_scores_for_chart(self, chart_guid: str) -> None:
+        self.delete_scores_for_charts([chart_guid])
+
+    @abstractmethod
+    def save_user_settings(self, settings: Dict[str, Any]) -> None:
+        """
+        Sets or updates a user's settings.
+
+        :param settings: A settings dict. Settings it does not have are left as they are.
+        """
+
+    @abstractmethod
+    def get_user_settings(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        :return: The user's settings dict, or None if not found.
+        """
+
+    @abstractmethod
+    def iter_settings(self) -> Iterator[Dict[str, Any]]:
+        """
+        :return: An iterator over the settings of every user, e.g. to copy them to another store.
+        """
+
+    def set_user_settings(self, user_id: str, scroll_speed: float, noteskin: str,
+                          controller_type: str, controller_buttons: Dict[str, str],
+                          visual_timing_offset: float, judgement_timing_offset: float,
+                          height_of_notes_area: float, arrow_x_axis_spacing: float,
+                          note_scroll_direction: str,
+                          combo_text_position: int,
+                          judgement_text_position: int,
+                          background_filter: int,
+                          ) -> None:
+        """
+        Set or update a user's settings.
+
+        :param user_id: The user_id of the player.
+        :param scroll_speed: The scroll speed setting.
+        :param noteskin: The noteskin setting.
+        :param controller: The controller type.
+        :param controller_buttons: Mapping of controller buttons (e.g., button_0, button_1).
+        :param visual_timing_offset: Visual timing offset for display.
+        :param judgement_timing_offset: Timing offset for judgement.
+        :param height_of_notes_area: Height of the notes area.
+        :param arrow_x_axis_spacing: Spacing of arrows on the x-axis.
+        :param note_scroll_direction: Scroll direction for notes.
+        """
+        self.save_user_settings({
+            "user_id": user_id,
+            "scroll_speed": scroll_speed,
+            "noteskin": noteskin,
+            "controller_type": controller_type,
+            "controller_buttons": controller_buttons,
+            "visual_timing_offset": visual_timing_offset,
+            "judgement_timing_offset": judgement_timing_offset,
+            "height_of_notes_area": height_of_notes_area,
+            "arrow_x_axis_spacing": arrow_x_axis_spacing,
+            "note_scroll_direction": note_scroll_direction,
+            "background_filter": background_filter,
+            "combo_text_position": combo_text_position,
+            "judgement_text_position": judgement_text_position,
+        })
+
+    @property
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: Cache name -> the stats of the store's read caches, if it has any.
+        """
+        return {}
+
+    def invalidate_cached_user_scores(self, user_id: str) -> None:
+        """
+        Drops the scores of the user from the store's read caches, if it has any, e.g. once another process
+        changed them.
+        """
+
+    def invalidate_cached_user_settings(self, user_id: str) -> None:
+        """
+        Drops the settings of the user from the store's read caches, if it has any, e.g. once another process
+        changed them.
+        """
+
+    @property
+    def fallback_read_count(self) -> int:
+        """
+        :return: The number of reads answered without reaching the store, e.g. from expired cache entries
+                 while it is unavailable. Results read while it changes may be stale and should not be cached.
+        """
+        return 0
+
+    def reconnect_after_fork(self) -> None:
+        """
+        Called in a worker process right after it is forked, to replace connections inherited from the parent.
+        """
+
+    def close(self) -> None:
+        pass
+
+
+def create_score_store(config: Config, backend: Optional[str] = None) -> ScoreStore:
+    """
+    :param backend: BACKEND_MONGODB or BACKEND_SQLITE. Defaults to the backend set in the config.
+    :return: The score store of the backend. The backends are imported here, so pymongo is only needed for MongoDB.
+    """
+    backend = backend or config.score_store_backend
+    if backend == BACKEND_MONGODB:
+        from modules.MongoDBClient import MongoDBClient
+        return MongoDBClient(config)
+    if backend == BACKEND_SQLITE:
+        from modules.SQLiteScoreStore import SQLiteScoreStore
+        return SQLiteScoreStore.from_config(config)
+    raise ValueError(f"Unknown score store backend: {backend}")
@@ -0,0 +1,62 @@
+import argparse
+import logging
+from typing import Tuple
+
+from modules.Config import Config
+from modules.ScoreStore import ScoreStore, create_score_store, BACKEND_MONGODB, BACKEND_SQLITE
+from modules.utils.Loggers import configure_console_logger
+
+logger = logging.getLogger(__name__)
+
+
+def copy_score_store(source: ScoreStore, destination: ScoreStore, batch_size: int = 1000) -> Tuple[int, int]:
+    """
+    Copies every score and user's settings from one store to another. Scores and settings already in the destination
+    are overwritten by those of the same user (and chart) in the source, and the others are kept, so the copy can be
+    run again to sync the destination.
+
+    :param source: The store to copy from.
+    :param destination: The store to copy to.
+    :param batch_size: The number of scores written to the destination at once.
+    :return: A tuple containing the number of scores and the number of settings copied.
+    """
+    score_count = 0
+    batch = []
+    for score in source.iter_scores():
+        batch.append(score)
+        if len(batch) >= batch_size:
+            destination.add_scores_bulk(batch)
+            score_count += len(batch)
+            batch = []
+    if batch:
+        destination.add_scores_bulk(batch)
+        score_count += len(batch)
+    logger.info(f"Copied {score_count} scores.")
+
+    settings_count = 0
+    for settings in source.iter_settings():
+        destination.save_user_settings(settings)
+        settings_count += 1
+    logger.info(f"Copied the settings of {settings_count} users.")
+    return score_count, settings_count
+
+
+if __name__ == "__main__":
+    configure_console_logger()
+    parser = argparse.ArgumentParser(description="Copy scores and settings between score store backends.")
+    parser.add_argument("--config", default="config.ini", help="Path to the config file.")
+    parser.add_argument("--source", choices=[BACKEND_MONGODB, BACKEND_SQLITE], default=BACKEND_MONGODB)
+    parser.add_argument("--destination", choices=[BACKEND_MONGODB, BACKEND_SQLITE], default=BACKEND_SQLITE)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    if args.source == args.destination:
+        parser.error("The source and destination backends must be different.")
+
+    config = Config(args.config)
+    source_store = create_score_store(config, args.source)
+    destination_store = create_score_store(config, args.destination)
+    try:
+        copy_score_store(source_store, destination_store, batch_size=args.batch_size)
+    finally:
+        source_store.close()
+        destination_store.close()
@@ -0,0 +1,134 @@
+import gc
+import logging
+from typing import Callable, Optional
+
+from modules.Config import Config
+from modules.FlaskAppHandler import FlaskAppHandler
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn is optional, and does not run on Windows
+    BaseApplication = None
+
+try:
+    import waitress
+except ImportError:  # waitress is optional
+    waitress = None
+
+logger = logging.getLogger(__name__)
+
+SERVER_GUNICORN = "gunicorn"
+SERVER_WAITRESS = "waitress"
+SERVER_FLASK = "flask"
+SERVER_AUTO = "auto"
+
+
+def select_server(requested_server: str) -> str:
+    """
+    :param requested_server: A server name, or SERVER_AUTO for the first of gunicorn and waitress that is installed.
+    :return: The server to run. Falls back to the Flask development server if the requested one is not installed.
+    """
+    available_servers = {SERVER_GUNICORN: BaseApplication is not None,
+                         SERVER_WAITRESS: waitress is not None,
+                         SERVER_FLASK: True}
+    if requested_server == SERVER_AUTO:
+        return next(server for server, available in available_servers.items() if available)
+    if requested_server not in available_servers:
+        raise ValueError(f"Unknown server: {requested_server}")
+    if not available_servers[requested_server]:
+        logger.warning(f"{requested_server} is not installed. Falling back to the Flask development server.")
+        return SERVER_FLASK
+    return requested_server
+
+
+if BaseApplication is not None:
+    class GunicornApplication(BaseApplication):
+        def __init__(self, app, options: dict):
+            """
+            Runs an already built WSGI app with gunicorn, configured from options instead of the command line.
+            """
+            self.application = app
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+
+class WSGIServer:
+    def __init__(self,
+                 config: Config,
+                 create_app_handler: Callable[[bool], FlaskAppHandler],
+                 host: str = "0.0.0.0",
+                 port: int = 5731):
+        """
+        Runs the app with a production WSGI server, chosen by the server option of the config.
+
+        With gunicorn, the songs are scanned once in the master process before the workers are forked,
+        so the workers share the scanned groups, songs and charts copy-on-write instead of each scanning the library.
+        Each worker opens its own SQLite and MongoDB connections after the fork.
+        Audio jobs and library watching run in the worker when there is a single worker. With more workers,
+        each would only update its own copy of the songs, so audio jobs are done during the scan and the library
+        is not watched; restart the server to pick up changes.
+
+        :param config: The config, read for the server options.
+        :param create_app_handler: Builds the app handler. It is passed whether to start the background services.
+        :param host: The host to listen on.
+        :param port: The port to listen on.
+        """
+        self.config = config
+        self.create_app_handler = create_app_handler
+        self.host = host
+        self.port = port
+        self.app_handler: Optional[FlaskAppHandler] = None
+
+    def run(self):
+        server = select_server(self.config.server)
+        logger.info(f"Serving with {server}.")
+        if server == SERVER_GUNICORN:
+            self.run_gunicorn()
+        elif server == SERVER_WAITRESS:
+            self.app_handler = self.create_app_handler(True)
+            if self.config.server_workers > 1:
+                logger.warning("waitress runs a single process. Only the threads option is used.")
+            waitress.serve(self.app_handler.app, host=self.host, port=self.port, threads=self.config.server_threads)
+        else:
+            self.app_handler = self.create_app_handler(True)
+            self.app_handler.run()
+
+    def run_gunicorn(self):
+        workers = self.config.server_workers
+        if workers > 1:
+            if self.config.background_audio_jobs:
+                logger.warning("Audio jobs are done during the scan, since they cannot be shared by multiple workers.")
+                self.config.background_audio_jobs = False
+            if self.config.watch_songs_directory:
+                logger.warning("The songs directory is not watched with multiple workers. Restart to rescan it.")
+                self.config.watch_songs_directory = False
+
+        # Scanned before forking, also with a single worker, so a long scan does not trip the worker timeout
+        self.app_handler = self.create_app_handler(False)
+        # Objects that exist now are never collected, so the collector does not write to (and copy) the shared pages
+        gc.freeze()
+
+        options = {
+            "bind": f"{self.host}:{self.port}",
+            "workers": workers,
+            "threads": self.config.server_threads,
+            "worker_class": "gthread",
+            "timeout": self.config.server_timeout_seconds,
+            "post_fork": self.post_fork,
+        }
+        GunicornApplication(self.app_handler.app, options).run()
+
+    def post_fork(self, server, worker):
+        """
+        Runs in each worker process right after it is forked.
+        """
+        # SQLite connections are reopened by the connection manager on first use in the worker
+        self.app_handler.score_store.reconnect_after_fork()
+        self.app_handler.start_background_services()
@@ -0,0 +1,125 @@
+import logging
+import shutil
+import subprocess
+from typing import Optional
+
+import mutagen
+from pydub import AudioSegment
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_FILE_NAME = 'reso-dmx-sample.ogg'
+CONVERTIBLE_AUDIO_EXTENSIONS = ('.mp3', '.wav')
+
+
+def load_audio(audio_file_path: str) -> AudioSegment:
+    """
+    Decodes an mp3, ogg or wav file.
+
+    :raises ValueError: If the audio format is not supported.
+    """
+    if audio_file_path.endswith('.mp3'):
+        return AudioSegment.from_mp3(audio_file_path)
+    elif audio_file_path.endswith('.ogg'):
+        return AudioSegment.from_ogg(audio_file_path)
+    elif audio_file_path.endswith('.wav'):
+        return AudioSegment.from_wav(audio_file_path)
+    raise ValueError(f"Unsupported audio format: {audio_file_path}")
+
+
+def convert_audio_to_ogg(original_audio_file_path: str, ogg_file_path: str):
+    """
+    Converts an mp3 or wav file to ogg.
+
+    :raises ValueError: If the audio format is not supported.
+    """
+    if not original_audio_file_path.endswith(CONVERTIBLE_AUDIO_EXTENSIONS):
+        raise ValueError(f"Unsupported audio format for conversion: {original_audio_file_path}")
+    audio = load_audio(original_audio_file_path)
+    # Export the audio as an ogg file
+    audio.export(ogg_file_path, format='ogg')
+
+
+def get_ffmpeg_path() -> Optional[str]:
+    """
+    :return: The path of the ffmpeg executable pydub uses, or None if it cannot be found.
+    """
+    return shutil.which(AudioSegment.converter)
+
+
+def get_audio_length(audio_file_path: str) -> Optional[float]:
+    """
+    :return: The length of the audio in seconds, read from the file's headers, or None if it cannot be read.
+    """
+    try:
+        audio = mutagen.File(audio_file_path)
+        return float(audio.info.length) if audio is not None else None
+    except Exception as e:
+        logger.info(f"Error reading the length of {audio_file_path}: {e}")
+        return None
+
+
+def export_sample_ogg(audio_file_path: str, sample_path: str, sample_start: float, sample_length: float):
+    """
+    Cuts the preview sample out of a song's audio and exports it as ogg, fading out over the last 10% of the sample.
+
+    With ffmpeg available, ffmpeg seeks to the sample start and decodes only the sample, streaming it through the fade
+    into the encoder, so memory use does not depend on the length of the track. Otherwise the whole track is decoded.
+
+    :param audio_file_path: The song's audio file.
+    :param sample_path: Where to write the sample.
+    :param sample_start: Start of the sample in seconds.
+    :param sample_length: Length of the sample in seconds.
+    :raises ValueError: If the audio format is not supported.
+    """
+    if not audio_file_path.endswith(('.mp3', '.ogg', '.wav')):
+        raise ValueError(f"Unsupported audio format: {audio_file_path}")
+
+    ffmpeg_path = get_ffmpeg_path()
+    if ffmpeg_path is None:
+        export_sample_ogg_from_decoded_audio(audio_file_path, sample_path, sample_start, sample_length)
+        return
+
+    # The sample ends early if the track does, and the fade out is moved to where it ends
+    audio_length = get_audio_length(audio_file_path)
+    available_length = sample_length
+    if audio_length is not None and audio_length - sample_start > 0:
+        available_length = min(sample_length, audio_length - max(sample_start, 0.0))
+    # Apply fade out to the last 10% of the sample_length
+    fade_duration = min(sample_length * 0.1, available_length)
+    command = [
+        ffmpeg_path, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        # -ss and -t before -i seek in the input, so the audio before the sample is skipped rather than decoded
+        "-ss", f"{max(sample_start, 0.0):.3f}", "-t", f"{sample_length:.3f}", "-i", audio_file_path,
+        "-vn",  # Leave out embedded cover art
+        "-af", f"afade=t=out:st={available_length - fade_duration:.3f}:d={fade_duration:.3f}",
+        # Fails without libvorbis, rather than letting the ogg muxer pick another codec (e.g. FLAC)
+        "-c:a", "libvorbis",
+        "-f", "ogg", sample_path,
+    ]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {result.returncode}: "
+                           f"{result.stderr.decode('utf-8', errors='replace').strip()}")
+
+
+def export_sample_ogg_from_decoded_audio(audio_file_path: str, sample_path: str, sample_start: float, sample_length: float):
+    """
+    Like export_sample_ogg, but decodes the whole track with pydub and slices the sample out of it.
+    """
+    # Load the original audio file
+    original_audio = load_audio(audio_file_path)
+
+    # Define the start and end time in milliseconds for the sample
+    start_ms = sample_start * 1000
+    end_ms = start_ms + (sample_length * 1000)
+
+    # Cut the sample from the original audio
+    sample = original_audio[start_ms:end_ms]
+
+    # Apply fade out to the last 10% of the sample_length
+    fade_duration = sample_length * 0.1 * 1000  # Last 10% of the sample_length
+    sample_with_fadeout = sample.fade_out(int(fade_duration))
+
+    # Export the sample as an ogg file
+    sample_with_fadeout.export(sample_path, format='ogg')
@@ -0,0 +1,78 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout_seconds: float = 30.0):
+        """
+        Stops calls to a service that keeps failing, so callers fail fast instead of each waiting for a timeout.
+
+        The circuit opens after failure_threshold consecutive failures. While it is open, allow_request returns False.
+        After reset_timeout_seconds, a single trial call is allowed (half-open): its success closes the circuit,
+        and its failure opens it again for another reset_timeout_seconds.
+
+        :param name: The name of the service, for logging.
+        :param failure_threshold: The number of consecutive failures that open the circuit.
+        :param reset_timeout_seconds: How long the circuit stays open before a trial call is allowed.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failure_count = 0
+        self._opened_at = 0.0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_seconds:
+                return STATE_HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        """
+        :return: Whether the service may be called. When the reset timeout is over, only the first caller is allowed,
+                 and it must report the outcome with record_success or record_failure.
+        """
+        with self._lock:
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_seconds:
+                self._state = STATE_HALF_OPEN
+                return True
+            # Open, or half-open with the trial call in flight
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info(f"{self.name} is reachable again. Closing the circuit.")
+            self._state = STATE_CLOSED
+            self._failure_count = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failure_count += 1
+            if self._state == STATE_HALF_OPEN or self._failure_count >= self.failure_threshold:
+                self._open()
+
+    def trip(self):
+        """
+        Opens the circuit right away, e.g. when the service is known to be unreachable.
+        """
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        if self._state != STATE_OPEN:
+            logger.warning(f"{self.name} is unreachable. Opening the circuit for {self.reset_timeout_seconds}s.")
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
@@ -0,0 +1,100 @@
+import gzip
+import zlib
+from typing import Optional, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # zlib is used if zstandard is not installed
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # Brotli encodings are not produced if brotli is not installed
+    brotli = None
+
+# Stored next to each compressed column, so rows written with a different format can still be read
+FORMAT_RAW = 0
+FORMAT_ZLIB = 1
+FORMAT_ZSTD = 2
+# Can be sent as is with Content-Encoding: gzip
+FORMAT_GZIP = 3
+# Can be sent as is with Content-Encoding: br
+FORMAT_BROTLI = 4
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+# Used for data compressed once and served many times
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# The Content-Encoding each format can be served with
+CONTENT_ENCODINGS = {FORMAT_GZIP: "gzip", FORMAT_BROTLI: "br"}
+
+
+def get_default_format() -> int:
+    return FORMAT_ZSTD if zstandard is not None else FORMAT_ZLIB
+
+
+def compress_text(text: str, compression_format: Optional[int] = None) -> Tuple[bytes, int]:
+    """
+    Compresses text for storage.
+
+    :param text: The text to compress.
+    :param compression_format: The format to compress with. Defaults to zstd if zstandard is installed, and zlib otherwise.
+    :return: A tuple containing the compressed bytes and the format they were compressed with.
+    """
+    if compression_format is None:
+        compression_format = get_default_format()
+    data = text.encode('utf-8')
+    if compression_format == FORMAT_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data), FORMAT_ZSTD
+    if compression_format == FORMAT_ZLIB:
+        return zlib.compress(data, ZLIB_LEVEL), FORMAT_ZLIB
+    if compression_format == FORMAT_GZIP:
+        # A fixed mtime keeps the output (and so the stored bytes) the same for the same text
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0), FORMAT_GZIP
+    if compression_format == FORMAT_BROTLI:
+        if brotli is None:
+            raise RuntimeError("brotli must be installed to compress with brotli")
+        return brotli.compress(data, quality=BROTLI_QUALITY), FORMAT_BROTLI
+    if compression_format == FORMAT_RAW:
+        return data, FORMAT_RAW
+    raise ValueError(f"Unknown compression format: {compression_format}")
+
+
+def decompress_text(data: Union[bytes, str, None], compression_format: int) -> Optional[str]:
+    """
+    Reverses compress_text.
+
+    :param data: The stored value. Rows stored before compression was introduced hold the text itself.
+    :param compression_format: The format the value was stored with.
+    :return: The text, or None if data is None.
+    """
+    if data is None:
+        return None
+    if compression_format == FORMAT_RAW:
+        return data if isinstance(data, str) else bytes(data).decode('utf-8')
+    if compression_format == FORMAT_ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    if compression_format == FORMAT_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard must be installed to read data compressed with zstd")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    if compression_format == FORMAT_GZIP:
+        return gzip.decompress(data).decode('utf-8')
+    if compression_format == FORMAT_BROTLI:
+        if brotli is None:
+            raise RuntimeError("brotli must be installed to read data compressed with brotli")
+        return brotli.decompress(data).decode('utf-8')
+    raise ValueError(f"Unknown compression format: {compression_format}")
+
+
+def compress_text_for_serving(text: str) -> Tuple[bytes, Optional[bytes]]:
+    """
+    Compresses text that is served over HTTP, in the encodings it can be sent with as is.
+
+    :return: A tuple containing the text in FORMAT_GZIP, and in FORMAT_BROTLI if brotli is installed (None otherwise).
+    """
+    gzip_data, _ = compress_text(text, FORMAT_GZIP)
+    brotli_data = compress_text(text, FORMAT_BROTLI)[0] if brotli is not None else None
+    return gzip_data, brotli_data
@@ -0,0 +1,67 @@
+import os
+from typing import Dict, List, Optional, Set
+
+
+class DirectoryIndex:
+    def __init__(self, directory: str):
+        """
+        A listing of a directory, taken once with os.scandir, that file lookups are resolved against
+        instead of listing or stat-ing the directory again.
+
+        Stat results are fetched from the DirEntry the first time they are needed and cached.
+        The index can be pickled (e.g. to send it to an ingest worker process); the DirEntry objects are not,
+        but the stat results fetched so far are.
+
+        :param directory: The directory to index.
+        """
+        self.directory = directory
+        # All entry names, in the order os.listdir would return them
+        self.names: List[str] = []
+        self.directory_names: Set[str] = set()
+        self._name_set = set()
+        self._entries: Dict[str, os.DirEntry] = {}
+        self._stats: Dict[str, os.stat_result] = {}
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                self.names.append(entry.name)
+                self._name_set.add(entry.name)
+                self._entries[entry.name] = entry
+                try:
+                    if entry.is_dir():
+                        self.directory_names.add(entry.name)
+                except OSError:
+                    pass
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_entries'] = {}
+        return state
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def exists(self, name: str) -> bool:
+        return name in self._name_set
+
+    def is_dir(self, name: str) -> bool:
+        return name in self.directory_names
+
+    def add(self, name: str):
+        """
+        Records a file that was created in the directory after it was indexed, e.g. a converted audio file.
+        """
+        if name not in self._name_set:
+            self.names.append(name)
+            self._name_set.add(name)
+
+    def stat(self, name: str) -> os.stat_result:
+        stat_result = self._stats.get(name)
+        if stat_result is None:
+            entry: Optional[os.DirEntry] = self._entries.get(name)
+            stat_result = entry.stat() if entry is not None else os.stat(self.path(name))
+            self._stats[name] = stat_result
+        return stat_result
+
+    def getmtime(self, name: str) -> float:
+        return self.stat(name).st_mtime
@@ -1,4 +1,7 @@
+import hashlib
 import logging
+import os
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
@@ -36,3 +39,53 @@ def read_file_with_encodings(file_path: str, encodings_to_try=None) -> str:
     except Exception as e:
         logger.error(f"Failed to read {file_path} with error replacement: {e}")
         raise Exception(f"Could not read the file {file_path} with any encoding.") from e
+
+
+def decode_with_encodings(data: bytes, file_path: str, encodings_to_try=None) -> str:
+    """
+    Decodes the bytes of a file the way read_file_with_encodings reads it, including its newline translation,
+    for when the bytes were already read (e.g. to hash them).
+
+    :param data: The contents of the file.
+    :param file_path: Path of the file, for logging.
+    :param encodings_to_try: List of encodings to attempt, in order. Defaults to common encodings.
+    :return: The contents of the file as a string.
+    """
+    if encodings_to_try is None:
+        encodings_to_try = ['utf-8', 'windows-1252', 'latin-1']
+
+    contents = None
+    for encoding in encodings_to_try:
+        try:
+            contents = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            pass
+
+    if contents is None:
+        contents = data.decode('utf-8', errors='replace')
+        logger.warning(f"Read {file_path} using utf-8 with errors replaced.")
+
+    # Text mode reads translate all newlines to \n
+    return contents.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def compute_content_hash(data: bytes) -> str:
+    """
+    :return: A hash of the contents of a file, used to tell whether a file's bytes changed.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def get_file_version(file_path: str) -> Optional[str]:
+    """
+    Identifies the current contents of a file by its modification time and size, without reading it.
+    Used in asset URLs, so a URL always refers to the same bytes and can be cached indefinitely.
+
+    :return: The version, or None if the file does not exist.
+    """
+    try:
+        stat_result = os.stat(file_path)
+    except OSError:
+        return None
+    return f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# Returned by TTLCache.get for keys that are not cached, since None is a value that can be cached
+MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60.0):
+        """
+        A thread-safe cache whose entries expire ttl_seconds after they are set.
+        Once max_entries are cached, the least recently used entry is evicted. Expired entries are kept until they
+        are set again or evicted, so get can still return them with include_expired.
+
+        :param max_entries: The maximum number of entries.
+        :param ttl_seconds: How long an entry is used before it is loaded again. 0 disables the cache.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented by every invalidation, so a value loaded before an invalidation is not cached after it
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, key: Hashable, include_expired: bool = False) -> Any:
+        """
+        :param include_expired: Whether to return an expired value that has not been evicted yet, and keep it,
+                                e.g. when the value cannot be loaded again right now.
+        :return: The cached value, or MISSING if the key is not cached or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] <= time.monotonic() and not include_expired):
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, version: Optional[int] = None):
+        """
+        :param version: The version read before the value was loaded. If anything was invalidated since,
+                        the value may be stale and is not cached.
+        """
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """
+        :return: The cached value, or the value returned by load, which is then cached.
+        """
+        value = self.get(key)
+        if value is MISSING:
+            version = self._version
+            value = load()
+            self.set(key, value, version=version)
+        return value
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._version += 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]):
+        """
+        Invalidates every key for which predicate returns True.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+            self._version += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version += 1
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,124 @@
+import struct
+
+import pytest
+from mutagen.ogg import OggPage
+
+from modules.ScoreStore import ScoreStoreUnavailableError
+
+
+class StubScoreStore:
+    """
+    Stands in for the ScoreStore of a SQLiteConnector or a ScoreBuffer, keeping scores in a dict.
+    """
+    def __init__(self):
+        self.scores = {}
+        self.bulk_write_count = 0
+        self.deleted_chart_guids = []
+        # Make add_scores_bulk fail as if the cluster was unreachable, and add_score as if the circuit was open
+        self.fail = False
+        self.unavailable = False
+        # Called once by the next bulk write before it lands, e.g. to run another flush meanwhile
+        self.before_bulk_write = None
+        # Called with the chart GUIDs by each delete_scores_for_charts
+        self.on_delete_scores_for_charts = None
+
+    def add_score(self, user_id, chart_guid, percentage_score, timestamp):
+        if self.unavailable:
+            raise ScoreStoreUnavailableError("circuit open")
+        self.scores[(user_id, chart_guid)] = percentage_score
+
+    def add_scores_bulk(self, scores):
+        if self.fail:
+            raise ConnectionError("cluster unreachable")
+        self.bulk_write_count += 1
+        if self.before_bulk_write:
+            before_bulk_write, self.before_bulk_write = self.before_bulk_write, None
+            before_bulk_write()
+        for score in scores:
+            self.scores[(score["user_id"], score["chart_guid"])] = score["percentage_score"]
+
+    def get_user_score(self, user_id, chart_guid):
+        if (user_id, chart_guid) not in self.scores:
+            return None
+        return {"user_id": user_id, "chart_guid": chart_guid, "percentage_score": self.scores[(user_id, chart_guid)]}
+
+    def get_user_scores_bulk(self, user_id, chart_ids):
+        return {chart_id: self.scores.get((user_id, chart_id)) for chart_id in chart_ids}
+
+    def delete_scores_for_charts(self, chart_guids):
+        self.deleted_chart_guids.extend(chart_guids)
+        if self.on_delete_scores_for_charts:
+            self.on_delete_scores_for_charts(chart_guids)
+
+
+def build_ogg_vorbis_file_contents(duration_seconds, sample_rate=44100):
+    """
+    :return: The headers of an Ogg Vorbis file without audio data, which mutagen reads as duration_seconds long.
+    """
+    identification_header = b"\x01vorbis" + struct.pack("<IBIiii", 0, 2, sample_rate, 0, 128000, 0) + b"\xb8\x01"
+    comment_header = b"\x03vorbis" + struct.pack("<II", 0, 0) + b"\x01"
+    last_packet = b"\x00"
+    file_contents = b""
+    for sequence, (packet, position) in enumerate([(identification_header, 0),
+                                                   (comment_header, 0),
+                                                   (last_packet, int(duration_seconds * sample_rate))]):
+        page = OggPage()
+        page.serial = 1
+        page.sequence = sequence
+        page.position = position
+        page.packets = [packet]
+        page.first = sequence == 0
+        page.last = sequence == 2
+        file_contents += page.write()
+    return file_contents
+
+
+def build_measures(width, measure_count, rows):
+    measures = []
+    for measure_index in range(measure_count):
+        measure_rows = []
+        for row_index in range(rows):
+            row = ["0"] * width
+            if (measure_index + row_index) % 3 == 0:
+                row[(measure_index * 3 + row_index) % width] = "1"
+            measure_rows.append("".join(row))
+        measures.append("\n".join(measure_rows))
+    return "\n,\n".join(measures)
+
+
+def build_sm_file_contents(title, double=False):
+    bpms = "0.000=120.000,16.000=180.500"
+    sm_file_contents = f"#TITLE:{title};\n#ARTIST:Artist;\n#OFFSET:-0.123;\n#SAMPLESTART:10.0;\n#SAMPLELENGTH:12.0;\n" \
+                       f"#BPMS:{bpms};\n#STOPS:8.000=0.500;\n"
+    charts = [("dance-single", "Easy", 3, 4, 4), ("dance-single", "Hard", 9, 4, 16)]
+    if double:
+        charts.append(("dance-double", "Challenge", 12, 8, 8))
+    for mode, difficulty_name, difficulty_level, width, rows in charts:
+        sm_file_contents += f"#NOTES:\n     {mode}:\n     :\n     {difficulty_name}:\n     {difficulty_level}:\n" \
+                            f"     0,0,0,0,0:\n{build_measures(width, 12, rows)}\n;\n"
+    return sm_file_contents
+
+
+@pytest.fixture
+def score_store():
+    return StubScoreStore()
+
+
+@pytest.fixture
+def song_library(tmp_path):
+    """
+    A songs directory with two groups of two songs. Every song has an ogg file and a sample, so nothing is converted.
+
+    :return: The path of the songs directory.
+    """
+    root_directory = tmp_path / "songs"
+    for group_index in range(2):
+        for song_index in range(2):
+            song_directory = root_directory / f"Group {group_index}" / f"Song {song_index}"
+            song_directory.mkdir(parents=True)
+            (song_directory / "song.ogg").write_bytes(build_ogg_vorbis_file_contents(90))
+            (song_directory / "reso-dmx-sample.ogg").write_bytes(b"OggS")
+            (song_directory / "cover-jacket.png").write_bytes(b"\x89PNG")
+            (song_directory / "song.sm").write_text(
+                build_sm_file_contents(f"Song {group_index}-{song_index}", double=song_index == 1))
+    return str(root_directory)
@@ -0,0 +1,132 @@
+import os
+import time
+
+import pytest
+
+import modules.AudioJobQueue as AudioJobQueueModule
+from modules.AudioJobQueue import AudioJobQueue
+from modules.SQLiteConnector import SQLiteConnector
+from modules.utils.AudioUtils import SAMPLE_FILE_NAME
+from modules.utils.DirectoryIndex import DirectoryIndex
+
+
+class StubSong:
+    def __init__(self, directory):
+        self.name = "Song"
+        self.directory = directory
+        self.directory_index = DirectoryIndex(directory)
+        self.audio_file_path = os.path.join(directory, "song.mp3")
+        self.audio_file_name = "song.mp3"
+        self.pending_ogg_audio_file_path = None
+        self.sample_start = 0.0
+        self.sample_length = 10.0
+        self.sample_pending = False
+
+
+class StubExportSampleOgg:
+    def __init__(self, failures):
+        """
+        :param failures: The number of calls that fail before the sample is written.
+        """
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self, audio_file_path, sample_path, sample_start, sample_length):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("ffmpeg crashed")
+        with open(sample_path, "wb") as f:
+            f.write(b"OggS")
+
+
+# ---------------------
+# Helpers
+@pytest.fixture
+def connector(tmp_path, score_store):
+    connector = SQLiteConnector(db_path=str(tmp_path / "test.db"), score_store=score_store)
+    yield connector
+    connector.close()
+
+
+@pytest.fixture
+def song_directory(tmp_path):
+    song_directory = tmp_path / "Group" / "Song"
+    song_directory.mkdir(parents=True)
+    (song_directory / "song.mp3").write_bytes(b"ID3")
+    return str(song_directory)
+
+
+def use_export_sample_ogg(monkeypatch, failures):
+    export_sample_ogg = StubExportSampleOgg(failures)
+    monkeypatch.setattr(AudioJobQueueModule, "export_sample_ogg", export_sample_ogg)
+    return export_sample_ogg
+
+
+def wait_until(condition, timeout_seconds=5.0):
+    deadline = time.monotonic() + timeout_seconds
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting for the audio job"
+        time.sleep(0.01)
+
+
+# ---------------------
+# TESTS
+def test_failed_job_is_retried(monkeypatch, connector, song_directory):
+    export_sample_ogg = use_export_sample_ogg(monkeypatch, failures=1)
+    queue = AudioJobQueue(connector, max_attempts=3, retry_delay_seconds=0.01)
+    song = StubSong(song_directory)
+
+    queue.submit_song_jobs(song)
+    assert song.sample_pending
+    wait_until(lambda: not song.sample_pending)
+
+    assert export_sample_ogg.calls == 2
+    assert os.path.exists(os.path.join(song_directory, SAMPLE_FILE_NAME))
+    assert song.directory_index.exists(SAMPLE_FILE_NAME)
+    job = connector.get_audio_job(os.path.join(song_directory, SAMPLE_FILE_NAME))
+    assert (job["status"], job["attempts"]) == ("done", 1)
+    # The library watcher ignores the files the queue writes
+    assert queue.is_job_output(os.path.join(song_directory, SAMPLE_FILE_NAME))
+    assert queue.is_job_output(os.path.join(song_directory, SAMPLE_FILE_NAME + ".part"))
+    assert not queue.is_job_output(song.audio_file_path)
+    queue.shutdown()
+
+
+def test_job_that_keeps_failing_is_given_up_on(monkeypatch, connector, song_directory):
+    export_sample_ogg = use_export_sample_ogg(monkeypatch, failures=10)
+    queue = AudioJobQueue(connector, max_attempts=2, retry_delay_seconds=0.01)
+    song = StubSong(song_directory)
+
+    queue.submit_song_jobs(song)
+    wait_until(lambda: not song.sample_pending)
+
+    assert export_sample_ogg.calls == 2
+    assert not os.path.exists(os.path.join(song_directory, SAMPLE_FILE_NAME))
+    assert not os.path.exists(os.path.join(song_directory, SAMPLE_FILE_NAME + ".part"))
+    assert connector.get_audio_job(os.path.join(song_directory, SAMPLE_FILE_NAME))["status"] == "failed"
+
+    # A rescanned song does not wait for a job that is not queued again
+    rescanned_song = StubSong(song_directory)
+    queue.submit_song_jobs(rescanned_song)
+    assert not rescanned_song.sample_pending
+    assert export_sample_ogg.calls == 2
+    queue.shutdown()
+
+
+def test_song_resubmitted_while_its_job_is_queued_is_updated(monkeypatch, connector, song_directory):
+    export_sample_ogg = use_export_sample_ogg(monkeypatch, failures=0)
+    queue = AudioJobQueue(connector, start=False)
+    song = StubSong(song_directory)
+    queue.submit_song_jobs(song)
+
+    # A rescan creates a new Song for the same directory before the job has run
+    rescanned_song = StubSong(song_directory)
+    queue.submit_song_jobs(rescanned_song)
+    assert song.sample_pending and rescanned_song.sample_pending
+
+    queue.start()
+    wait_until(lambda: not song.sample_pending and not rescanned_song.sample_pending)
+
+    assert export_sample_ogg.calls == 1
+    assert rescanned_song.directory_index.exists(SAMPLE_FILE_NAME)
+    queue.shutdown()
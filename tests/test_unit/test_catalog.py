@@ -0,0 +1,63 @@
+import json
+from types import SimpleNamespace
+
+from modules.Catalog import Catalog
+from modules.Music.Chart import Chart
+from modules.Music.Group import Group
+
+
+# ---------------------
+# Helpers
+def build_song(title, levels):
+    charts = [Chart(chart_id=f"{title}-{level}", mode="dance-single", difficulty_name="Hard", difficulty_level=level,
+                    note_count=level * 100) for level in levels]
+    return SimpleNamespace(song_id=title, title=title, artist="Artist 🎵", duration_str="1:30", charts=charts,
+                           details=f"{title}\nArtist\nBPM: 150\nDuration: 1:30",
+                           bpm_display="BPM: 150",
+                           chart_levels="/".join(str(level) for level in levels))
+
+
+def build_groups():
+    group = Group("Group", directory_path="/songs/Group")
+    group.songs = [build_song("First", [3, 9]), build_song("Second\nLine", [12])]
+    group.display_name = group.get_display_name()
+    return [group]
+
+
+def take(text, position, width):
+    return text[position:position + width], position + width
+
+
+# ---------------------
+# TESTS
+def test_resonite_format_is_fixed_width():
+    catalog = Catalog(build_groups(), version=7)
+    text = catalog.resonite_string
+
+    version, position = take(text, 0, 8)
+    group_count, position = take(text, position, 4)
+    group_name, position = take(text, position, 64)
+    song_count, position = take(text, position, 4)
+    assert (version, group_count, group_name.rstrip(), song_count) == ("00000007", "0001", "Group (2 ♫)", "0002")
+
+    titles = []
+    for _ in range(int(song_count)):
+        title, position = take(text, position, 64)
+        artist, position = take(text, position, 64)
+        position += 24 + 8
+        chart_count, position = take(text, position, 2)
+        titles.append(title.rstrip())
+        assert artist.rstrip() == "Artist ?"
+        position += int(chart_count) * (1 + 10 + 2 + 5)
+    assert titles == ["First", "Second Line"]
+    assert position == len(text)
+    assert catalog.group_resonite_strings[0] == text[:8] + text[12:]
+
+
+def test_json_format():
+    catalog = Catalog(build_groups(), version=2)
+    songs = json.loads(catalog.json)["groups"][0]["songs"]
+    assert [song["chart_levels"] for song in songs] == ["3/9", "12"]
+    assert songs[0]["charts"][1] == {"guid": "First-9", "mode": "dance-single", "difficulty": "Hard", "level": 9,
+                                     "note_count": 900}
+    assert json.loads(catalog.group_json[0])["version"] == 2
@@ -0,0 +1,53 @@
+import pytest
+
+from modules.Music.ChartEncoding import (encode_compact, decode_compact, zigzag_encode, zigzag_decode,
+                                         parse_time_ticks, format_time_ticks)
+
+# Records of a time, the arrows (including a hold end and a mine) and the measure size
+SINGLE_RESONITE_STRING = "".join([
+    "-001.5000000" "1000" "004",
+    "0000.0000000" "0100" "004",
+    "0000.2500000" "0011" "004",
+    "0000.2500000" "3000" "004",
+    "0000.5000000" "0M00" "008",
+    "0000.6250000" "0001" "008",
+    "0012.3456789" "1001" "012",
+    "0999.9999999" "0001" "020",
+    "0001.0000000" "0010" "012",
+])
+DOUBLE_RESONITE_STRING = "".join([
+    "0001.0000000" "10000001" "004",
+    "0001.1250000" "00013000" "008",
+    "0009.0000000" "11111111" "016",
+])
+
+
+# ---------------------
+# TESTS
+@pytest.mark.parametrize("value", [0, 1, -1, 63, -64, 2 ** 40, -(2 ** 40)])
+def test_zigzag_round_trip(value):
+    assert zigzag_encode(value) >= 0
+    assert zigzag_decode(zigzag_encode(value)) == value
+
+
+@pytest.mark.parametrize("time_field", ["0000.0000000", "0001.2345678", "-001.5000000", "0999.9999999"])
+def test_time_ticks_round_trip(time_field):
+    assert format_time_ticks(parse_time_ticks(time_field)) == time_field
+
+
+@pytest.mark.parametrize("resonite_string, arrow_count", [
+    (SINGLE_RESONITE_STRING, 4),
+    (DOUBLE_RESONITE_STRING, 8),
+    ("", 4),
+])
+def test_compact_round_trip(resonite_string, arrow_count):
+    encoded = encode_compact(resonite_string, arrow_count)
+    assert decode_compact(encoded) == resonite_string
+    assert len(encoded) < len(resonite_string) or not resonite_string
+
+
+def test_rejects_partial_records():
+    with pytest.raises(ValueError):
+        encode_compact(SINGLE_RESONITE_STRING[:-1], 4)
+    with pytest.raises(ValueError):
+        decode_compact(b"not a chart")
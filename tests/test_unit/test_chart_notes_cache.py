@@ -0,0 +1,123 @@
+import pytest
+
+from modules.ChartNotesCache import ChartNotesCache
+from modules.Music.Chart import Chart
+from modules.SQLiteConnector import SQLiteConnector
+from modules.utils.CompressionUtils import FORMAT_GZIP
+
+
+class StubSQLiteConnector:
+    def __init__(self, notes):
+        self.notes = notes
+        self.reads = []
+
+    def get_chart_notes(self, chart_guid):
+        self.reads.append(chart_guid)
+        return self.notes.get(chart_guid)
+
+
+# ---------------------
+# Helpers
+def build_notes(size):
+    return b"x" * size, FORMAT_GZIP, None
+
+
+@pytest.fixture
+def connector(tmp_path, score_store):
+    connector = SQLiteConnector(db_path=str(tmp_path / "test.db"), score_store=score_store)
+    yield connector
+    connector.close()
+
+
+def build_chart():
+    chart = Chart(chart_id=None, mode="dance-single", difficulty_name="Hard", difficulty_level=5, note_count=2,
+                  beats_as_resonite_string="0001.00000001000016" * 50)
+    chart.compress_beats_as_resonite_string()
+    return chart
+
+
+def insert_chart(connector, chart):
+    return connector.insert_charts([{"chart_guid": chart.chart_id,
+                                     "song_guid": "song",
+                                     "sm_file_path": "/songs/Group/Song/song.sm",
+                                     "mode": chart.mode,
+                                     "difficulty_name": chart.difficulty_name,
+                                     "difficulty_level": chart.difficulty_level,
+                                     "note_count": chart.note_count,
+                                     "compressed_beats_as_resonite_string": chart.compressed_beats_as_resonite_string,
+                                     "beats_format": chart.beats_format,
+                                     "brotli_beats_as_resonite_string": chart.brotli_beats_as_resonite_string}])
+
+
+# ---------------------
+# TESTS
+def test_notes_are_read_once_and_evicted_least_recently_used_first():
+    connector = StubSQLiteConnector({"chart1": build_notes(40), "chart2": build_notes(40), "chart3": build_notes(40)})
+    cache = ChartNotesCache(connector, max_bytes=100)
+
+    assert cache.get("chart1") == build_notes(40)
+    cache.get("chart2")
+    cache.get("chart1")
+    cache.get("chart3")
+
+    assert connector.reads == ["chart1", "chart2", "chart3"]
+    assert cache.stats["entries"] == 2
+    assert cache.stats["size_bytes"] == 80
+    assert cache.stats["evictions"] == 1
+
+    # chart2 was the least recently used, so it is read again
+    cache.get("chart1")
+    cache.get("chart2")
+    assert connector.reads == ["chart1", "chart2", "chart3", "chart2"]
+
+
+def test_missing_and_oversized_notes_are_not_cached():
+    connector = StubSQLiteConnector({"big": build_notes(200)})
+    cache = ChartNotesCache(connector, max_bytes=100)
+
+    assert cache.get("missing") is None
+    assert cache.get("big") == build_notes(200)
+    assert cache.get("big") == build_notes(200)
+    assert connector.reads == ["missing", "big", "big"]
+    assert cache.stats["entries"] == 0
+
+
+def test_released_chart_reads_its_notes_through_the_cache(connector):
+    chart = build_chart()
+    beats_as_resonite_string = chart.beats_as_resonite_string
+    content_encodings = chart.content_encodings
+    encoded = {encoding: chart.get_encoded_beats_as_resonite_string(encoding) for encoding in content_encodings}
+    assert insert_chart(connector, chart) == {chart.chart_id}
+    cache = ChartNotesCache(connector)
+
+    chart.release_notes(cache)
+
+    assert cache.stats["entries"] == 0
+    assert chart.beats_as_resonite_string == beats_as_resonite_string
+    assert chart.content_encodings == content_encodings
+    for encoding in content_encodings:
+        assert chart.get_encoded_beats_as_resonite_string(encoding) == encoded[encoding]
+    assert cache.stats["misses"] == 1
+
+
+def test_chart_loaded_without_notes(connector):
+    stored_chart = build_chart()
+    insert_chart(connector, stored_chart)
+    cache = ChartNotesCache(connector)
+
+    chart_info = connector.get_charts_by_song_guid("song", include_notes=False)[0]
+    assert chart_info["compressed_beats_as_resonite_string"] is None
+    chart = Chart(chart_id=chart_info["guid"],
+                  mode=chart_info["mode"],
+                  difficulty_name=chart_info["difficulty_name"],
+                  difficulty_level=chart_info["difficulty_level"],
+                  note_count=chart_info["note_count"],
+                  compressed_beats_as_resonite_string=chart_info["compressed_beats_as_resonite_string"],
+                  beats_format=chart_info["beats_format"],
+                  brotli_beats_as_resonite_string=chart_info["brotli_beats_as_resonite_string"],
+                  has_brotli_beats_as_resonite_string=chart_info["has_brotli_beats_as_resonite_string"],
+                  notes_cache=cache)
+
+    assert chart.content_encodings == stored_chart.content_encodings
+    assert chart.beats_as_resonite_string == stored_chart.beats_as_resonite_string
+    assert chart.get_resonite_string_window(offset=1, limit=2) == stored_chart.get_resonite_string_window(offset=1, limit=2)
@@ -0,0 +1,102 @@
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+
+from modules.MongoDBClient import MongoDBClient
+from modules.ScoreStore import ScoreStoreUnavailableError
+from modules.utils import CircuitBreaker as CircuitBreakerModule
+from modules.utils.CircuitBreaker import CircuitBreaker, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN
+from modules.utils import TTLCache as TTLCacheModule
+from modules.utils.TTLCache import TTLCache
+
+
+class UnreachableCollection:
+    def __init__(self):
+        self.query_count = 0
+
+    def find_one(self, query):
+        self.query_count += 1
+        raise ServerSelectionTimeoutError("No servers found")
+
+    def find(self, query):
+        self.query_count += 1
+        raise ServerSelectionTimeoutError("No servers found")
+
+
+# ---------------------
+# Helpers
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(CircuitBreakerModule.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def build_unreachable_mongodb_client(scores_cache):
+    # Skips __init__, which connects to the cluster
+    mongodb_client = MongoDBClient.__new__(MongoDBClient)
+    mongodb_client.scores_cache = scores_cache
+    mongodb_client._fallback_read_count = 0
+    mongodb_client.scores_collection = UnreachableCollection()
+    mongodb_client.circuit_breaker = CircuitBreaker("MongoDB", failure_threshold=2, reset_timeout_seconds=30)
+    return mongodb_client
+
+
+# ---------------------
+# TESTS
+def test_circuit_opens_after_consecutive_failures_and_closes_after_a_trial(clock):
+    circuit_breaker = CircuitBreaker("service", failure_threshold=2, reset_timeout_seconds=30)
+    circuit_breaker.record_failure()
+    circuit_breaker.record_success()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == STATE_CLOSED
+
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == STATE_OPEN
+    assert not circuit_breaker.allow_request()
+
+    clock.now += 30
+    assert circuit_breaker.state == STATE_HALF_OPEN
+    assert circuit_breaker.allow_request()
+    # Only one trial call at a time
+    assert not circuit_breaker.allow_request()
+    circuit_breaker.record_success()
+    assert circuit_breaker.state == STATE_CLOSED
+    assert circuit_breaker.allow_request()
+
+
+def test_failed_trial_opens_the_circuit_again(clock):
+    circuit_breaker = CircuitBreaker("service", failure_threshold=5, reset_timeout_seconds=30)
+    circuit_breaker.trip()
+    clock.now += 30
+    assert circuit_breaker.allow_request()
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == STATE_OPEN
+    clock.now += 29
+    assert not circuit_breaker.allow_request()
+
+
+def test_unreachable_mongodb_serves_expired_scores_and_fails_fast(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(TTLCacheModule.time, "monotonic", lambda: now[0])
+    scores_cache = TTLCache(ttl_seconds=60)
+    scores_cache.set(("player1", "chart1"), {"percentage_score": 90.0})
+    now[0] += 61
+    mongodb_client = build_unreachable_mongodb_client(scores_cache)
+
+    assert mongodb_client.get_user_score("player1", "chart1") == {"percentage_score": 90.0}
+    assert mongodb_client.get_user_scores_bulk("player1", ["chart1", "chart2"]) == {"chart1": 90.0, "chart2": None}
+    assert mongodb_client.scores_collection.query_count == 2
+
+    # The circuit is open, so the cluster is no longer queried
+    assert mongodb_client.get_user_score("player1", "chart2") is None
+    assert mongodb_client.scores_collection.query_count == 2
+    with pytest.raises(ScoreStoreUnavailableError):
+        mongodb_client.get_chart_scores("chart1")
@@ -0,0 +1,44 @@
+import gzip
+
+import pytest
+
+from modules.Music.Chart import Chart
+from modules.utils.CompressionUtils import FORMAT_RAW, FORMAT_ZLIB, FORMAT_GZIP, brotli, compress_text, decompress_text
+
+RESONITE_STRING = "0001.2345678100001600013456780100016" * 100
+
+
+# ---------------------
+# TESTS
+@pytest.mark.parametrize("compression_format", [FORMAT_RAW, FORMAT_ZLIB, FORMAT_GZIP, None])
+def test_round_trip(compression_format):
+    compressed, stored_format = compress_text(RESONITE_STRING, compression_format)
+    assert decompress_text(compressed, stored_format) == RESONITE_STRING
+
+
+def test_plain_text_rows_read_as_raw():
+    assert decompress_text("#TITLE:Song;", FORMAT_RAW) == "#TITLE:Song;"
+
+
+def test_chart_decompresses_on_read():
+    compressed, compression_format = compress_text(RESONITE_STRING)
+    chart = Chart(chart_id=None, mode="dance-single", difficulty_name="Hard", difficulty_level=5,
+                  compressed_beats_as_resonite_string=compressed, beats_format=compression_format)
+    assert chart.beats_as_resonite_string == RESONITE_STRING
+
+    chart.beats_as_resonite_string = "0001.0000000100001"
+    assert chart.beats_as_resonite_string == "0001.0000000100001"
+
+
+def test_compressed_chart_is_served_without_recompressing():
+    chart = Chart(chart_id=None, mode="dance-single", difficulty_name="Hard", difficulty_level=5)
+    chart.beats_as_resonite_string = RESONITE_STRING
+    chart.compress_beats_as_resonite_string()
+
+    assert chart.beats_format == FORMAT_GZIP
+    assert chart.content_encodings == (["br", "gzip"] if brotli is not None else ["gzip"])
+    assert chart.get_encoded_beats_as_resonite_string("gzip") is chart.compressed_beats_as_resonite_string
+    assert gzip.decompress(chart.get_encoded_beats_as_resonite_string("gzip")).decode() == RESONITE_STRING
+    assert chart.get_encoded_beats_as_resonite_string("identity") == RESONITE_STRING.encode()
+    with pytest.raises(ValueError):
+        chart.get_encoded_beats_as_resonite_string("deflate")
@@ -0,0 +1,67 @@
+import subprocess
+
+import pytest
+
+import modules.utils.AudioUtils as AudioUtilsModule
+from modules.utils.AudioUtils import export_sample_ogg, get_ffmpeg_path
+
+ffmpeg_path = get_ffmpeg_path()
+requires_ffmpeg = pytest.mark.skipif(ffmpeg_path is None, reason="ffmpeg is not installed")
+
+
+# ---------------------
+# Helper: Generate a silent ogg file of the given length
+def make_silent_ogg(path, seconds):
+    subprocess.run([ffmpeg_path, "-nostdin", "-loglevel", "error", "-y", "-f", "lavfi",
+                    "-i", "anullsrc=r=44100:cl=stereo", "-t", str(seconds), "-c:a", "libvorbis", str(path)],
+                   check=True)
+
+
+def run_export_sample_ogg(monkeypatch, tmp_path, audio_length, sample_start, sample_length):
+    """
+    Runs export_sample_ogg against a track of audio_length seconds without running ffmpeg.
+
+    :return: The ffmpeg command it ran.
+    """
+    commands = []
+    monkeypatch.setattr(AudioUtilsModule, "get_ffmpeg_path", lambda: "ffmpeg")
+    monkeypatch.setattr(AudioUtilsModule, "get_audio_length", lambda audio_file_path: audio_length)
+    monkeypatch.setattr(AudioUtilsModule.subprocess, "run",
+                        lambda command, **kwargs: commands.append(command) or subprocess.CompletedProcess(command, 0))
+    export_sample_ogg(str(tmp_path / "song.ogg"), str(tmp_path / "sample.ogg"), sample_start=sample_start,
+                      sample_length=sample_length)
+    return commands[0]
+
+
+# ---------------------
+# TESTS
+@requires_ffmpeg
+def test_sample_has_requested_length(tmp_path):
+    mutagen_oggvorbis = pytest.importorskip("mutagen.oggvorbis")
+    audio_path = tmp_path / "song.ogg"
+    sample_path = tmp_path / "reso-dmx-sample.ogg"
+    make_silent_ogg(audio_path, 30)
+
+    export_sample_ogg(str(audio_path), str(sample_path), sample_start=20.0, sample_length=8.0)
+
+    assert mutagen_oggvorbis.OggVorbis(str(sample_path)).info.length == pytest.approx(8.0, abs=0.1)
+
+
+def test_unsupported_format_raises(tmp_path):
+    with pytest.raises(ValueError):
+        export_sample_ogg(str(tmp_path / "song.flac"), str(tmp_path / "sample.ogg"), sample_start=0.0, sample_length=1.0)
+
+
+def test_sample_is_encoded_with_vorbis(monkeypatch, tmp_path):
+    command = run_export_sample_ogg(monkeypatch, tmp_path, audio_length=120.0, sample_start=30.0, sample_length=10.0)
+    assert command[command.index("-c:a") + 1] == "libvorbis"
+    assert command.index("-c:a") < command.index("-f")
+    assert command[command.index("-af") + 1] == "afade=t=out:st=9.000:d=1.000"
+
+
+def test_sample_of_a_track_ending_early_still_fades_out(monkeypatch, tmp_path):
+    command = run_export_sample_ogg(monkeypatch, tmp_path, audio_length=34.0, sample_start=30.0, sample_length=10.0)
+    assert command[command.index("-af") + 1] == "afade=t=out:st=3.000:d=1.000"
+
+    command = run_export_sample_ogg(monkeypatch, tmp_path, audio_length=30.5, sample_start=30.0, sample_length=10.0)
+    assert command[command.index("-af") + 1] == "afade=t=out:st=0.000:d=0.500"
@@ -0,0 +1,32 @@
+import pytest
+
+from modules.utils.FileUtils import read_file_with_encodings, decode_with_encodings, compute_content_hash, get_file_version
+
+
+# ---------------------
+# TESTS
+@pytest.mark.parametrize("data", [
+    "#TITLE:Song;\n#ARTIST:Artist;\n".encode("utf-8"),
+    "#TITLE:Sóng;\r\n#NOTES:\r\n0000\r\n".encode("utf-8"),
+    b"#TITLE:Caf\xe9;\r#ARTIST:\x93Artist\x94;\r",
+])
+def test_decode_matches_read(tmp_path, data):
+    path = tmp_path / "song.sm"
+    path.write_bytes(data)
+    assert decode_with_encodings(data, str(path)) == read_file_with_encodings(str(path))
+
+
+def test_content_hash_depends_on_bytes_only():
+    assert compute_content_hash(b"#TITLE:Song;") == compute_content_hash(b"#TITLE:Song;")
+    assert compute_content_hash(b"#TITLE:Song;") != compute_content_hash(b"#TITLE:Song;\n")
+
+
+def test_file_version_changes_with_file(tmp_path):
+    path = tmp_path / "audio.ogg"
+    assert get_file_version(str(path)) is None
+
+    path.write_bytes(b"OggS")
+    version = get_file_version(str(path))
+    assert version == get_file_version(str(path))
+    path.write_bytes(b"OggS\x00")
+    assert get_file_version(str(path)) != version
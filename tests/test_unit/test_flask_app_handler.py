@@ -0,0 +1,201 @@
+import os
+
+import pytest
+
+from modules.Config import Config
+from modules.FlaskAppHandler import FlaskAppHandler
+from modules.utils.FileUtils import get_file_version
+
+
+# ---------------------
+# Helpers
+@pytest.fixture
+def handler(tmp_path, song_library):
+    config_file_path = tmp_path / "config.ini"
+    config_file_path.write_text(f"[scores]\nbackend = sqlite\nsqlite_path = {tmp_path / 'scores.sqlite3'}\n"
+                                f"[sqlite]\npath = {tmp_path / 'songs.sqlite3'}\n"
+                                f"[io]\nsample_audio_filename = reso-dmx-sample.ogg\nbackground_audio_jobs = false\n")
+    handler = FlaskAppHandler(config=Config(str(config_file_path)), base_url="", host="localhost",
+                              root_directory=song_library, start_background_services=False)
+    yield handler
+    handler.score_store.close()
+
+
+@pytest.fixture
+def client(handler):
+    return handler.app.test_client()
+
+
+# ---------------------
+# TESTS
+def test_assets_are_served_without_generating_their_url_first(handler, client):
+    # As in a server worker other than the one that generated the URL
+    song = handler.all_groups[1].songs[0]
+    response = client.get(f"/assets/{song.song_id}/jacket")
+    assert response.status_code == 200
+    assert response.data == b"\x89PNG"
+    response.close()
+
+    assert client.get("/assets/unknown-guid/jacket").status_code == 404
+
+
+def test_chart_with_notes_no_longer_in_the_database_is_not_found(handler, client):
+    chart = handler.all_groups[0].songs[0].charts[0]
+    handler.sqlite_db_connector.conn.execute("DELETE FROM charts WHERE guid = ?", (chart.chart_id,))
+    handler.sqlite_db_connector.conn.commit()
+
+    notes_url = "/groups/0/songs/0/charts/0/notes"
+    assert client.get(notes_url, headers={"Accept-Encoding": "gzip"}).status_code == 404
+    assert client.get(notes_url, headers={"Accept-Encoding": "identity"}).status_code == 404
+    assert client.get(f"{notes_url}?encoding=compact").status_code == 404
+    assert client.get(f"{notes_url}/window?offset=0&limit=4").status_code == 404
+
+
+def test_replaced_charts_are_deleted_after_the_rescanned_groups_are_served(monkeypatch, handler, client, song_library):
+    song = handler.all_groups[0].songs[0]
+    previous_chart_guid = song.charts[0].chart_id
+    previous_notes = client.get("/groups/0/songs/0/charts/0/notes").data
+    with open(os.path.join(song.directory, song.sm_file_name), "a") as f:
+        f.write("\n")
+
+    previous_chart_served_until_swap = []
+    swap_in_rescanned_groups = handler.swap_in_rescanned_groups
+
+    def record_swap(rescanned_groups):
+        previous_chart_served_until_swap.append(
+            handler.sqlite_db_connector.get_chart_notes(previous_chart_guid) is not None)
+        swap_in_rescanned_groups(rescanned_groups)
+
+    monkeypatch.setattr(handler, "swap_in_rescanned_groups", record_swap)
+    handler.rescan_changed_groups({os.path.join(song_library, "Group 0")})
+
+    assert previous_chart_served_until_swap == [True]
+    assert handler.sqlite_db_connector.get_chart_notes(previous_chart_guid) is None
+    assert handler.all_groups[0].songs[0].charts[0].chart_id != previous_chart_guid
+    assert client.get("/groups/0/songs/0/charts/0/notes").data == previous_notes
+
+
+def test_personal_bests_are_returned_as_json_and_resonite_strings(handler, client):
+    assert client.get("/groups/0/personal_bests").status_code == 400
+    assert client.get("/groups/0/personal_bests?user_id=player1&response_type=xml").status_code == 400
+    assert [len(song.charts) for song in handler.all_groups[0].songs] == [3, 2]
+    assert client.get("/groups/0/personal_bests?user_id=player1").get_json() == [[None, None, None], [None, None]]
+
+    assert client.post("/db/score?user_id=player1&group_idx=0&song_idx=0&chart_idx=2&percentage_score=95.5"
+                       ).status_code == 200
+    assert client.post("/db/score?user_id=player1&group_idx=0&song_idx=1&chart_idx=0&percentage_score=100"
+                       ).status_code == 200
+    # The personal bests cached before the submissions are dropped
+    assert client.get("/groups/0/personal_bests?user_id=player1").get_json() == [[None, None, 95.5], [100.0, None]]
+    response = client.get("/groups/0/personal_bests?user_id=player1&response_type=resonite")
+    assert response.get_data(as_text=True) == "00.00%00.00%95.50%\n100%  00.00%"
+
+
+def test_personal_bests_submitted_to_another_worker_are_not_served_from_the_cache(handler, client):
+    chart_guid = handler.all_groups[0].songs[0].charts[0].chart_id
+    assert client.get("/groups/0/personal_bests?user_id=player1").get_json()[0] == [None, None, None]
+
+    # What another server worker does when the user submits a score to it
+    handler.score_store.add_score("player1", chart_guid, 90.0, 1)
+    handler.sqlite_db_connector.record_score_changes(["player1"])
+
+    assert client.get("/groups/0/personal_bests?user_id=player1").get_json()[0] == [90.0, None, None]
+
+
+def test_personal_bests_read_while_the_score_store_is_unavailable_are_not_cached(monkeypatch, handler, client):
+    fallback_read_count = [0]
+    get_user_scores_bulk = handler.score_store.get_user_scores_bulk
+
+    def get_user_scores_bulk_while_unavailable(user_id, chart_ids):
+        fallback_read_count[0] += 1
+        return {chart_id: None for chart_id in chart_ids}
+
+    monkeypatch.setattr(type(handler.score_store), "fallback_read_count", property(lambda _: fallback_read_count[0]))
+    monkeypatch.setattr(handler.score_store, "get_user_scores_bulk", get_user_scores_bulk_while_unavailable)
+    handler.score_store.add_score("player1", handler.all_groups[0].songs[0].charts[0].chart_id, 90.0, 1)
+    assert client.get("/groups/0/personal_bests?user_id=player1").get_json()[0] == [None, None, None]
+
+    # Once the store is reachable again, the personal bests are read again
+    monkeypatch.setattr(handler.score_store, "get_user_scores_bulk", get_user_scores_bulk)
+    assert client.get("/groups/0/personal_bests?user_id=player1").get_json()[0] == [90.0, None, None]
+
+
+def test_audio_range_requests_are_answered_with_partial_content(handler, client):
+    song = handler.all_groups[0].songs[0]
+    response = client.get(f"/assets/{song.song_id}/audio", headers={"Range": "bytes=0-3"})
+    assert response.status_code == 206
+    file_size = os.path.getsize(os.path.join(song.directory, song.audio_file_name))
+    assert response.headers["Content-Range"] == f"bytes 0-3/{file_size}"
+    assert response.data == b"OggS"
+    response.close()
+
+
+def test_assets_are_cached_as_immutable_only_at_their_current_version(handler, client):
+    group, song = handler.all_groups[0], handler.all_groups[0].songs[0]
+    version = get_file_version(os.path.join(handler.root_directory, handler.get_file_path(group, song, "jacket")))
+    assert handler.generate_file_url(0, 0, "jacket").endswith(f"/assets/{song.song_id}/jacket?v={version}")
+
+    response = client.get(f"/assets/{song.song_id}/jacket?v={version}")
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == handler.config.http_asset_max_age_seconds
+    assert not response.cache_control.no_cache
+    response.close()
+
+    # A URL generated before the file changed is revalidated
+    response = client.get(f"/assets/{song.song_id}/jacket?v=0-0")
+    assert not response.cache_control.immutable
+    assert response.cache_control.no_cache
+    response.close()
+
+    assert client.get(f"/assets/{song.song_id}/lyrics").status_code == 404
+
+
+def test_matching_if_none_match_is_answered_without_building_the_body(handler):
+    built_bodies = []
+
+    def make_body():
+        built_bodies.append(True)
+        return "body"
+
+    with handler.app.test_request_context(headers={"If-None-Match": '"catalog-1"'}):
+        response = handler.conditional_response("catalog-1", make_body)
+    assert response.status_code == 304
+    assert response.get_etag() == ("catalog-1", False)
+    assert built_bodies == []
+
+    with handler.app.test_request_context(headers={"If-None-Match": '"catalog-0"'}):
+        response = handler.conditional_response("catalog-1", make_body)
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == "body"
+    assert built_bodies == [True]
+
+
+def test_catalog_etag_changes_after_a_rescan(handler, client, song_library):
+    response = client.get("/catalog")
+    etag = response.headers["ETag"]
+    assert client.get("/catalog", headers={"If-None-Match": etag}).status_code == 304
+
+    song = handler.all_groups[0].songs[0]
+    with open(os.path.join(song.directory, song.sm_file_name), "a") as f:
+        f.write("\n")
+    handler.rescan_changed_groups({os.path.join(song_library, "Group 0")})
+
+    response = client.get("/catalog", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_settings_saved_through_another_worker_are_not_served_from_the_cache(monkeypatch, handler, client):
+    invalidated_user_ids = []
+    monkeypatch.setattr(handler.score_store, "invalidate_cached_user_settings", invalidated_user_ids.append)
+    assert client.post("/db/settings?user_id=player1&scroll_speed=1.5").status_code == 200
+    assert client.get("/db/settings?user_id=player1").get_json()["scroll_speed"] == 1.5
+    assert client.get("/db/settings?user_id=player1").status_code == 200
+    assert invalidated_user_ids == ["player1"]
+
+    # What another server worker does when the user saves their settings through it
+    handler.score_store.save_user_settings({"user_id": "player1", "scroll_speed": 2.0})
+    handler.sqlite_db_connector.record_settings_change("player1")
+
+    assert client.get("/db/settings?user_id=player1").get_json()["scroll_speed"] == 2.0
+    assert invalidated_user_ids == ["player1", "player1"]
@@ -0,0 +1,36 @@
+from modules.Music.Group import find_songs
+from modules.SQLiteConnector import SQLiteConnector
+
+
+# ---------------------
+# Helpers
+def ingest(db_path, score_store, song_library, ingest_workers):
+    """
+    :return: The groups found in the song library, as tuples of plain values that do not depend on the GUIDs.
+    """
+    connector = SQLiteConnector(db_path=db_path, score_store=score_store)
+    try:
+        groups, _, _ = find_songs(song_library, connector, ingest_workers=ingest_workers)
+        return [(group.name,
+                 [(song.title, song.artist, song.duration, song.offset, song.sample_start, song.sample_length,
+                   song.min_bpm, song.max_bpm, song.details, song.chart_levels,
+                   [(chart.mode, chart.difficulty_name, chart.difficulty_level, chart.note_count,
+                     chart.beats_as_resonite_string) for chart in song.charts])
+                  for song in group.songs])
+                for group in groups]
+    finally:
+        connector.close()
+
+
+# ---------------------
+# TESTS
+def test_parallel_ingest_matches_serial_ingest(tmp_path, score_store, song_library):
+    serially_ingested_groups = ingest(str(tmp_path / "serial.db"), score_store, song_library, ingest_workers=1)
+    parallel_ingested_groups = ingest(str(tmp_path / "parallel.db"), score_store, song_library, ingest_workers=2)
+
+    assert [len(songs) for _, songs in serially_ingested_groups] == [2, 2]
+    assert all(chart[-1] for _, songs in serially_ingested_groups for song in songs for chart in song[-1])
+    assert parallel_ingested_groups == serially_ingested_groups
+
+    # Loading the songs stored by the parallel ingest gives the same songs again
+    assert ingest(str(tmp_path / "parallel.db"), score_store, song_library, ingest_workers=2) == serially_ingested_groups
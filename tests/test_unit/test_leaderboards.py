@@ -0,0 +1,70 @@
+from modules.Leaderboards import ChartLeaderboard, Leaderboards
+
+
+# ---------------------
+# Helpers
+def build_score(user_id, percentage_score, timestamp):
+    return {"user_id": user_id, "chart_guid": "chart1", "percentage_score": percentage_score, "timestamp": timestamp}
+
+
+def build_leaderboards(scores):
+    load_calls = []
+
+    def load_chart_scores(chart_guid):
+        load_calls.append(chart_guid)
+        return list(scores)
+
+    return Leaderboards(load_chart_scores=load_chart_scores, max_age_seconds=60), load_calls
+
+
+# ---------------------
+# TESTS
+def test_ranks_by_score_then_earliest_timestamp():
+    leaderboard = ChartLeaderboard("chart1", [build_score("late", 90.0, 20),
+                                              build_score("best", 99.0, 30),
+                                              build_score("early", 90.0, 10)])
+
+    assert [score["user_id"] for score in leaderboard.get_scores(0, 10)] == ["best", "early", "late"]
+    assert leaderboard.get_rank("late") == 3
+    assert leaderboard.get_rank("nobody") is None
+
+
+def test_record_score_replaces_the_users_score():
+    leaderboard = ChartLeaderboard("chart1", [build_score("a", 90.0, 1), build_score("b", 80.0, 2)])
+
+    leaderboard.record_score("b", 95.0, 3)
+
+    assert len(leaderboard) == 2
+    assert leaderboard.get_rank("b") == 1
+    assert leaderboard.get_scores(0, 1)[0] == {"rank": 1, "user_id": "b", "chart_guid": "chart1",
+                                               "percentage_score": 95.0, "timestamp": 3}
+
+
+def test_get_rank_with_neighbours():
+    leaderboards, _ = build_leaderboards([build_score(f"user{i}", 100.0 - i, i) for i in range(10)])
+
+    user_rank = leaderboards.get_rank("chart1", "user0", neighbour_count=2)
+
+    assert user_rank["rank"] == 1
+    assert user_rank["total"] == 10
+    assert [score["rank"] for score in user_rank["scores"]] == [1, 2, 3]
+    assert [score["rank"] for score in leaderboards.get_rank("chart1", "user5", 2)["scores"]] == [4, 5, 6, 7, 8]
+    assert leaderboards.get_rank("chart1", "nobody") is None
+
+
+def test_leaderboard_is_loaded_once_and_updated_by_record_score():
+    leaderboards, load_calls = build_leaderboards([build_score("a", 90.0, 1)])
+
+    leaderboards.get_top_scores("chart1")
+    leaderboards.record_score("chart1", "b", 95.0, 2)
+
+    assert [score["user_id"] for score in leaderboards.get_top_scores("chart1")] == ["b", "a"]
+    assert load_calls == ["chart1"]
+
+
+def test_record_score_on_an_unloaded_leaderboard_does_not_load_it():
+    leaderboards, load_calls = build_leaderboards([])
+
+    leaderboards.record_score("chart1", "a", 90.0, 1)
+
+    assert load_calls == []
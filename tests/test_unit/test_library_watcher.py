@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+import pytest
+
+from modules.LibraryWatcher import LibraryWatcher, Observer
+
+
+class ChangedGroupsRecorder:
+    def __init__(self):
+        self.calls = []
+        self.called = threading.Event()
+
+    def __call__(self, changed_group_directory_paths):
+        self.calls.append(changed_group_directory_paths)
+        self.called.set()
+
+
+# ---------------------
+# Helpers
+@pytest.fixture
+def root_directory(tmp_path):
+    for group_name in ("Group A", "Group B"):
+        (tmp_path / group_name / "Song").mkdir(parents=True)
+        (tmp_path / group_name / "Song" / "song.sm").write_text("#TITLE:Song;")
+    return str(tmp_path)
+
+
+# ---------------------
+# TESTS
+def test_paths_are_mapped_to_their_group(root_directory):
+    watcher = LibraryWatcher(root_directory, on_groups_changed=ChangedGroupsRecorder())
+
+    song_directory_path = os.path.join(root_directory, "Group A", "Song")
+    assert watcher.get_group_directory_path(os.path.join(song_directory_path, "song.sm")) == \
+        os.path.join(root_directory, "Group A")
+    assert watcher.get_group_directory_path(os.path.join(root_directory, "Group B")) == \
+        os.path.join(root_directory, "Group B")
+    assert watcher.get_group_directory_path(os.path.join(root_directory, "ignore", "Song", "song.sm")) is None
+    assert watcher.get_group_directory_path(root_directory) is None
+    assert watcher.get_group_directory_path(os.path.dirname(root_directory)) is None
+
+
+def test_files_written_by_the_server_are_ignored(root_directory):
+    converted_audio_path = os.path.join(root_directory, "Group A", "Song", "song.ogg")
+    watcher = LibraryWatcher(root_directory, on_groups_changed=ChangedGroupsRecorder(),
+                             ignore_path=lambda path: path == converted_audio_path)
+
+    song_directory_path = os.path.join(root_directory, "Group A", "Song")
+    for file_name in ("reso-dmx-sample.ogg", "reso-dmx-sample.ogg.part", "song.ogg.part", "song.ogg"):
+        assert watcher.get_group_directory_path(os.path.join(song_directory_path, file_name)) is None
+    assert watcher.get_group_directory_path(os.path.join(song_directory_path, "other.ogg")) is not None
+
+
+def test_polling_snapshot_ignores_files_written_by_the_server(root_directory):
+    watcher = LibraryWatcher(root_directory, on_groups_changed=ChangedGroupsRecorder(), use_polling=True)
+    snapshot = watcher._take_snapshot()
+
+    song_directory_path = os.path.join(root_directory, "Group A", "Song")
+    with open(os.path.join(song_directory_path, "song.ogg.part"), "wb") as f:
+        f.write(b"OggS")
+    with open(os.path.join(song_directory_path, "reso-dmx-sample.ogg"), "wb") as f:
+        f.write(b"OggS")
+    assert watcher._take_snapshot() == snapshot
+
+    with open(os.path.join(song_directory_path, "song.sm"), "a") as f:
+        f.write("\n#ARTIST:Artist;")
+    new_snapshot = watcher._take_snapshot()
+    assert new_snapshot[os.path.join(root_directory, "Group A")] != snapshot[os.path.join(root_directory, "Group A")]
+    assert new_snapshot[os.path.join(root_directory, "Group B")] == snapshot[os.path.join(root_directory, "Group B")]
+
+
+@pytest.mark.skipif(Observer is None, reason="watchdog is not installed")
+def test_changes_are_debounced_into_one_callback(root_directory):
+    recorder = ChangedGroupsRecorder()
+    watcher = LibraryWatcher(root_directory, on_groups_changed=recorder, debounce_seconds=0.3)
+    watcher.start()
+    try:
+        # A burst of changes, as when a pack is copied, with gaps shorter than the debounce delay
+        for group_name in ("Group A", "Group B", "Group A"):
+            watcher.mark_path_changed(os.path.join(root_directory, group_name, "Song", "song.sm"))
+            time.sleep(0.1)
+        watcher.mark_path_changed(os.path.join(root_directory, "Group A", "Song", "song.ogg.part"))
+        assert recorder.called.wait(timeout=5)
+        time.sleep(0.5)
+    finally:
+        watcher.stop()
+
+    assert recorder.calls == [{os.path.join(root_directory, "Group A"), os.path.join(root_directory, "Group B")}]
+
+
+@pytest.mark.skipif(Observer is None, reason="watchdog is not installed")
+def test_partial_files_do_not_trigger_a_rescan(root_directory):
+    recorder = ChangedGroupsRecorder()
+    watcher = LibraryWatcher(root_directory, on_groups_changed=recorder, debounce_seconds=0.2)
+    watcher.start()
+    try:
+        part_path = os.path.join(root_directory, "Group B", "Song", "reso-dmx-sample.ogg.part")
+        with open(part_path, "wb") as f:
+            f.write(b"OggS")
+        os.replace(part_path, os.path.join(root_directory, "Group B", "Song", "reso-dmx-sample.ogg"))
+        assert not recorder.called.wait(timeout=1.5)
+
+        with open(os.path.join(root_directory, "Group A", "Song", "song.sm"), "a") as f:
+            f.write("\n")
+        assert recorder.called.wait(timeout=5)
+    finally:
+        watcher.stop()
+
+    assert recorder.calls == [{os.path.join(root_directory, "Group A")}]
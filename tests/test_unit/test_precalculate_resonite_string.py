@@ -0,0 +1,75 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from modules.Music.Beat import precalculate_beats, get_beats_as_resonite_string, precalculate_resonite_string
+
+
+# ---------------------
+# Helper: Build a random chart with the given number of arrows per note row
+def build_measures(rng, n_measures, n_arrows):
+    measures = []
+    for _ in range(n_measures):
+        n_note_rows = rng.choice([1, 3, 4, 8, 12, 16, 24, 48, 64, 192])
+        measures.append([''.join(rng.choice('00000000123M4') for _ in range(n_arrows)) for _ in range(n_note_rows)])
+    return measures
+
+
+def build_song(rng, bpm_changes, stops, offset):
+    bpms = [[0.0, rng.uniform(60, 300)]]
+    bpms += sorted([[rng.choice([rng.uniform(0, 400), float(rng.randint(0, 400))]), rng.uniform(30, 400)]
+                    for _ in range(bpm_changes)])
+    stop_list = [(rng.choice([rng.uniform(0, 400), float(rng.randint(0, 400))]), rng.uniform(0, 2))
+                 for _ in range(stops)]
+    return SimpleNamespace(bpms=bpms, stops=stop_list, offset=offset, duration=240.0)
+
+
+def assert_engines_match(song, chart):
+    for exclude_inactive_beats in (True, False):
+        beats, note_count = precalculate_beats(song=song, chart=chart, exclude_inactive_beats=exclude_inactive_beats)
+        expected = get_beats_as_resonite_string(beats)
+        resonite_string, vectorized_note_count = precalculate_resonite_string(
+            song=song, chart=chart, exclude_inactive_beats=exclude_inactive_beats)
+        assert resonite_string == expected
+        assert vectorized_note_count == note_count
+
+
+# ---------------------
+# TESTS
+def test_constant_bpm():
+    rng = random.Random(0)
+    song = build_song(rng, bpm_changes=0, stops=0, offset=-0.05)
+    assert_engines_match(song, SimpleNamespace(measures=build_measures(rng, 80, 4)))
+
+
+def test_bpm_changes_and_stops():
+    rng = random.Random(1)
+    for _ in range(50):
+        song = build_song(rng, bpm_changes=rng.randint(0, 10), stops=rng.randint(0, 10), offset=rng.uniform(-2, 2))
+        assert_engines_match(song, SimpleNamespace(measures=build_measures(rng, rng.randint(1, 100), 4)))
+
+
+def test_stop_on_bpm_change():
+    song = SimpleNamespace(bpms=[[0.0, 120.0], [8.0, 240.0]], stops=[(8.0, 0.5), (8.0, 0.25)], offset=0.0, duration=60.0)
+    chart = SimpleNamespace(measures=[['1000', '0100', '0010', '0001']] * 4)
+    assert_engines_match(song, chart)
+
+
+def test_double_chart():
+    rng = random.Random(2)
+    song = build_song(rng, bpm_changes=3, stops=2, offset=0.1)
+    assert_engines_match(song, SimpleNamespace(measures=build_measures(rng, 60, 8)))
+
+
+def test_empty_chart():
+    song = SimpleNamespace(bpms=[[0.0, 120.0]], stops=[], offset=0.0, duration=60.0)
+    assert precalculate_resonite_string(song=song, chart=SimpleNamespace(measures=[]), exclude_inactive_beats=True) == ("", 0)
+
+
+def test_zero_duration_raises():
+    song = SimpleNamespace(bpms=[[0.0, 120.0]], stops=[], offset=0.0, duration=0.0)
+    with pytest.raises(ZeroDivisionError):
+        precalculate_resonite_string(song=song, chart=SimpleNamespace(measures=[['1000']]), exclude_inactive_beats=True)
@@ -0,0 +1,36 @@
+from modules.Music.Beat import find_resonite_record_index
+from modules.Music.Chart import Chart
+
+
+# ---------------------
+# Helpers
+def build_chart(times, mode="dance-single"):
+    arrows = "1000" if mode == "dance-single" else "10000000"
+    chart = Chart(chart_id="chart", mode=mode, difficulty_name="Hard", difficulty_level=5)
+    chart.beats_as_resonite_string = "".join(f"{time:012.7f}{arrows}004" for time in times)
+    return chart
+
+
+# ---------------------
+# TESTS
+def test_find_record_index_by_time():
+    chart = build_chart([0.5, 1.0, 1.0, 2.5])
+    record_width = chart.resonite_record_width
+    assert record_width == 19
+    assert [find_resonite_record_index(chart.beats_as_resonite_string, record_width, time)
+            for time in (0.0, 1.0, 1.5, 3.0)] == [0, 1, 3, 4]
+
+
+def test_offset_windows_cover_the_whole_string():
+    chart = build_chart([i * 0.25 for i in range(10)], mode="dance-double")
+    windows = [chart.get_resonite_string_window(offset=offset, limit=3) for offset in range(0, 12, 3)]
+    assert "".join(window for window, _, _ in windows) == chart.beats_as_resonite_string
+    assert windows[-1][1:] == (9, 10)
+
+
+def test_time_window():
+    chart = build_chart([0.5, 1.0, 1.5, 2.0, 2.5])
+    window, offset, record_count = chart.get_resonite_string_window(start_time=1.0, end_time=2.0)
+    assert (window, offset, record_count) == (chart.beats_as_resonite_string[19:57], 1, 5)
+    assert chart.get_resonite_string_window(start_time=1.0, limit=1)[0] == chart.beats_as_resonite_string[19:38]
+    assert chart.get_resonite_string_window(start_time=3.0)[:2] == ("", 5)
@@ -0,0 +1,120 @@
+import pytest
+
+from modules.ScoreBuffer import ScoreBuffer
+from modules.SQLiteConnector import SQLiteConnector
+
+
+# ---------------------
+# Helpers
+@pytest.fixture
+def connector(tmp_path, score_store):
+    connector = SQLiteConnector(db_path=str(tmp_path / "test.db"), score_store=score_store)
+    yield connector
+    connector.close()
+
+
+# ---------------------
+# TESTS
+def test_submissions_are_coalesced_and_flushed_in_one_bulk_write(connector, score_store):
+    score_buffer = ScoreBuffer(connector, score_store, start=False)
+    score_buffer.add_score("player1", "chart1", 80.0, 1)
+    score_buffer.add_score("player1", "chart1", 90.0, 2)
+    score_buffer.add_score("player2", "chart1", 70.0, 2)
+
+    assert score_store.scores == {}
+    assert score_buffer.get_user_score("player1", "chart1")["percentage_score"] == 90.0
+    assert score_buffer.get_user_scores_bulk("player2", ["chart1", "chart2"]) == {"chart1": 70.0, "chart2": None}
+
+    assert score_buffer.flush() == 2
+    assert score_store.bulk_write_count == 1
+    assert score_store.scores == {("player1", "chart1"): 90.0, ("player2", "chart1"): 70.0}
+    assert connector.count_pending_scores() == 0
+    # Other server workers are told to read the scores of these users again
+    assert (connector.get_score_revision("player1"), connector.get_score_revision("player2")) == (1, 1)
+    assert connector.get_score_revision("player3") == 0
+
+
+def test_failed_flush_keeps_scores_spooled(tmp_path, connector, score_store):
+    score_buffer = ScoreBuffer(connector, score_store, start=False)
+    score_buffer.add_score("player1", "chart1", 80.0, 1)
+    score_store.fail = True
+    with pytest.raises(ConnectionError):
+        score_buffer.flush()
+
+    # A new buffer on the same spool, as after a restart, writes the scores
+    score_store.fail = False
+    restarted_connector = SQLiteConnector(db_path=str(tmp_path / "test.db"), score_store=score_store)
+    assert ScoreBuffer(restarted_connector, score_store, start=False).flush() == 1
+    assert score_store.scores == {("player1", "chart1"): 80.0}
+    restarted_connector.close()
+
+
+def test_score_replaced_during_flush_is_kept(connector, score_store):
+    connector.upsert_pending_score("player1", "chart1", 80.0, 1)
+    read_scores = connector.get_pending_scores()
+    connector.upsert_pending_score("player1", "chart1", 95.0, 2)
+    connector.delete_pending_scores(read_scores)
+    assert [score["percentage_score"] for score in connector.get_pending_scores()] == [95.0]
+
+
+def test_score_resubmitted_during_another_workers_flush_is_written_last(tmp_path, connector, score_store):
+    # Two server workers sharing the spool
+    other_connector = SQLiteConnector(db_path=str(tmp_path / "test.db"), score_store=score_store)
+    score_buffer = ScoreBuffer(connector, score_store, start=False)
+    other_score_buffer = ScoreBuffer(other_connector, score_store, start=False)
+    score_buffer.add_score("player1", "chart1", 90.0, 1)
+
+    def resubmit_and_flush_in_the_other_worker():
+        other_score_buffer.add_score("player1", "chart1", 80.0, 2)
+        # The resubmitted score stays claimed by the flush that is still writing the previous one
+        assert other_score_buffer.flush() == 0
+
+    score_store.before_bulk_write = resubmit_and_flush_in_the_other_worker
+    assert score_buffer.flush() == 1
+    assert score_store.scores == {("player1", "chart1"): 90.0}
+
+    assert other_score_buffer.flush() == 1
+    assert score_store.scores == {("player1", "chart1"): 80.0}
+    assert connector.count_pending_scores() == 0
+    other_connector.close()
+
+
+def test_claims_of_a_flush_that_never_finished_expire(connector, score_store):
+    connector.upsert_pending_score("player1", "chart1", 80.0, 1)
+    assert len(connector.claim_pending_scores("killed-worker", limit=10, claim_timeout_seconds=300)) == 1
+
+    assert ScoreBuffer(connector, score_store, start=False).flush() == 0
+    assert ScoreBuffer(connector, score_store, claim_timeout_seconds=0, start=False).flush() == 1
+    assert score_store.scores == {("player1", "chart1"): 80.0}
+
+
+def test_threshold_triggers_flush_thread(connector, score_store):
+    score_buffer = ScoreBuffer(connector, score_store, flush_interval_seconds=60, flush_threshold=2)
+    score_buffer.add_score("player1", "chart1", 80.0, 1)
+    score_buffer.add_score("player1", "chart2", 85.0, 1)
+    for _ in range(100):
+        if score_store.scores:
+            break
+        score_buffer._stop_event.wait(0.05)
+    score_buffer.stop()
+    assert score_store.scores == {("player1", "chart1"): 80.0, ("player1", "chart2"): 85.0}
+
+
+def test_without_write_behind_scores_are_only_spooled_while_unavailable(connector, score_store):
+    score_buffer = ScoreBuffer(connector, score_store, write_behind=False, start=False)
+    score_buffer.add_score("player1", "chart1", 80.0, 1)
+    assert score_store.scores == {("player1", "chart1"): 80.0}
+    assert connector.count_pending_scores() == 0
+
+    score_store.unavailable = True
+    score_buffer.add_score("player1", "chart2", 85.0, 2)
+    score_buffer.add_score("player1", "chart3", 60.0, 2)
+    assert connector.count_pending_scores() == 2
+    assert score_buffer.get_user_score("player1", "chart2")["percentage_score"] == 85.0
+
+    # A direct write replaces the spooled score, so the flush does not overwrite it
+    score_store.unavailable = False
+    score_buffer.add_score("player1", "chart3", 90.0, 3)
+    assert score_buffer.flush() == 1
+    assert score_store.scores == {("player1", "chart1"): 80.0, ("player1", "chart2"): 85.0,
+                                     ("player1", "chart3"): 90.0}
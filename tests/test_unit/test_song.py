@@ -0,0 +1,36 @@
+from modules.Music.Chart import Chart
+from modules.Music.Song import Song, CHART_BLOCK_WIDTH, format_personal_best
+
+
+# ---------------------
+# Helpers
+def build_song(tmp_path):
+    (tmp_path / "song.ogg").write_bytes(b"OggS")
+    song = Song(song_id="song", name="Song", audio_file="song.ogg", directory=str(tmp_path), sm_file="song.sm")
+    song.title, song.artist, song.min_bpm, song.max_bpm = "Title", "Artist", 120.0, 180.0
+    song.set_duration(90)
+    song.charts = [Chart(chart_id=f"chart-{level}", mode="dance-single", difficulty_name="Hard", difficulty_level=level,
+                         note_count=level * 100) for level in (4, 12)]
+    song.render_response_strings()
+    return song
+
+
+# ---------------------
+# TESTS
+def test_format_personal_best():
+    assert [format_personal_best(score) for score in (None, 54.5, 100)] == ["00.00%", "54.50%", "100%"]
+
+
+def test_rendered_strings_match_renderers(tmp_path):
+    song = build_song(tmp_path)
+    assert song.details == song.get_details() == "Title\nArtist\nBPM Range: 120 - 180\nDuration: 1:30"
+    assert song.chart_levels == "4/12"
+
+
+def test_personal_bests_are_spliced_into_chart_blocks(tmp_path):
+    song = build_song(tmp_path)
+    blocks = song.get_chart_blocks({"chart-12": 99.25})
+    assert len(blocks) == 2 * CHART_BLOCK_WIDTH
+    assert blocks[:CHART_BLOCK_WIDTH] == "<b>Lv.  4</b>\n400 Notes\nPB: 00.00%".ljust(CHART_BLOCK_WIDTH)
+    assert blocks[CHART_BLOCK_WIDTH:].rstrip() == "<b>Lv. 12</b>\n1200 Notes\nPB: 99.25%"
+    assert song.chart_blocks_without_personal_bests == song.get_chart_blocks({})
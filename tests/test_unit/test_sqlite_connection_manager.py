@@ -0,0 +1,41 @@
+import threading
+
+from modules.SQLiteConnectionManager import SQLiteConnectionManager
+
+
+# ---------------------
+# TESTS
+def test_connection_per_thread(tmp_path):
+    manager = SQLiteConnectionManager(str(tmp_path / "test.db"))
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(manager.connection))
+    thread.start()
+    thread.join()
+
+    assert manager.connection is manager.connection
+    assert connections[0] is not manager.connection
+    assert manager.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    manager.close_all()
+
+
+def test_reader_sees_committed_state_while_writer_is_open(tmp_path):
+    manager = SQLiteConnectionManager(str(tmp_path / "test.db"))
+    manager.connection.execute("CREATE TABLE t (x INTEGER)")
+    manager.connection.commit()
+
+    writing, finish = threading.Event(), threading.Event()
+
+    def write():
+        manager.connection.execute("INSERT INTO t VALUES (1)")
+        writing.set()
+        finish.wait()
+        manager.connection.commit()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writing.wait()
+    assert manager.connection.execute("SELECT count(*) FROM t").fetchone()[0] == 0
+    finish.set()
+    writer.join()
+    assert manager.connection.execute("SELECT count(*) FROM t").fetchone()[0] == 1
+    manager.close_all()
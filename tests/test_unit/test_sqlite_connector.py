@@ -0,0 +1,135 @@
+import sqlite3
+
+import pytest
+
+import modules.SQLiteConnector as SQLiteConnectorModule
+from modules.SQLiteConnector import SQLiteConnector
+from modules.utils.CompressionUtils import FORMAT_GZIP, FORMAT_RAW, decompress_text
+
+
+# ---------------------
+# Helpers
+@pytest.fixture
+def connector(tmp_path, score_store):
+    connector = SQLiteConnector(db_path=str(tmp_path / "test.db"), score_store=score_store)
+    yield connector
+    connector.close()
+
+
+def upsert_song(connector, song_guid, group_guid, title="Title"):
+    connector.upsert_song(song_guid=song_guid, group_guid=group_guid, name="Song", title=title,
+                          directory_path="/songs/Group/Song", artist="Artist", sample_start=10.0, sample_length=12.0,
+                          duration=90.0, offset=0.0, bpms=[[0.0, 120.0]], stops=[], chart_guids=[])
+
+
+def chart(chart_guid, song_guid, difficulty_level=5):
+    return {"chart_guid": chart_guid, "song_guid": song_guid, "sm_file_path": "/songs/Group/Song/song.sm",
+            "mode": "dance-single", "difficulty_name": "Hard", "difficulty_level": difficulty_level,
+            "note_count": 100, "beats_as_resonite_string": ""}
+
+
+# ---------------------
+# TESTS
+def test_insert_group_returns_existing_guid(connector):
+    guid = connector.insert_group(name="Group", directory_path="/songs/Group")
+    assert connector.insert_group(name="Group", directory_path="/songs/Group") == guid
+
+
+def test_upsert_song_takes_over_new_guid(score_store, connector):
+    group_guid = connector.insert_group(name="Group", directory_path="/songs/Group")
+    upsert_song(connector, "old-song", group_guid)
+    connector.insert_charts([chart("old-chart", "old-song")])
+    connector.upsert_pending_score("player1", "old-chart", 90.0, 1)
+
+    upsert_song(connector, "new-song", group_guid, title="New Title")
+
+    assert connector.get_song_by_song_guid("old-song") is None
+    assert connector.get_song_by_song_guid("new-song")["title"] == "New Title"
+    # The previous charts are kept until the orphaned records are cleaned up, as they may still be served
+    assert connector.get_chart_notes("old-chart") is not None
+    connector.cleanup_orphaned_records_in_groups({"/songs/Group"}, {"/songs/Group"}, {"/songs/Group/Song"}, set())
+    assert connector.get_charts_by_song_guid("old-song") == []
+    # Their scores are deleted with them
+    assert connector.count_pending_scores() == 0
+    assert score_store.deleted_chart_guids == ["old-chart"]
+
+
+@pytest.mark.parametrize("in_groups", [False, True])
+def test_scores_of_orphaned_charts_are_deleted_after_the_commit(tmp_path, score_store, connector, in_groups):
+    # Whether the song database had committed the deletion of the charts when their scores were deleted
+    deleted_after_commit = []
+
+    def check_deletion_is_committed(chart_guids):
+        conn = sqlite3.connect(str(tmp_path / "test.db"))
+        placeholders = ','.join('?' * len(chart_guids))
+        remaining_chart_count = conn.execute(f"SELECT count(*) FROM charts WHERE guid IN ({placeholders})",
+                                             tuple(chart_guids)).fetchone()[0]
+        conn.close()
+        deleted_after_commit.append(remaining_chart_count == 0)
+
+    score_store.on_delete_scores_for_charts = check_deletion_is_committed
+    group_guid = connector.insert_group(name="Group", directory_path="/songs/Group")
+    upsert_song(connector, "song", group_guid)
+    connector.insert_charts([chart("chart", "song")])
+    connector.upsert_pending_score("player1", "chart", 90.0, 1)
+
+    if in_groups:
+        connector.cleanup_orphaned_records_in_groups({"/songs/Group"}, {"/songs/Group"}, set(), set())
+    else:
+        connector.cleanup_orphaned_records({"/songs/Group"}, set(), set())
+
+    assert score_store.deleted_chart_guids == ["chart"]
+    assert deleted_after_commit == [True]
+    assert connector.count_pending_scores() == 0
+
+
+def test_insert_charts_skips_existing_difficulty(connector):
+    inserted_chart_guids = connector.insert_charts([chart("chart-1", "song"), chart("chart-2", "song"),
+                                                    chart("chart-3", "song", 9)])
+    assert inserted_chart_guids == {"chart-1", "chart-3"}
+    assert [c["guid"] for c in connector.get_charts_by_song_guid("song")] == ["chart-1", "chart-3"]
+
+
+def test_transaction_rolls_back_on_error(connector):
+    with pytest.raises(RuntimeError):
+        with connector.transaction():
+            connector.insert_group(name="Group", directory_path="/songs/Group")
+            connector.insert_or_update_sm_file(song_id="song", path="/songs/Group/Song/song.sm", content="",
+                                               last_modified=1.0)
+            raise RuntimeError()
+
+    assert connector.get_sm_file_last_modified("/songs/Group/Song/song.sm") is None
+    assert connector.conn.execute("SELECT count(*) FROM groups").fetchone()[0] == 0
+
+
+def test_migrates_plain_text_rows_to_compressed_storage(monkeypatch, tmp_path, score_store):
+    # Rows are compressed in several batches
+    monkeypatch.setattr(SQLiteConnectorModule, "MIGRATION_BATCH_SIZE", 2)
+    db_path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript("""
+        CREATE TABLE charts (guid TEXT PRIMARY KEY, song_guid TEXT NOT NULL, path TEXT NOT NULL,
+                             difficulty_name TEXT NOT NULL, difficulty_level INTEGER NOT NULL, mode TEXT,
+                             note_count INTEGER, beats_as_resonite_string TEXT,
+                             UNIQUE(song_guid, difficulty_name, difficulty_level));
+        CREATE TABLE sm_files (path TEXT PRIMARY KEY, song_id TEXT, last_modified REAL NOT NULL, content TEXT NOT NULL);
+        INSERT INTO charts VALUES ('chart', 'song', 'song.sm', 'Hard', 5, 'dance-single', 1, '0001.00000001000016');
+        INSERT INTO charts VALUES ('chart-2', 'song', 'song.sm', 'Hard', 6, 'dance-single', 1, '0001.00000001000016');
+        INSERT INTO charts VALUES ('chart-3', 'song', 'song.sm', 'Hard', 7, 'dance-single', 1, '0001.00000001000016');
+        INSERT INTO sm_files VALUES ('song.sm', 'song', 1.0, '#TITLE:Song;');
+        INSERT INTO sm_files VALUES ('song-2.sm', 'song-2', 1.0, '#TITLE:Song 2;');
+        INSERT INTO sm_files VALUES ('song-3.sm', 'song-3', 1.0, '#TITLE:Song 3;');
+    """)
+    conn.commit()
+    conn.close()
+
+    connector = SQLiteConnector(db_path=db_path, score_store=score_store)
+
+    # Chart strings are stored in a format they can be served with
+    assert connector.conn.execute("SELECT count(*) FROM charts WHERE beats_format != ?", (FORMAT_GZIP,)).fetchone()[0] == 0
+    assert connector.conn.execute("SELECT count(*) FROM sm_files WHERE content_format = ?", (FORMAT_RAW,)).fetchone()[0] == 0
+    assert connector.get_sm_files_for_paths(["song.sm"])["song.sm"]["content"] == "#TITLE:Song;"
+    assert connector.get_sm_files_for_paths(["song-3.sm"])["song-3.sm"]["content"] == "#TITLE:Song 3;"
+    chart_info = connector.get_charts_by_song_guid("song")[0]
+    assert decompress_text(chart_info["compressed_beats_as_resonite_string"], chart_info["beats_format"]) == "0001.00000001000016"
+    connector.close()
@@ -0,0 +1,64 @@
+import pytest
+
+from modules.SQLiteScoreStore import SQLiteScoreStore
+from modules.ScoreStoreMigration import copy_score_store
+
+
+# ---------------------
+# Helpers
+def build_score(user_id, chart_guid, percentage_score, timestamp):
+    return {"user_id": user_id, "chart_guid": chart_guid, "percentage_score": percentage_score, "timestamp": timestamp}
+
+
+@pytest.fixture
+def score_store(tmp_path):
+    score_store = SQLiteScoreStore(str(tmp_path / "scores.db"))
+    yield score_store
+    score_store.close()
+
+
+# ---------------------
+# TESTS
+def test_add_score_overwrites_the_users_score(score_store):
+    score_store.add_score("player1", "chart1", 80.0, 1)
+    score_store.add_score("player1", "chart1", 70.0, 2)
+
+    assert score_store.get_user_score("player1", "chart1") == build_score("player1", "chart1", 70.0, 2)
+    assert score_store.get_user_score("player1", "chart2") is None
+    assert score_store.get_user_scores_bulk("player1", ["chart1", "chart2"]) == {"chart1": 70.0, "chart2": None}
+
+
+def test_top_scores_are_ordered_by_score_then_timestamp(score_store):
+    score_store.add_scores_bulk([build_score("late", "chart1", 90.0, 20),
+                                 build_score("best", "chart1", 99.0, 30),
+                                 build_score("early", "chart1", 90.0, 10),
+                                 build_score("other_chart", "chart2", 100.0, 10)])
+
+    assert [score["user_id"] for score in score_store.get_top_scores("chart1", limit=2)] == ["best", "early"]
+    assert [score["user_id"] for score in score_store.get_chart_scores("chart1")] == ["best", "early", "late"]
+
+    score_store.delete_scores_for_charts(["chart1"])
+    assert score_store.get_chart_scores("chart1") == []
+    assert len(score_store.get_chart_scores("chart2")) == 1
+
+
+def test_saved_settings_are_merged(score_store):
+    score_store.save_user_settings({"user_id": "player1", "scroll_speed": 1.5, "controller_buttons": {"button_0": "A"}})
+    score_store.save_user_settings({"user_id": "player1", "noteskin": "default"})
+
+    assert score_store.get_user_settings("player1") == {"user_id": "player1", "scroll_speed": 1.5,
+                                                        "controller_buttons": {"button_0": "A"}, "noteskin": "default"}
+    assert score_store.get_user_settings("player2") is None
+
+
+def test_copy_score_store(tmp_path, score_store):
+    score_store.add_scores_bulk([build_score(f"player{i}", "chart1", 50.0 + i, i) for i in range(5)])
+    score_store.save_user_settings({"user_id": "player1", "scroll_speed": 2.0})
+    destination = SQLiteScoreStore(str(tmp_path / "destination.db"))
+    destination.add_score("player0", "chart1", 10.0, 0)
+
+    assert copy_score_store(score_store, destination, batch_size=2) == (5, 1)
+    assert sorted(destination.iter_scores(), key=lambda score: score["user_id"]) == \
+        sorted(score_store.iter_scores(), key=lambda score: score["user_id"])
+    assert destination.get_user_settings("player1") == {"user_id": "player1", "scroll_speed": 2.0}
+    destination.close()
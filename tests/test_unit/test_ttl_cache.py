@@ -0,0 +1,125 @@
+from modules.utils import TTLCache as TTLCacheModule
+from modules.utils.TTLCache import TTLCache, MISSING
+from modules.MongoDBClient import MongoDBClient
+from modules.ScoreStore import ScoreStoreUnavailableError
+from modules.utils.CircuitBreaker import CircuitBreaker
+
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.query_count = 0
+
+    def find_one(self, query):
+        self.query_count += 1
+        return next((document for document in self.documents if all(document.get(key) == value
+                                                                      for key, value in query.items())), None)
+
+    def update_one(self, query, update, upsert=False):
+        self.documents = [document for document in self.documents if document["user_id"] != query["user_id"]]
+        self.documents.append(update["$set"])
+
+
+# ---------------------
+# Helpers
+def build_mongodb_client(settings_documents, score_documents=()):
+    # Skips __init__, which connects to the cluster
+    mongodb_client = MongoDBClient.__new__(MongoDBClient)
+    mongodb_client.settings_cache = TTLCache(ttl_seconds=300)
+    mongodb_client.scores_cache = TTLCache(ttl_seconds=60)
+    mongodb_client._fallback_read_count = 0
+    mongodb_client.circuit_breaker = CircuitBreaker("MongoDB")
+    mongodb_client.settings_collection = FakeCollection(settings_documents)
+    mongodb_client.scores_collection = FakeCollection(list(score_documents))
+    return mongodb_client
+
+
+# ---------------------
+# TESTS
+def test_entries_expire(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(TTLCacheModule.time, "monotonic", lambda: now[0])
+    cache = TTLCache(ttl_seconds=10)
+    cache.set("user", None)
+    assert cache.get("user") is None
+    now[0] += 10
+    assert cache.get("user") is MISSING
+    assert (cache.stats["hits"], cache.stats["misses"]) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert [cache.get(key) for key in "abc"] == [1, MISSING, 3]
+    assert cache.stats["evictions"] == 1
+
+
+def test_value_loaded_before_an_invalidation_is_not_cached():
+    cache = TTLCache()
+
+    def load_then_invalidate():
+        cache.invalidate("user")
+        return "stale"
+
+    assert cache.get_or_load("user", load_then_invalidate) == "stale"
+    assert cache.get("user") is MISSING
+    assert cache.get_or_load("user", lambda: "fresh") == "fresh"
+    assert cache.get("user") == "fresh"
+
+
+def test_invalidate_where_drops_matching_keys_only():
+    cache = TTLCache()
+    cache.set(("player1", "chart1"), 1)
+    cache.set(("player1", "chart2"), 2)
+    cache.set(("player2", "chart1"), 3)
+    cache.invalidate_where(lambda key: key[0] == "player1")
+    assert [cache.get(key) for key in [("player1", "chart1"), ("player1", "chart2"), ("player2", "chart1")]] == \
+           [MISSING, MISSING, 3]
+
+
+def test_settings_are_read_through_and_invalidated_on_write():
+    mongodb_client = build_mongodb_client([{"user_id": "player1", "scroll_speed": 1.5}])
+    assert mongodb_client.get_user_settings("player1")["scroll_speed"] == 1.5
+    assert mongodb_client.get_user_settings("player1")["scroll_speed"] == 1.5
+    assert mongodb_client.get_user_settings("player2") is None
+    assert mongodb_client.get_user_settings("player2") is None
+    assert mongodb_client.settings_collection.query_count == 2
+
+    mongodb_client.set_user_settings("player1", 2.0, "default", "0", {}, 0, 0, 500, 50, "up", 0, 0, 0)
+    assert mongodb_client.get_user_settings("player1")["scroll_speed"] == 2.0
+    assert mongodb_client.settings_collection.query_count == 3
+
+    # Saved by another server worker
+    mongodb_client.settings_collection.documents[0] = {"user_id": "player1", "scroll_speed": 2.5}
+    assert mongodb_client.get_user_settings("player1")["scroll_speed"] == 2.0
+    mongodb_client.invalidate_cached_user_settings("player1")
+    assert mongodb_client.get_user_settings("player1")["scroll_speed"] == 2.5
+
+
+def test_user_scores_changed_elsewhere_are_read_again_once_invalidated():
+    mongodb_client = build_mongodb_client([], [{"user_id": "player1", "chart_guid": "chart1", "percentage_score": 80.0}])
+    assert mongodb_client.get_user_score("player1", "chart1")["percentage_score"] == 80.0
+
+    # Another server worker writes a better score
+    mongodb_client.scores_collection.documents[0] = {"user_id": "player1", "chart_guid": "chart1",
+                                                     "percentage_score": 95.0}
+    assert mongodb_client.get_user_score("player1", "chart1")["percentage_score"] == 80.0
+    mongodb_client.invalidate_cached_user_scores("player1")
+    assert mongodb_client.get_user_score("player1", "chart1")["percentage_score"] == 95.0
+    assert mongodb_client.scores_collection.query_count == 2
+
+
+def test_reads_answered_while_unavailable_are_counted(monkeypatch):
+    mongodb_client = build_mongodb_client([])
+
+    def unavailable(operation):
+        raise ScoreStoreUnavailableError("circuit open")
+
+    monkeypatch.setattr(mongodb_client, "_call", unavailable)
+    assert mongodb_client.fallback_read_count == 0
+    assert mongodb_client.get_user_score("player1", "chart1") is None
+    assert mongodb_client.get_user_scores_bulk("player1", ["chart1", "chart2"]) == {"chart1": None, "chart2": None}
+    assert mongodb_client.fallback_read_count == 2
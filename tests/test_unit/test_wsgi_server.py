@@ -0,0 +1,25 @@
+import pytest
+
+import modules.WSGIServer as WSGIServer
+from modules.WSGIServer import select_server
+
+
+# ---------------------
+# TESTS
+def test_auto_prefers_gunicorn_then_waitress(monkeypatch):
+    monkeypatch.setattr(WSGIServer, "BaseApplication", object)
+    monkeypatch.setattr(WSGIServer, "waitress", object())
+    assert select_server("auto") == "gunicorn"
+
+    monkeypatch.setattr(WSGIServer, "BaseApplication", None)
+    assert select_server("auto") == "waitress"
+
+    monkeypatch.setattr(WSGIServer, "waitress", None)
+    assert select_server("auto") == "flask"
+
+
+def test_missing_server_falls_back_to_flask(monkeypatch):
+    monkeypatch.setattr(WSGIServer, "waitress", None)
+    assert select_server("waitress") == "flask"
+    with pytest.raises(ValueError):
+        select_server("uwsgi")